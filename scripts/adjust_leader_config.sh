@@ -16,7 +16,16 @@ count_leader_sequences() {
         return
     fi
 
-    # Count all ZMK_LEADER_SEQUENCE calls that are not commented out
+    # Prefer the preprocessed keymap model: it expands the macros and skips
+    # commented-out blocks, so it counts the sequences that are actually built
+    local model_count
+    if model_count=$(python3 "$SCRIPT_DIR/keymap_model.py" --leader-count 2>/dev/null) && \
+       [[ "$model_count" =~ ^[0-9]+$ ]] && [[ "$model_count" -gt 0 ]]; then
+        echo "$model_count"
+        return
+    fi
+
+    # Fallback: count ZMK_LEADER_SEQUENCE calls that are not commented out
     # This includes both direct calls and macro-generated calls
     local count=0
 
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Asyncio core for the ZMK device tools
+Runs mount, umount, lsblk and lsusb from argument lists (never through a
+shell), each with a timeout and under one process-wide concurrency limit, on a
+shared event loop thread. Cancelling an operation kills its process, and
+temp_mount() unmounts and removes its directory however its block is left, so
+an interrupted scan leaves nothing mounted behind.
+"""
+
+import asyncio
+import concurrent.futures
+import os
+import tempfile
+import threading
+from collections import namedtuple
+from contextlib import asynccontextmanager
+
+from tracing import span
+
+# Constants
+MAX_CONCURRENT = 8  # Subprocesses and blocking probes in flight at once, across all callers
+COMMAND_TIMEOUT = 10.0  # Seconds before a stuck lsblk/lsusb is killed
+MOUNT_TIMEOUT = 15.0  # mount can wait on a slow device (and sudo on a prompt)
+TERMINATE_GRACE = 1.0  # Seconds between SIGTERM and SIGKILL (sudo forwards SIGTERM to its child)
+CLEANUP_TIMEOUT = 20.0  # How long an interrupted caller waits for cancelled work to clean up
+MOUNT_OPTIONS = 'rw,uid=1000,gid=1000'
+
+CommandResult = namedtuple('CommandResult', 'returncode stdout stderr')
+
+_loop = None
+_loop_pid = None
+_loop_thread = None
+_loop_lock = threading.Lock()
+_limit = None
+
+
+def _loop_thread_main(loop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+def get_loop():
+    """The shared event loop, started on a daemon thread on first use (and again after a fork)"""
+    global _loop, _loop_pid, _loop_thread, _limit
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            _limit = asyncio.Semaphore(MAX_CONCURRENT)
+            _loop_thread = threading.Thread(target=_loop_thread_main, args=(_loop,), name='zmk-aio', daemon=True)
+            _loop_thread.start()
+    return _loop
+
+
+def stop_loop():
+    """
+    Stop the shared loop and its thread, for a process about to fork (the zmk
+    daemon) that must not have other threads. The next call starts a new one.
+    """
+    global _loop, _loop_thread
+    with _loop_lock:
+        loop, thread = _loop, _loop_thread
+        if loop is None or _loop_pid != os.getpid():
+            return
+        _loop, _loop_thread = None, None
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def call(coro, timeout=None):
+    """
+    Run a coroutine on the shared loop and wait for its result. If the caller
+    is interrupted (Ctrl-C), the coroutine is cancelled and its cleanup is
+    allowed to finish before the exception propagates.
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        concurrent.futures.wait([future], CLEANUP_TIMEOUT)
+        raise
+
+
+async def _stop(proc):
+    """Terminate a process, escalating to SIGKILL, and reap it"""
+    for signal_process in (proc.terminate, proc.kill):
+        try:
+            signal_process()
+        except ProcessLookupError:
+            break
+        try:
+            await asyncio.wait_for(proc.wait(), TERMINATE_GRACE)
+            return
+        except asyncio.TimeoutError:
+            continue
+    await proc.wait()
+
+
+async def run(argv, timeout=COMMAND_TIMEOUT):
+    """
+    Run a command (a list, no shell) under the concurrency limit. Returns a
+    CommandResult; returncode is None if the command timed out and 127 if it
+    does not exist. Cancelling the caller kills the process.
+    """
+    async with _limit:
+        try:
+            proc = await asyncio.create_subprocess_exec(*argv, stdin=asyncio.subprocess.DEVNULL,
+                                                        stdout=asyncio.subprocess.PIPE,
+                                                        stderr=asyncio.subprocess.PIPE)
+        except FileNotFoundError:
+            return CommandResult(127, '', f"{argv[0]}: command not found")
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            await _stop(proc)
+            return CommandResult(None, '', f"{argv[0]} timed out after {timeout:g}s")
+        except asyncio.CancelledError:
+            await _stop(proc)
+            raise
+        return CommandResult(proc.returncode, stdout.decode(errors='replace'), stderr.decode(errors='replace'))
+
+
+async def to_thread(func, *args):
+    """Run a blocking function (e.g. a FAT read) on a worker thread under the concurrency limit"""
+    async with _limit:
+        return await asyncio.to_thread(func, *args)
+
+
+async def lsblk(columns, timeout=COMMAND_TIMEOUT):
+    """lsblk -b -n -r output as one list of values per device, or None if lsblk is missing or fails"""
+    result = await run(['lsblk', '-b', '-n', '-r', '-o', ','.join(columns)], timeout)
+    if result.returncode != 0:
+        return None
+    rows = []
+    for line in result.stdout.splitlines():
+        values = [value.replace('\\x20', ' ') for value in line.split(' ')]
+        rows.append(values + [''] * (len(columns) - len(values)))
+    return rows
+
+
+async def lsusb(timeout=COMMAND_TIMEOUT):
+    """The text of `lsusb -v`, or '' if it is unavailable"""
+    result = await run(['lsusb', '-v'], timeout)
+    return result.stdout if result.returncode == 0 else ''
+
+
+async def mount(device, mount_point, options=MOUNT_OPTIONS, timeout=MOUNT_TIMEOUT):
+    """sudo mount a device. Returns (ok, stderr)."""
+    with span('mount', device=device):
+        os.makedirs(mount_point, exist_ok=True)
+        result = await run(['sudo', 'mount', '-o', options, device, mount_point], timeout)
+    return result.returncode == 0, result.stderr.strip()
+
+
+async def umount(mount_point, timeout=MOUNT_TIMEOUT):
+    """sudo umount a mount point. Returns (ok, stderr)."""
+    with span('umount'):
+        result = await run(['sudo', 'umount', mount_point], timeout)
+    return result.returncode == 0, result.stderr.strip()
+
+
+@asynccontextmanager
+async def temp_mount(device, prefix='zmk_'):
+    """
+    Mount a device on a fresh directory under /tmp for the duration of the block.
+    Yields the mount point, or None if mounting failed. The volume is unmounted and
+    the directory removed on exit, including when the block is cancelled.
+    """
+    mount_point = tempfile.mkdtemp(prefix=prefix, dir='/tmp')
+    mounted = False
+    try:
+        mounted, _ = await mount(device, mount_point)
+        yield mount_point if mounted else None
+    finally:
+        # Shielded: a second cancellation during teardown must not leave the mount behind.
+        # A mount cancelled mid-way may still have completed, so check rather than trust `mounted`.
+        if mounted or os.path.ismount(mount_point):
+            await asyncio.shield(umount(mount_point))
+        try:
+            os.rmdir(mount_point)
+        except OSError:
+            pass
+
+
+async def first_match(coros, accept):
+    """
+    Run coroutines concurrently and return the first result for which accept(result)
+    is true (or None). As soon as one is accepted, the others are cancelled and their
+    cleanup awaited before returning. Exceptions count as non-matching results.
+    """
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is None and accept(task.result()):
+                    return task.result()
+        return None
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def gather(coros):
+    """Run coroutines concurrently; results in order, exceptions returned in place"""
+    return await asyncio.gather(*coros, return_exceptions=True)
@@ -5,203 +5,108 @@ Extracted from auto-flash to avoid circular imports
 """
 
 import os
-import re
-import subprocess
 import sys
 import time
 import glob
-import shutil
-from pathlib import Path
 
+import aio
+from block_devices import by_mount_point, list_block_devices
+from fat import read_bootloader_info
+from flasher import write_firmware
+from tracing import traced
+from uf2 import open_firmware
+from usb_devices import list_bootloader_devices
+from usb_watch import BootloaderWatcher
 
-def load_device_config():
-    """Load device configuration from ~/.config/zmk/devices.yaml or devices.conf"""
-    config_dir = Path.home() / ".config" / "zmk"
-    yaml_path = config_dir / "devices.yaml"
-    conf_path = config_dir / "devices.conf"
-    devices = {}
-    
-    # Try YAML format first
-    if yaml_path.exists():
-        try:
-            import yaml
-            with open(yaml_path, 'r') as f:
-                config = yaml.safe_load(f)
-                if config:
-                    for serial, device_info in config.items():
-                        # Preserve all existing keys, not just name/type/notes
-                        devices[serial] = dict(device_info)
-                        # Ensure standard keys exist with defaults
-                        devices[serial].setdefault('name', '')
-                        devices[serial].setdefault('type', 'unknown')
-                        devices[serial].setdefault('notes', '')
-            return devices
-        except ImportError:
-            print("PyYAML not found, falling back to conf format")
-        except Exception as e:
-            print(f"Error reading YAML config: {e}, falling back to conf format")
-    
-    # Fall back to conf format
-    if conf_path.exists():
-        with open(conf_path, 'r') as f:
-            for line_num, line in enumerate(f, 1):
-                line = line.strip()
-                if not line or line.startswith('#'):
-                    continue
-                
-                parts = line.split(':', 3)
-                if len(parts) < 2:
-                    print(f"Warning: Invalid format at line {line_num}: {line}")
-                    continue
-                
-                serial = parts[0]
-                friendly_name = parts[1]
-                device_type = parts[2] if len(parts) > 2 else "unknown"
-                notes = parts[3] if len(parts) > 3 else ""
-                
-                devices[serial] = {
-                    'name': friendly_name,
-                    'type': device_type,
-                    'notes': notes
-                }
-        return devices
-    
-    print("No config file found. Create ~/.config/zmk/devices.yaml or ~/.config/zmk/devices.conf")
-    return devices
+RESCAN_INTERVAL = 2.0  # Fallback rescan for volumes mounted by an automounter
 
 
-def get_usb_devices():
-    """Get USB device information using lsusb -v"""
-    try:
-        result = subprocess.run(['lsusb', '-v'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
-        return result.stdout
-    except FileNotFoundError:
-        print("Error: lsusb command not found")
-        return ""
+def detect_bootloader_devices():
+    """
+    Detect devices currently in bootloader mode.
+    Bootloader devices typically show up as USB mass storage devices.
+    """
+    return list_bootloader_devices()
 
 
-def parse_usb_devices(lsusb_output):
-    """Parse lsusb output to extract device information"""
-    devices = []
-    current_device = {}
-    
-    for line in lsusb_output.split('\n'):
-        line = line.strip()
-        
-        if line.startswith('Bus ') and 'Device ' in line:
-            if current_device:
-                devices.append(current_device)
-            current_device = {}
-            # Extract bus and device numbers
-            match = re.search(r'Bus (\d+) Device (\d+)', line)
-            if match:
-                current_device['bus'] = match.group(1).zfill(3)
-                current_device['device'] = match.group(2).zfill(3)
-        
-        elif line.startswith('idVendor'):
-            match = re.search(r'idVendor\s+0x([0-9a-f]+)\s*(.*)', line)
-            if match:
-                current_device['vendor_id'] = match.group(1)
-                current_device['vendor_name'] = match.group(2).strip()
-        
-        elif line.startswith('idProduct'):
-            match = re.search(r'idProduct\s+0x([0-9a-f]+)\s*(.*)', line)
-            if match:
-                current_device['product_id'] = match.group(1)
-                current_device['product_name'] = match.group(2).strip()
-        
-        elif line.startswith('iSerial'):
-            match = re.search(r'iSerial\s+\d+\s+(.+)', line)
-            if match:
-                current_device['serial'] = match.group(1).strip()
-    
-    if current_device:
-        devices.append(current_device)
-    
-    return devices
+def find_available_mass_storage_devices(inventory=None):
+    """
+    Find unmounted mass storage devices that could be bootloaders: small disks
+    on USB, each with the serial of the USB device it belongs to.
+    """
+    if inventory is None:
+        inventory = list_block_devices()
+    return [{
+        'name': disk.name,
+        'path': disk.path,
+        'label': disk.label,
+        'type': 'disk',
+        'serial': disk.usb_serial,
+    } for disk in inventory if disk.could_be_bootloader()]
 
 
-def detect_bootloader_devices():
+def find_bootloader_volumes(found_devices):
     """
-    Detect devices currently in bootloader mode.
-    Bootloader devices typically show up as USB mass storage devices.
+    One inventory pass per scan: bootloader volumes not in found_devices, mounted
+    or not, each with the serial of the USB device its disk belongs to.
+    Returns (volumes, bootloader_devices); found_devices is updated.
     """
-    bootloader_devices = []
+    # First check for already-mounted bootloader devices
+    mounted_devices = [mp for mp in find_bootloader_mount_points() if mp not in found_devices]
+    if mounted_devices:
+        print(f"Found {len(mounted_devices)} new mounted bootloader device(s)")
+        found_devices.update(mounted_devices)
     
-    # Get USB devices
-    lsusb_output = get_usb_devices()
-    if not lsusb_output:
-        return bootloader_devices
+    # Also check for unmounted bootloader devices
+    bootloader_devices = detect_bootloader_devices()
+    # Every disk with its USB serial and mount point, read once
+    inventory = list_block_devices()
+    mounted_disks = by_mount_point(inventory)
     
-    usb_devices = parse_usb_devices(lsusb_output)
+    unmounted_devices = []
+    for ms_device in find_available_mass_storage_devices(inventory):
+        if ms_device['path'] not in found_devices:
+            unmounted_devices.append(ms_device)
+            found_devices.add(ms_device['path'])
     
-    # Look for devices that might be in bootloader mode
-    bootloader_keywords = [
-        'circuitpython', 'uf2', 'bootloader', 'rpi-rp2', 'pico',
-        'adafruit', 'raspberry pi', 'seeed', 'nice!nano'
-    ]
+    new_bootloader_devices = []
+    for device in bootloader_devices:
+        serial = device.serial or (device.vendor_name + device.product_name)
+        if serial and serial not in found_devices:
+            new_bootloader_devices.append(device)
+            found_devices.add(serial)
     
-    for device in usb_devices:
-        vendor_name = device.get('vendor_name', '').lower()
-        product_name = device.get('product_name', '').lower()
-        
-        # Check if device matches bootloader patterns
-        is_bootloader = any(keyword in vendor_name or keyword in product_name 
-                          for keyword in bootloader_keywords)
-        
-        if is_bootloader:
-            # Add device path information for mounting
-            bus = device.get('bus')
-            dev_num = device.get('device')
-            if bus and dev_num:
-                device['usb_path'] = f"/dev/bus/usb/{bus}/{dev_num}"
-            bootloader_devices.append(device)
+    if new_bootloader_devices:
+        print(f"Found {len(new_bootloader_devices)} new USB bootloader device(s)")
+        for device in new_bootloader_devices:
+            vendor = device.vendor_name or 'Unknown'
+            product = device.product_name or 'Unknown'
+            serial = device.serial or 'No serial'
+            print(f"  - {vendor} {product} (Serial: {serial})")
     
-    return bootloader_devices
-
-
-def find_available_mass_storage_devices():
-    """
-    Find unmounted mass storage devices that could be bootloaders.
-    """
-    try:
-        # Use lsblk to find removable block devices
-        result = subprocess.run(['lsblk', '-rno', 'NAME,TYPE,MOUNTPOINT,LABEL'], 
-                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
-        
-        devices = []
-        for line in result.stdout.strip().split('\n'):
-            if not line:
-                continue
-            parts = line.split(None, 3)
-            if len(parts) >= 3:
-                name, device_type, mountpoint = parts[0], parts[1], parts[2]
-                label = parts[3] if len(parts) > 3 else ""
-                
-                # Look for disk devices that are not mounted
-                is_unmounted = (mountpoint == "" or 
-                              (not mountpoint.startswith('/') and not mountpoint.startswith('[')))
-                
-                if (device_type == 'disk' and is_unmounted):
-                    # Skip obvious system disks and swap
-                    if (name.startswith('nvme') or 
-                        name in ['sda', 'zram0'] or
-                        'SWAP' in str(label) or
-                        'luks-' in name):
-                        continue
-                    device_path = f"/dev/{name}"
-                    devices.append({
-                        'name': name,
-                        'path': device_path,
-                        'label': label,
-                        'type': device_type
-                    })
-        
-        return devices
-        
-    except FileNotFoundError:
-        print("Warning: lsblk not found, cannot detect unmounted devices")
-        return []
+    if unmounted_devices:
+        print(f"Found {len(unmounted_devices)} new unmounted mass storage device(s)")
+        for device in unmounted_devices:
+            print(f"  - {device['path']} (Label: {device['label'] or 'No label'})")
+    
+    volumes = []
+    for mount_point in mounted_devices:
+        disk = mounted_disks.get(os.path.realpath(mount_point))
+        volumes.append({
+            'type': 'mounted',
+            'mount_point': mount_point,
+            'device_path': disk.path if disk else None,
+            'serial': disk.usb_serial if disk else None
+        })
+    for device in unmounted_devices:
+        volumes.append({
+            'type': 'unmounted',
+            'mount_point': None,
+            'device_path': device['path'],
+            'label': device.get('label', ''),
+            'serial': device.get('serial')
+        })
+    return volumes, bootloader_devices
 
 
 def find_bootloader_mount_points():
@@ -265,16 +170,13 @@ def flash_device(mount_point, firmware_file, device_name=None):
         print(f"❌ Firmware file not found: {firmware_file}")
         return False
     
-    target_file = os.path.join(mount_point, "CURRENT.UF2")
-    
     try:
-        print(f"📦 Flashing {os.path.basename(firmware_file)} to {mount_point}")
-        
-        # Copy firmware file
-        shutil.copy2(firmware_file, target_file)
-        
-        # Sync to ensure write completes
-        os.sync()
+        # Validate the image against the bootloader's Board-ID before writing anything
+        with open_firmware(firmware_file, mount_point) as image:
+            print(f"📦 Flashing {os.path.basename(firmware_file)} to {mount_point} ({image.describe()})")
+            
+            # Chunked copy with an fsync of CURRENT.UF2 only (no system-wide sync)
+            write_firmware(mount_point, image)
         
         print(f"✅ Successfully flashed {device_name or 'device'}")
         return True
@@ -288,59 +190,230 @@ def mount_device(device_path, mount_point):
     """
     Mount a device to a mount point.
     """
-    try:
-        # Create mount point if it doesn't exist
-        os.makedirs(mount_point, exist_ok=True)
-        
-        # Mount the device with proper permissions for flashing
-        result = subprocess.run(['sudo', 'mount', '-o', 'rw,uid=1000,gid=1000', device_path, mount_point], 
-                              capture_output=True, text=True)
-        
-        if result.returncode == 0:
-            return True
-        else:
-            print(f"Failed to mount {device_path}: {result.stderr}")
-            return False
-            
-    except Exception as e:
-        print(f"Error mounting {device_path}: {e}")
-        return False
+    # Mount the device with proper permissions for flashing (no shell, with a timeout)
+    ok, error = aio.call(aio.mount(device_path, mount_point))
+    if not ok:
+        print(f"Failed to mount {device_path}: {error}")
+    return ok
+
+
+def mount_when_needed(mount_point, needs_unmount, device_path, temp_mount):
+    """
+    Mount a device that was identified without mounting, now that it is going
+    to be flashed. Returns (mount_point, needs_unmount); None if mounting failed.
+    """
+    if mount_point:
+        return mount_point, needs_unmount
+    print(f"Mounting {device_path} to {temp_mount} for flashing...")
+    if mount_device(device_path, temp_mount):
+        return temp_mount, True
+    print(f"❌ Failed to mount {device_path}, skipping")
+    return None, False
 
 
 def unmount_device(mount_point):
     """
     Unmount a device.
     """
-    try:
-        result = subprocess.run(['sudo', 'umount', mount_point], 
-                              capture_output=True, text=True)
-        return result.returncode == 0
-    except Exception:
-        return False
+    ok, _ = aio.call(aio.umount(mount_point))
+    return ok
 
 
-def scan_for_bootloaders(known_devices, firmware_dir, require_confirmation=False, scan_duration=5):
+@traced('detect.scan')
+def find_devices_to_flash(known_devices, find_firmware, require_confirmation=False, found_devices=None,
+                          temp_prefix="/tmp/zmk-flash"):
     """
-    Continuously scan for bootloader devices for the specified duration.
-    Returns list of (mount_point, device_config, firmware_file) tuples.
+    Single scan for devices in bootloader mode that can be flashed.
+    find_firmware(device_name, device_side) picks the image for a device (None if there is none).
+    Returns list of (mount_point, device_config, firmware_file, needs_unmount) tuples.
     """
-    from auto_flash import find_flashable_devices_once
+    if found_devices is None:
+        found_devices = set()
+        
+    flashable = []
+    all_devices, bootloader_devices = find_bootloader_volumes(found_devices)
+    if not all_devices:
+        return flashable
+    
+    # Read every unmounted volume's INFO_UF2.TXT concurrently (an unreadable one counts as unknown)
+    unmounted_devices = [d for d in all_devices if d['type'] == 'unmounted']
+    infos = aio.call(aio.gather([aio.to_thread(read_bootloader_info, d['device_path']) for d in unmounted_devices]))
+    volume_infos = {d['device_path']: None if isinstance(info, Exception) else info
+                    for d, info in zip(unmounted_devices, infos)}
     
+    # For each device, try to determine what to flash
+    for i, device_info in enumerate(all_devices, 1):
+        mount_point = device_info.get('mount_point')
+        device_path = device_info.get('device_path')
+        needs_unmount = False
+        
+        # Unmounted devices are identified by reading INFO_UF2.TXT from the FAT volume;
+        # only the ones that get flashed are mounted. Unreadable devices are mounted to check.
+        bootloader_info = None
+        temp_mount = f"{temp_prefix}-{i}"
+        if device_info['type'] == 'unmounted':
+            bootloader_info = volume_infos[device_path]
+            if bootloader_info == {}:
+                print(f"\n💾 {device_path} is not a UF2 bootloader volume, skipping")
+                continue
+            if bootloader_info is None:
+                print(f"\n📱 Unmounted bootloader device: {device_path}")
+                print(f"Mounting to {temp_mount} to check device info...")
+            
+                if mount_device(device_path, temp_mount):
+                    mount_point = temp_mount
+                    needs_unmount = True
+                else:
+                    print(f"❌ Failed to mount {device_path}, skipping")
+                    continue
+        
+        # Get bootloader info
+        if bootloader_info is None:
+            bootloader_info = get_bootloader_info(mount_point) if mount_point else {}
+        
+        # Match by the serial of the USB device this disk belongs to
+        usb_serial = device_info.get('serial')
+        matched_config = known_devices.get(usb_serial) if usb_serial else None
+        
+        # Without a serial for the disk (no sysfs link), fall back to any known bootloader serial
+        if usb_serial is None:
+            for usb_device in bootloader_devices:
+                if usb_device.serial:
+                    usb_serial = usb_device.serial
+                    if usb_serial in known_devices:
+                        matched_config = known_devices[usb_serial]
+                        break
+        
+        print(f"\n📱 Bootloader device #{i}")
+        if device_info['type'] == 'mounted':
+            print(f"   Already mounted at: {mount_point}")
+        else:
+            print(f"   Device: {device_path}")
+            print(f"   Mounted at: {mount_point or 'not mounted (read directly)'}")
+        
+        if usb_serial:
+            print(f"   USB Serial: {usb_serial}")
+            
+        if bootloader_info:
+            for key, value in bootloader_info.items():
+                print(f"   {key}: {value}")
+        
+        # If we found a match, suggest it
+        if matched_config:
+            device_name = matched_config['name']
+            device_side = matched_config.get('side', 'unknown')
+            print(f"\n✨ Auto-detected: {device_name} ({device_side} side)")
+            
+            # Find appropriate firmware
+            firmware_file = find_firmware(device_name, device_side)
+            if firmware_file:
+                if require_confirmation:
+                    confirm = input(f"Flash {os.path.basename(firmware_file)} to {device_name}? [Y/n]: ").strip().lower()
+                    if confirm in ['', 'y', 'yes']:
+                        mount_point, needs_unmount = mount_when_needed(mount_point, needs_unmount, device_path, temp_mount)
+                        if mount_point:
+                            flashable.append((mount_point, matched_config, firmware_file, needs_unmount))
+                            print(f"✅ Will flash {os.path.basename(firmware_file)} to {device_name}")
+                        continue
+                    else:
+                        print("Skipping auto-detected device")
+                else:
+                    mount_point, needs_unmount = mount_when_needed(mount_point, needs_unmount, device_path, temp_mount)
+                    if mount_point:
+                        flashable.append((mount_point, matched_config, firmware_file, needs_unmount))
+                        print(f"✅ Will flash {os.path.basename(firmware_file)} to {device_name}")
+                    continue
+            else:
+                print(f"❌ No firmware found for {device_name} ({device_side} side)")
+        
+        # List configured devices for user to choose from
+        print(f"\nConfigured devices:")
+        device_list = list(known_devices.items())
+        for j, (serial, config) in enumerate(device_list, 1):
+            side = config.get('side', 'unknown')
+            print(f"  {j}. {config['name']} ({side} side)")
+        
+        print("  0. Skip this device")
+        
+        try:
+            choice = input("Which device is this? (number): ").strip()
+            if choice == '0':
+                if needs_unmount:
+                    unmount_device(mount_point)
+                continue
+                
+            choice_idx = int(choice) - 1
+            if 0 <= choice_idx < len(device_list):
+                serial, config = device_list[choice_idx]
+                device_name = config['name']
+                device_side = config.get('side', 'unknown')
+                
+                # Find appropriate firmware
+                firmware_file = find_firmware(device_name, device_side)
+                if firmware_file:
+                    mount_point, needs_unmount = mount_when_needed(mount_point, needs_unmount, device_path, temp_mount)
+                    if mount_point:
+                        flashable.append((mount_point, config, firmware_file, needs_unmount))
+                        print(f"✅ Will flash {os.path.basename(firmware_file)} to {device_name}")
+                else:
+                    print(f"❌ No firmware found for {device_name} ({device_side} side)")
+                    if needs_unmount:
+                        unmount_device(mount_point)
+            else:
+                print("Invalid choice, skipping device")
+                if needs_unmount:
+                    unmount_device(mount_point)
+                
+        except (ValueError, KeyboardInterrupt):
+            print("Skipping device")
+            if needs_unmount:
+                unmount_device(mount_point)
+            continue
+    
+    return flashable
+
+
+def load_script(filename):
+    """A script in scripts/ without a .py suffix (e.g. 'auto-flash') as a module named auto_flash"""
+    import importlib.util
+    from importlib.machinery import SourceFileLoader
+
+    name = filename.replace('-', '_')
+    module = sys.modules.get(name)
+    if module is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+        loader = SourceFileLoader(name, path)
+        module = importlib.util.module_from_spec(importlib.util.spec_from_loader(name, loader))
+        loader.exec_module(module)
+        sys.modules[name] = module
+    return module
+
+
+def scan_until_found(find_once, scan_duration=5):
+    """
+    Continuously scan for bootloader devices for the specified duration.
+    find_once(found_devices) is a single scan; returns the first non-empty list it finds.
+    """
     start_time = time.time()
-    scan_interval = 0.5  # Check every 500ms
     found_devices = set()  # Track already-found devices to avoid duplicates
     
     print(f"Scanning for bootloader devices for {scan_duration} seconds...")
     
-    while time.time() - start_time < scan_duration:
-        flashable = find_flashable_devices_once(known_devices, firmware_dir, require_confirmation, found_devices)
-        
-        if flashable:
-            # Found devices, return immediately
-            return flashable
-        
-        # Wait before next scan
-        time.sleep(scan_interval)
+    with BootloaderWatcher() as watcher:
+        while True:
+            flashable = find_once(found_devices)
+            
+            if flashable:
+                # Found devices, return immediately
+                return flashable
+            
+            remaining = scan_duration - (time.time() - start_time)
+            if remaining <= 0:
+                break
+            
+            # Sleep until a bootloader disk appears (or a periodic rescan is due,
+            # which still catches volumes mounted by a desktop automounter)
+            watcher.wait_for_devices(min(remaining, RESCAN_INTERVAL))
     
     print("Scan complete. No devices found.")
-    return []
\ No newline at end of file
+    return []
@@ -0,0 +1,534 @@
+#!/usr/bin/env python3
+"""
+Synthetic device fixtures for the ZMK tooling benchmarks
+Builds fake sysfs/dev trees that the detection code can be pointed at, so
+benchmarks run without real hardware or root access.
+"""
+
+import os
+import shutil
+import tempfile
+
+
+class FakeSysfs:
+    """
+    A throwaway directory laid out like /sys and /dev:
+
+        <root>/sys/devices/pci0000:00/0000:00:14.0/usb<bus>/<bus>-<port>/...
+        <root>/sys/bus/usb/devices/<bus>-<port> -> ../../../devices/...
+        <root>/sys/block/<name> -> ../devices/.../block/<name>
+        <root>/dev/<name>
+    """
+
+    def __init__(self, root=None):
+        self.owns_root = root is None
+        self.root = root or tempfile.mkdtemp(prefix='zmk-fake-sysfs-')
+        self.sysfs_root = os.path.join(self.root, 'sys')
+        self.dev_root = os.path.join(self.root, 'dev')
+        self.devices_root = os.path.join(self.sysfs_root, 'devices', 'pci0000:00', '0000:00:14.0')
+        for path in (self.devices_root, self.dev_root,
+                     os.path.join(self.sysfs_root, 'block'),
+                     os.path.join(self.sysfs_root, 'bus', 'usb', 'devices')):
+            os.makedirs(path, exist_ok=True)
+        self.next_host = 0
+        self.usb_devices = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+
+    def cleanup(self):
+        if self.owns_root:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+    @staticmethod
+    def _write(path, value):
+        with open(path, 'w') as f:
+            f.write(f"{value}\n")
+
+    def add_usb_device(self, bus, port, vendor_id, product_id, manufacturer='', product='',
+                       serial=None, devnum=None):
+        """Create a USB device node and return its sysfs path"""
+        bus_dir = os.path.join(self.devices_root, f"usb{bus}")
+        usb_path = os.path.join(bus_dir, f"{bus}-{port}")
+        os.makedirs(usb_path, exist_ok=True)
+
+        attrs = {
+            'idVendor': vendor_id,
+            'idProduct': product_id,
+            'busnum': bus,
+            'devnum': devnum if devnum is not None else port + 1,
+            'uevent': f"MAJOR=189\nMINOR=0\nDEVNAME=bus/usb/{bus:03d}/{(devnum or port + 1):03d}\n"
+                      f"DEVTYPE=usb_device\nBUSNUM={bus:03d}\nDEVNUM={(devnum or port + 1):03d}",
+        }
+        if manufacturer:
+            attrs['manufacturer'] = manufacturer
+        if product:
+            attrs['product'] = product
+        if serial:
+            attrs['serial'] = serial
+        for name, value in attrs.items():
+            self._write(os.path.join(usb_path, name), value)
+
+        link = os.path.join(self.sysfs_root, 'bus', 'usb', 'devices', f"{bus}-{port}")
+        if not os.path.lexists(link):
+            os.symlink(os.path.relpath(usb_path, os.path.dirname(link)), link)
+
+        # Interface entries live next to devices in /sys/bus/usb/devices
+        interface = os.path.join(usb_path, f"{bus}-{port}:1.0")
+        os.makedirs(interface, exist_ok=True)
+        iface_link = os.path.join(self.sysfs_root, 'bus', 'usb', 'devices', f"{bus}-{port}:1.0")
+        if not os.path.lexists(iface_link):
+            os.symlink(os.path.relpath(interface, os.path.dirname(iface_link)), iface_link)
+
+        self.usb_devices.append({
+            'bus': bus, 'devnum': attrs['devnum'], 'vendor_id': vendor_id, 'product_id': product_id,
+            'manufacturer': manufacturer, 'product': product, 'serial': serial,
+        })
+        return usb_path
+
+    def lsusb_output(self):
+        """Render the devices in this tree the way `lsusb -v` prints them"""
+        blocks = []
+        for dev in sorted(self.usb_devices, key=lambda d: (d['bus'], d['devnum'])):
+            serial_index = 3 if dev['serial'] else 0
+            blocks.append("\n".join([
+                f"Bus {dev['bus']:03d} Device {dev['devnum']:03d}: ID {dev['vendor_id']}:{dev['product_id']} "
+                f"{dev['manufacturer']} {dev['product']}".rstrip(),
+                "Device Descriptor:",
+                "  bLength                18",
+                "  bDescriptorType         1",
+                "  bcdUSB               2.00",
+                "  bDeviceClass           239 Miscellaneous Device",
+                "  bMaxPacketSize0         64",
+                f"  idVendor           0x{dev['vendor_id']} {dev['manufacturer']}".rstrip(),
+                f"  idProduct          0x{dev['product_id']} {dev['product']}".rstrip(),
+                "  bcdDevice            1.00",
+                f"  iManufacturer           1 {dev['manufacturer']}".rstrip(),
+                f"  iProduct                2 {dev['product']}".rstrip(),
+                f"  iSerial                 {serial_index} {dev['serial'] or ''}".rstrip(),
+                "  bNumConfigurations      1",
+                "  Configuration Descriptor:",
+                "    bLength                 9",
+                "    bNumInterfaces          1",
+                "    MaxPower              100mA",
+            ]))
+        return "\n\n".join(blocks) + "\n"
+
+    def lsblk_output(self, columns=('NAME', 'SIZE', 'TYPE', 'RM', 'TRAN', 'SERIAL', 'MOUNTPOINT')):
+        """Render the disks in this tree the way `lsblk -b -n -r -o <columns>` prints them"""
+        labels = {}
+        labels_dir = os.path.join(self.dev_root, 'disk', 'by-label')
+        if os.path.isdir(labels_dir):
+            for label in os.listdir(labels_dir):
+                labels[os.path.basename(os.readlink(os.path.join(labels_dir, label)))] = label
+
+        lines = []
+        block_dir = os.path.join(self.sysfs_root, 'block')
+        for name in sorted(os.listdir(block_dir)):
+            path = os.path.realpath(os.path.join(block_dir, name))
+            with open(os.path.join(path, 'size')) as f:
+                size = int(f.read()) * 512
+            with open(os.path.join(path, 'removable')) as f:
+                removable = f.read().strip()
+            usb = path
+            while usb.startswith(self.devices_root) and not os.path.exists(os.path.join(usb, 'idVendor')):
+                usb = os.path.dirname(usb)
+            serial = ''
+            if os.path.exists(os.path.join(usb, 'serial')):
+                with open(os.path.join(usb, 'serial')) as f:
+                    serial = f.read().strip()
+            values = {'NAME': name, 'KNAME': name, 'PATH': f"/dev/{name}", 'SIZE': str(size), 'TYPE': 'disk',
+                      'RM': removable, 'TRAN': 'usb' if usb.startswith(self.devices_root) else 'sata',
+                      'SERIAL': serial, 'LABEL': labels.get(name, ''), 'MOUNTPOINT': ''}
+            lines.append(' '.join(values.get(column, '').replace(' ', '\\x20') for column in columns).rstrip())
+        return "\n".join(lines) + "\n"
+
+    def add_disk(self, name, usb_path, size_mb=8, removable=True, label=None):
+        """
+        Attach a SCSI disk below a USB device (or, with usb_path None, a PCI
+        controller like a system disk) and return its sysfs block path
+        """
+        host = self.next_host
+        self.next_host += 1
+        parent = os.path.join(usb_path, f"{os.path.basename(usb_path)}:1.0") if usb_path else \
+            os.path.join(self.devices_root, f"ata{host}")
+        scsi_dev = os.path.join(parent, f"host{host}", f"target{host}:0:0", f"{host}:0:0:0")
+        block_path = os.path.join(scsi_dev, 'block', name)
+        os.makedirs(block_path, exist_ok=True)
+
+        self._write(os.path.join(block_path, 'size'), int(size_mb * 1024 * 1024 / 512))
+        self._write(os.path.join(block_path, 'removable'), 1 if removable else 0)
+        self._write(os.path.join(block_path, 'uevent'), f"MAJOR=8\nMINOR={host * 16}\nDEVNAME={name}\nDEVTYPE=disk")
+        os.symlink(os.path.relpath(scsi_dev, block_path), os.path.join(block_path, 'device'))
+
+        link = os.path.join(self.sysfs_root, 'block', name)
+        os.symlink(os.path.relpath(block_path, os.path.dirname(link)), link)
+        # A volume image written to the node beforehand (see add_uf2_volume) is kept
+        if not os.path.exists(os.path.join(self.dev_root, name)):
+            open(os.path.join(self.dev_root, name), 'w').close()
+        if label:
+            labels_dir = os.path.join(self.dev_root, 'disk', 'by-label')
+            os.makedirs(labels_dir, exist_ok=True)
+            os.symlink(os.path.join('..', '..', name), os.path.join(labels_dir, label.replace(' ', '\\x20')))
+        return block_path
+
+    def _add_class_device(self, class_dir, name, parent):
+        """A /sys/class-style entry for a device node below parent, and its /dev node"""
+        node = os.path.join(parent, os.path.basename(class_dir), name)
+        os.makedirs(node, exist_ok=True)
+        self._write(os.path.join(node, 'uevent'), f"DEVNAME={name}")
+        os.symlink(os.path.relpath(parent, node), os.path.join(node, 'device'))
+        link = os.path.join(self.sysfs_root, class_dir, name)
+        os.makedirs(os.path.dirname(link), exist_ok=True)
+        os.symlink(os.path.relpath(node, os.path.dirname(link)), link)
+        open(os.path.join(self.dev_root, name), 'w').close()
+        return node
+
+    def add_tty(self, name, usb_path, interface=0):
+        """A CDC ACM tty (e.g. ttyACM0) on one of a USB device's interfaces"""
+        parent = os.path.join(usb_path, f"{os.path.basename(usb_path)}:1.{interface}")
+        os.makedirs(parent, exist_ok=True)
+        return self._add_class_device(os.path.join('class', 'tty'), name, parent)
+
+    def add_hidraw(self, name, usb_path, interface=2):
+        """A hidraw node on a USB device's HID interface"""
+        parent = os.path.join(usb_path, f"{os.path.basename(usb_path)}:1.{interface}", '0003:1D50:615E.0001')
+        os.makedirs(parent, exist_ok=True)
+        return self._add_class_device(os.path.join('class', 'hidraw'), name, parent)
+
+    def add_virtual_ttys(self, count):
+        """Console and pseudo ttys, which have no device link (tty0, tty1, ...)"""
+        for n in range(count):
+            node = os.path.join(self.sysfs_root, 'devices', 'virtual', 'tty', f"tty{n}")
+            os.makedirs(node, exist_ok=True)
+            link = os.path.join(self.sysfs_root, 'class', 'tty', f"tty{n}")
+            os.makedirs(os.path.dirname(link), exist_ok=True)
+            os.symlink(os.path.relpath(node, os.path.dirname(link)), link)
+
+    def remove_disk(self, name):
+        link = os.path.join(self.sysfs_root, 'block', name)
+        target = os.path.realpath(link)
+        os.unlink(link)
+        shutil.rmtree(target, ignore_errors=True)
+        try:
+            os.unlink(os.path.join(self.dev_root, name))
+        except FileNotFoundError:
+            pass
+
+    def block_devpath(self, name):
+        """The DEVPATH a kernel uevent would carry for a disk (relative to /sys)"""
+        real = os.path.realpath(os.path.join(self.sysfs_root, 'block', name))
+        return '/' + os.path.relpath(real, self.sysfs_root)
+
+
+def add_bootloader(fake, index, serial=None, bus=1, size_mb=8, with_disk=True):
+    """Add a nice!nano-style UF2 bootloader (USB device plus its disk)"""
+    usb_path = fake.add_usb_device(bus, index + 1, '239a', '00b3', 'Adafruit Industries',
+                                   'nice!nano UF2 Bootloader',
+                                   serial or f"BOOT{index:012X}")
+    if with_disk:
+        fake.add_disk(disk_name(index), usb_path, size_mb)
+    return usb_path
+
+
+def add_uf2_volume(fake, index, serial=None, bus=1, model='nice!nano', board_id='nRF52840-nicenano',
+                   readable=True):
+    """
+    Add a bootloader whose disk holds a FAT12 volume with INFO_UF2.TXT, the way
+    the Adafruit nRF52 bootloader presents it. With readable False the /dev node
+    is left empty, as for a user outside the disk group: only a mount (through
+    StubCommands, which copies <node>.files/ in) can identify it.
+    """
+    files = {
+        'INFO_UF2.TXT': (f"UF2 Bootloader 0.6.{index} lib/nrfx (v2.0.0)\r\nModel: {model}\r\n"
+                         f"Board-ID: {board_id}\r\nDate: Jan  1 2024\r\n").encode(),
+        'INDEX.HTM': b'<html><body>nice!nano</body></html>\r\n',
+        'CURRENT.UF2': bytes(4096),
+    }
+    node = os.path.join(fake.dev_root, disk_name(index))
+    if readable:
+        # Written before the disk appears in sysfs, so a scan never sees a half-written volume
+        make_fat_image(node, files, fat_type=12, sectors_per_cluster=8)
+    else:
+        os.makedirs(node + '.files')
+        for name, content in files.items():
+            with open(os.path.join(node + '.files', name), 'wb') as f:
+                f.write(content)
+    return add_bootloader(fake, index, serial, bus)
+
+
+def disk_name(index):
+    """sdb, sdc, ... sdz, sdaa, ... (sda is left for the system disk)"""
+    index += 1
+    letters = ''
+    while True:
+        letters = chr(ord('a') + index % 26) + letters
+        index = index // 26 - 1
+        if index < 0:
+            return 'sd' + letters
+
+
+def populate_workstation(fake, count, bootloaders=2, seed=0):
+    """
+    Fill a fake tree with a hub-heavy workstation: `count` USB devices in total,
+    `bootloaders` of which are UF2 bootloaders with disks attached.
+    """
+    import random
+
+    rng = random.Random(seed)
+    ordinary = [
+        ('046d', 'c52b', 'Logitech', 'USB Receiver'),
+        ('05e3', '0610', 'GenesysLogic', 'USB2.1 Hub'),
+        ('8087', '0026', 'Intel Corp.', 'AX201 Bluetooth'),
+        ('0bda', '5634', 'Realtek', 'Integrated Webcam'),
+        ('1d50', '615e', 'ZMK Project', 'Eyelash Corne'),
+    ]
+    for index in range(bootloaders):
+        add_bootloader(fake, index, bus=1)
+    for index in range(bootloaders, count):
+        vendor_id, product_id, manufacturer, product = rng.choice(ordinary)
+        serial = f"{rng.getrandbits(48):012X}" if rng.random() < 0.6 else None
+        bus = 2 + index // 120
+        fake.add_usb_device(bus, index % 120 + 1, vendor_id, product_id, manufacturer, product, serial)
+
+
+class FakeUf2Volume:
+    """
+    A directory standing in for a mounted UF2 bootloader drive.
+    CURRENT.UF2 is a FIFO drained by a background "bootloader" at `rate` bytes/s,
+    so writers see realistic back-pressure. Once `expected_size` bytes have
+    arrived the volume resets: the directory disappears, as a real drive does.
+    With keep=True the bytes written are kept in `data`, to check what arrived.
+    """
+
+    def __init__(self, root, name, expected_size, rate=256 * 1024, reset_delay=0.05, keep=False):
+        self.path = os.path.join(root, name)
+        self.expected_size = expected_size
+        self.rate = rate
+        self.reset_delay = reset_delay
+        self.received = 0
+        self.data = bytearray() if keep else None
+        self.reset_at = None
+        os.makedirs(self.path)
+        with open(os.path.join(self.path, 'INFO_UF2.TXT'), 'w') as f:
+            f.write("UF2 Bootloader 0.6.0 lib/nrfx (v2.0.0)\n"
+                    "Model: nice!nano\nBoard-ID: nRF52840-nicenano\nDate: Jan  1 2024\n")
+        open(os.path.join(self.path, 'INDEX.HTM'), 'w').close()
+        os.mkfifo(os.path.join(self.path, 'CURRENT.UF2'))
+
+        import threading
+        self.thread = threading.Thread(target=self._drain, daemon=True)
+        self.thread.start()
+
+    def _drain(self):
+        import time
+
+        block = 4096
+        with open(os.path.join(self.path, 'CURRENT.UF2'), 'rb', buffering=0) as fifo:
+            start = time.monotonic()
+            while self.received < self.expected_size:
+                data = fifo.read(block)
+                if not data:
+                    break
+                self.received += len(data)
+                if self.data is not None:
+                    self.data += data
+                # Throttle to the simulated USB mass-storage write speed
+                ahead = start + self.received / self.rate - time.monotonic()
+                if ahead > 0:
+                    time.sleep(ahead)
+        time.sleep(self.reset_delay)
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.reset_at = time.monotonic()
+
+
+def make_fat_image(path, files, fat_type=16, size_mb=8, label='NICENANO', sectors_per_cluster=1,
+                   fragmented=False):
+    """
+    Write a FAT12/16 volume image holding `files` ({8.3 name: bytes}) in its root
+    directory, laid out like a UF2 bootloader's virtual drive. The image is
+    sparse: only the boot sector, FATs, root directory and file data are written.
+    With fragmented, the even-numbered chunks of all files are placed before
+    the odd ones, so every link of a multi-cluster chain jumps.
+    """
+    import struct
+
+    sector = 512
+    total = int(size_mb * 1024 * 1024) // sector
+    reserved, num_fats, root_entries = 1, 2, 64
+    root_sectors = root_entries * 32 // sector
+    clusters = (total - reserved - root_sectors) // sectors_per_cluster
+    entry_bits = 12 if fat_type == 12 else 16
+    fat_sectors = ((clusters + 2) * entry_bits // 8 + sector - 1) // sector
+    data_start = (reserved + num_fats * fat_sectors + root_sectors) * sector
+    cluster_size = sectors_per_cluster * sector
+
+    boot = bytearray(sector)
+    boot[0:3] = b'\xEB\x3C\x90'
+    boot[3:11] = b'UF2 UF2 '
+    struct.pack_into('<HBHBHHBHHHII', boot, 11, sector, sectors_per_cluster, reserved, num_fats, root_entries,
+                     total if total < 0x10000 else 0, 0xF8, fat_sectors, 1, 1, 0, total if total >= 0x10000 else 0)
+    struct.pack_into('<BBBI11s8s', boot, 36, 0x80, 0, 0x29, 0x00420042,
+                     label.encode().ljust(11)[:11], f"FAT{fat_type}   ".encode())
+    boot[510:512] = b'\x55\xAA'
+
+    end_of_chain = 0xFFFF if fat_type == 16 else 0xFFF
+    fat = {0: 0xFFF8 if fat_type == 16 else 0xFF8, 1: end_of_chain}
+    # Chunks of each file, then the cluster of every chunk: file by file, or scattered when fragmented
+    chunks = {name: [content[i:i + cluster_size] for i in range(0, len(content), cluster_size)]
+              for name, content in files.items()}
+    order = [(name, index) for name, parts in chunks.items() for index in range(len(parts))]
+    if fragmented:
+        order.sort(key=lambda item: item[1] % 2)
+    placed = {item: 2 + number for number, item in enumerate(order)}
+
+    root = bytearray(struct.pack('<11sB20x', label.encode().ljust(11)[:11], 0x08))
+    data = []
+    for name, content in files.items():
+        base, _, ext = name.upper().partition('.')
+        chain = [placed[name, index] for index in range(len(chunks[name]))]
+        for index, cluster in enumerate(chain):
+            fat[cluster] = chain[index + 1] if index + 1 < len(chain) else end_of_chain
+            data.append((cluster, chunks[name][index]))
+        root += struct.pack('<8s3sB10xHHHI', base.encode().ljust(8), ext.encode().ljust(3), 0x01,
+                            0, 0, chain[0] if chain else 0, len(content))
+
+    fat_bytes = bytearray(fat_sectors * sector)
+    for cluster, value in fat.items():
+        if fat_type == 16:
+            struct.pack_into('<H', fat_bytes, cluster * 2, value)
+            continue
+        offset = cluster * 3 // 2
+        current = struct.unpack_from('<H', fat_bytes, offset)[0]
+        if cluster & 1:
+            current = (current & 0x000F) | (value << 4)
+        else:
+            current = (current & 0xF000) | value
+        struct.pack_into('<H', fat_bytes, offset, current)
+
+    with open(path, 'wb') as f:
+        f.truncate(total * sector)
+        f.write(boot)
+        for index in range(num_fats):
+            f.seek((reserved + index * fat_sectors) * sector)
+            f.write(fat_bytes)
+        f.seek((reserved + num_fats * fat_sectors) * sector)
+        f.write(root)
+        for cluster, content in data:
+            f.seek(data_start + (cluster - 2) * cluster_size)
+            f.write(content)
+    return path
+
+
+STUB_COMMANDS = {
+    'sudo': 'exec "$@"',
+    # mount [-o options] device mount_point: copy in the files recorded for the device
+    'mount': 'while [ $# -gt 2 ]; do shift; done\n'
+             '[ -d "$1.files" ] || { echo "mount: $2: wrong fs type, bad option, bad superblock on $1" >&2; exit 32; }\n'
+             'cp -R "$1.files/." "$2/"',
+    'umount': 'find "$1" -mindepth 1 -delete',
+    'lsusb': 'cat "$STUB_DIR/lsusb.out"',
+    'lsblk': 'cat "$STUB_DIR/lsblk.out"',
+    'just': 'exit 0',
+}
+
+
+class StubCommands:
+    """
+    Stand-ins for the commands the tooling spawns, first on PATH inside a with block:
+
+        sudo          runs its arguments, so `sudo mount` reaches the stub mount
+        mount/umount  copy <device>.files/ into the mount point, and empty it again
+        lsusb/lsblk   print recorded output (FakeSysfs.lsusb_output/lsblk_output)
+        just          succeeds without running the recipes
+
+    Every invocation is appended to calls.log; calls() returns them. A stub mount
+    is invisible to os.path.ismount, so a probe cancelled mid-mount leaves its
+    mount point behind: those are removed on exit.
+    """
+
+    def __init__(self, lsusb='', lsblk=''):
+        self.directory = tempfile.mkdtemp(prefix='zmk-stub-bin-')
+        self.log = os.path.join(self.directory, 'calls.log')
+        self.saved_path = None
+        for name, body in STUB_COMMANDS.items():
+            path = os.path.join(self.directory, name)
+            with open(path, 'w') as f:
+                f.write(f"#!/bin/sh\nSTUB_DIR='{self.directory}'\n"
+                        f"echo \"{name} $*\" >> \"$STUB_DIR/calls.log\"\n{body}\n")
+            os.chmod(path, 0o755)
+        self.record('lsusb', lsusb)
+        self.record('lsblk', lsblk)
+
+    def __enter__(self):
+        self.saved_path = os.environ.get('PATH', '')
+        os.environ['PATH'] = self.directory + os.pathsep + self.saved_path
+        return self
+
+    def __exit__(self, *exc):
+        os.environ['PATH'] = self.saved_path
+        for call in self.calls('mount'):
+            shutil.rmtree(call.rsplit(' ', 1)[-1], ignore_errors=True)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def record(self, command, output):
+        """Set the output the lsusb or lsblk stub prints"""
+        with open(os.path.join(self.directory, f"{command}.out"), 'w') as f:
+            f.write(output)
+
+    def calls(self, command=None):
+        """The logged invocations ("mount -o ... /dev/sdb /tmp/zmk_x"), optionally of one command"""
+        try:
+            with open(self.log) as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return []
+        return [line for line in lines if command is None or line.split(' ', 1)[0] == command]
+
+
+FAKE_KEYMAP_DRAWER = r'''#!/usr/bin/env python3
+# Stand-in for keymap-drawer's `keymap` CLI: parse via keymap_model, draw one box per layer
+import hashlib, sys, time
+sys.path.insert(0, {scripts!r})
+import yaml
+from keymap_model import format_binding, load_model
+
+args = sys.argv[sys.argv.index('-c') + 2:] if '-c' in sys.argv else sys.argv[1:]
+if args[0] == 'parse':
+    time.sleep({parse_seconds!r})
+    model = load_model(args[args.index('-z') + 1], use_cache=False)
+    layers = {{layer.name: [format_binding(b) for b in layer.bindings] for layer in model.layers}}
+    layers[args[args.index('--virtual-layers') + 1]] = []
+    combos = [{{'p': [p for p in c.key_positions if isinstance(p, int)], 'k': format_binding(c.bindings[0])}}
+              for c in model.combos if c.bindings]
+    yaml.safe_dump({{'layout': {{'zmk_keyboard': model.name}}, 'layers': layers, 'combos': combos}}, sys.stdout)
+elif args[0] == 'draw':
+    document = yaml.safe_load(sys.stdin)
+    height = 0
+    body = []
+    for name, bindings in document['layers'].items():
+        time.sleep({layer_seconds!r})
+        digest = hashlib.sha256(repr(bindings).encode()).hexdigest()[:12]
+        body.append(f'<rect y="{{height}}" width="1000" height="300"/><text y="{{height + 20}}">{{name}} {{digest}}</text>')
+        height += 300
+    print(f'<svg width="1000" height="{{height}}" viewBox="0 0 1000 {{height}}" class="keymap" '
+          f'xmlns="http://www.w3.org/2000/svg">' + ''.join(body) + '</svg>')
+else:
+    sys.exit(f"unsupported command {{args[0]}}")
+'''
+
+
+def write_fake_keymap_drawer(directory, parse_seconds=0.3, layer_seconds=0.05):
+    """
+    Write an executable stand-in for keymap-drawer's `keymap` command into directory:
+    `parse` reads the keymap with keymap_model and `draw` takes layer_seconds per layer
+    """
+    path = os.path.join(directory, 'keymap')
+    with open(path, 'w') as f:
+        f.write(FAKE_KEYMAP_DRAWER.format(scripts=os.path.dirname(os.path.abspath(__file__)),
+                                          parse_seconds=parse_seconds, layer_seconds=layer_seconds))
+    os.chmod(path, 0o755)
+    return path
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Block device inventory for ZMK tools
+One pass over /sys/block, /proc/self/mountinfo and /dev/disk/by-label per scan
+gives every disk with its size, removable flag, owning USB device, mount point
+and file system label, without spawning lsblk or mount for each candidate.
+"""
+
+import os
+import sys
+from collections import namedtuple
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+from tracing import add_profile_argument, setup_profile, traced
+from usb_watch import MAX_BOOTLOADER_SIZE_MB, find_usb_parent
+
+# Constants
+SECTOR_SIZE = 512  # /sys/block/*/size is always in 512-byte sectors
+MOUNTINFO = '/proc/self/mountinfo'
+
+Mount = namedtuple('Mount', 'mount_point fs_type')
+
+
+class BlockDevice(namedtuple('BlockDevice', 'name path size_bytes removable usb_serial usb_path mount_point fs_type label')):
+    """One whole disk. usb_path is the sysfs path of the USB device it belongs to, if any."""
+
+    __slots__ = ()
+
+    @property
+    def size_mb(self):
+        return self.size_bytes / (1024 * 1024)
+
+    @property
+    def is_usb(self):
+        return self.usb_path is not None
+
+    @property
+    def is_mounted(self):
+        return self.mount_point is not None
+
+    def could_be_bootloader(self):
+        """A small, unmounted disk on USB: the only kind a UF2 bootloader exposes"""
+        return self.is_usb and not self.is_mounted and 0 < self.size_mb <= MAX_BOOTLOADER_SIZE_MB
+
+
+def _unescape_mountinfo(field):
+    # mountinfo octal-escapes space, tab, newline and backslash
+    for escaped, char in (('\\040', ' '), ('\\011', '\t'), ('\\012', '\n'), ('\\134', '\\')):
+        field = field.replace(escaped, char)
+    return field
+
+
+def read_mount_table(path=MOUNTINFO):
+    """{source device: Mount} for everything mounted from /dev (first mount of each source)"""
+    mounts = {}
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                fields = line.split()
+                try:
+                    separator = fields.index('-')
+                except ValueError:
+                    continue
+                if len(fields) < separator + 3 or not fields[separator + 2].startswith('/dev/'):
+                    continue
+                mounts.setdefault(fields[separator + 2],
+                                  Mount(_unescape_mountinfo(fields[4]), fields[separator + 1]))
+    except OSError:
+        pass
+    return mounts
+
+
+def read_labels(dev_root='/dev'):
+    """{device path: file system label} from udev's /dev/disk/by-label links"""
+    labels_dir = os.path.join(dev_root, 'disk', 'by-label')
+    labels = {}
+    try:
+        entries = os.listdir(labels_dir)
+    except OSError:
+        return labels
+    for entry in entries:
+        target = os.path.realpath(os.path.join(labels_dir, entry))
+        # udev escapes spaces and slashes as \x20 and \x2f
+        labels[target] = entry.replace('\\x20', ' ').replace('\\x2f', '/')
+    return labels
+
+
+def _read(path, default=''):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+def _partitions(block_path, name):
+    try:
+        entries = os.listdir(block_path)
+    except OSError:
+        return []
+    return sorted(entry for entry in entries
+                  if entry.startswith(name) and os.path.exists(os.path.join(block_path, entry, 'partition')))
+
+
+@traced('block.inventory')
+def list_block_devices(sysfs_root='/sys', dev_root='/dev', mountinfo=MOUNTINFO):
+    """
+    Every physical disk in /sys/block, in name order. Virtual devices (loop,
+    zram, dm-*/LUKS) have no backing device and are left out. A disk counts as
+    mounted when it or one of its partitions is.
+    """
+    try:
+        names = sorted(os.listdir(os.path.join(sysfs_root, 'block')))
+    except OSError:
+        return []
+
+    mounts = read_mount_table(mountinfo)
+    labels = read_labels(dev_root)
+    devices = []
+    for name in names:
+        block_path = os.path.join(sysfs_root, 'block', name)
+        if not os.path.exists(os.path.join(block_path, 'device')):
+            continue
+
+        try:
+            size_bytes = int(_read(os.path.join(block_path, 'size'), '0')) * SECTOR_SIZE
+        except ValueError:
+            size_bytes = 0
+        usb_path = find_usb_parent(os.path.realpath(block_path))
+        path = os.path.join(dev_root, name)
+
+        mount = mounts.get(f"/dev/{name}")
+        if mount is None:
+            mount = next((mounts[f"/dev/{part}"] for part in _partitions(block_path, name)
+                          if f"/dev/{part}" in mounts), None)
+
+        devices.append(BlockDevice(
+            name=name,
+            path=path,
+            size_bytes=size_bytes,
+            removable=_read(os.path.join(block_path, 'removable')) == '1',
+            usb_serial=(_read(os.path.join(usb_path, 'serial')) or None) if usb_path else None,
+            usb_path=usb_path,
+            mount_point=mount.mount_point if mount else None,
+            fs_type=mount.fs_type if mount else None,
+            label=labels.get(os.path.realpath(path), ''),
+        ))
+    return devices
+
+
+def by_mount_point(devices):
+    """{mount point: BlockDevice} for the mounted disks in an inventory"""
+    return {os.path.realpath(d.mount_point): d for d in devices if d.mount_point}
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='List disks with their USB serial, mount point and label')
+    parser.add_argument('--candidates', action='store_true',
+                        help='Only unmounted USB disks small enough to be a UF2 bootloader')
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    setup_profile(args)
+
+    devices = list_block_devices()
+    if args.candidates:
+        devices = [d for d in devices if d.could_be_bootloader()]
+    if not devices:
+        print("No disks found")
+        return
+
+    print(f"{'NAME':<10} {'SIZE':>10}  {'RM':<3} {'USB SERIAL':<20} {'LABEL':<12} MOUNTPOINT")
+    for d in devices:
+        print(f"{d.name:<10} {d.size_mb:>8.1f}MB  {'yes' if d.removable else 'no':<3} "
+              f"{d.usb_serial or '-':<20} {d.label or '-':<12} {d.mount_point or '-'}")
+
+
+if __name__ == "__main__":
+    main()
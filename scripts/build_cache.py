@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Content-addressed firmware cache for ZMK builds
+Keys each build.yaml target on the files that actually shape its firmware
+(keymap and the config files it includes, base .conf, ZMK_EXTRA_CONF_FILE,
+board/shield/snippet, west manifest revisions, the build-info message) so
+unchanged targets are restored into firmware/ without invoking west.
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+from build_info import OUTPUT_NAME as BUILD_INFO_NAME, current_state as build_info_state
+from verify import FINGERPRINT_SUFFIX
+
+# Constants
+CACHE_VERSION = 2
+DEFAULT_MAX_SIZE_MB = 256
+PRISTINE_ARGS = {'-p', '-p=always', '-p=auto', '--pristine', '--pristine=always', '--pristine=auto'}
+
+EXTRA_CONF_RE = re.compile(r'-D(?:ZMK_)?EXTRA_CONF_FILE="?([^"\s]+)"?')
+
+
+def _side_stripped(name):
+    """eyelash_corne_left -> eyelash_corne, sofle_ergomech_right -> sofle_ergomech"""
+    return re.sub(r'_(left|right)$', '', name)
+
+
+def config_candidates(target):
+    """Config basenames ZMK would look for, most specific first (shield before board)"""
+    names = []
+    for name in (target.shield, target.board):
+        if not name:
+            continue
+        for candidate in (name, _side_stripped(name)):
+            if candidate not in names:
+                names.append(candidate)
+    return names
+
+
+def keymap_dependencies(path, model_cache):
+    """Local files the preprocessed keymap pulls in (from the keymap model's include graph)"""
+    model = model_cache.model(path)
+    # build_info.dtsi is keyed on its stable state and message instead (see BuildCache.inputs)
+    return {Path(p) for p in model.dependencies if Path(p).name != BUILD_INFO_NAME}
+
+
+def _git_head(repo_dir):
+    """Commit checked out in repo_dir, read straight from .git (no subprocess)"""
+    git_dir = repo_dir / '.git'
+    if git_dir.is_file():  # Worktree or submodule: "gitdir: <path>"
+        content = git_dir.read_text().strip()
+        if content.startswith('gitdir:'):
+            git_dir = (repo_dir / content.split(':', 1)[1].strip()).resolve()
+    try:
+        head = (git_dir / 'HEAD').read_text().strip()
+    except OSError:
+        return None
+    if not head.startswith('ref:'):
+        return head
+    ref = head.split(':', 1)[1].strip()
+    try:
+        return (git_dir / ref).read_text().strip()
+    except OSError:
+        pass
+    try:
+        with open(git_dir / 'packed-refs', 'r') as f:
+            for line in f:
+                if line.rstrip().endswith(' ' + ref):
+                    return line.split()[0]
+    except OSError:
+        pass
+    return None
+
+
+def manifest_revisions(root):
+    """{project: commit} for every project in config/west.yml that is checked out"""
+    import yaml
+
+    try:
+        with open(root / 'config' / 'west.yml', 'r') as f:
+            manifest = (yaml.safe_load(f) or {}).get('manifest', {})
+    except OSError:
+        return {}
+
+    revisions = {}
+    for project in manifest.get('projects') or []:
+        name = project.get('name')
+        path = project.get('path', name)
+        if name and path:
+            revisions[name] = _git_head(root / path) or project.get('revision') or ''
+    return revisions
+
+
+class BuildCache:
+    """
+    Firmware images stored by input hash under <root>/.build/cache, with an
+    index.json tracking size and last use for LRU eviction, and hit/miss counters.
+    """
+
+    def __init__(self, root, max_size_mb=DEFAULT_MAX_SIZE_MB, cache_dir=None):
+        self.root = Path(root)
+        self.cache_dir = Path(cache_dir or self.root / '.build' / 'cache')
+        self.objects_dir = self.cache_dir / 'objects'
+        self.index_path = self.cache_dir / 'index.json'
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.lock = threading.Lock()
+        self._revisions = None
+        self._file_hashes = {}
+        self._models = None
+        self._models_lock = threading.Lock()
+        self.index = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+            if index.get('version') == CACHE_VERSION:
+                return index
+        except (OSError, ValueError):
+            pass
+        return {'version': CACHE_VERSION, 'entries': {}, 'stats': {'hits': 0, 'misses': 0, 'evictions': 0}}
+
+    def models(self):
+        """The shared keymap model cache (its files are re-parsed only when they change)"""
+        if self._models is None:
+            from keymap_model import ModelCache
+            self._models = ModelCache()
+        return self._models
+
+    def save(self):
+        with self._models_lock:
+            if self._models is not None:
+                self._models.save()
+        with self.lock:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp = self.index_path.with_suffix('.tmp')
+            with open(tmp, 'w') as f:
+                json.dump(self.index, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.index_path)
+
+    def _hash_file(self, path):
+        stat = path.stat()
+        cache_key = (str(path), stat.st_mtime_ns, stat.st_size)
+        digest = self._file_hashes.get(cache_key)
+        if digest is None:
+            digest = hashlib.sha256(path.read_bytes()).hexdigest()
+            self._file_hashes[cache_key] = digest
+        return digest
+
+    def refresh(self):
+        """Forget manifest revisions (call after west update may have moved them)"""
+        self._revisions = None
+
+    def revisions(self):
+        if self._revisions is None:
+            self._revisions = manifest_revisions(self.root)
+        return self._revisions
+
+    def inputs(self, target, west_args=()):
+        """The files and values that make up a target's cache key"""
+        config_dir = self.root / 'config'
+        files = set()
+        for name in config_candidates(target):
+            for suffix in ('.keymap', '.conf', '.overlay'):
+                path = config_dir / f"{name}{suffix}"
+                if path.is_file():
+                    files.add(path.resolve())
+                    if suffix == '.keymap':
+                        with self._models_lock:
+                            files |= keymap_dependencies(path, self.models())
+        for extra in EXTRA_CONF_RE.findall(target.cmake_args or ''):
+            path = Path(extra.replace('${GITHUB_WORKSPACE}', str(self.root)))
+            if path.is_file():
+                files.add(path.resolve())
+        files.add((config_dir / 'west.yml').resolve())
+
+        return {
+            'target': [target.board, target.shield, target.snippet, target.cmake_args],
+            'west_args': [a for a in west_args if a not in PRISTINE_ARGS],
+            'files': {os.path.relpath(p, self.root): self._hash_file(p) for p in sorted(files) if p.exists()},
+            'revisions': self.revisions(),
+            # The message the firmware types: a hit must carry the build info the tree has now
+            'build_info': list(build_info_state(config_dir)),
+        }
+
+    def key(self, target, west_args=()):
+        payload = json.dumps(self.inputs(target, west_args), sort_keys=True).encode()
+        return hashlib.sha256(payload).hexdigest()
+
+    def lookup(self, key):
+        """Path of the cached image for key, or None"""
+        entry = self.index['entries'].get(key)
+        if not entry:
+            return None
+        path = self.objects_dir / entry['object']
+        return path if path.exists() else None
+
+    def restore(self, target, key, out_dir):
+        """Copy a cached image into out_dir. Returns the output path, or None on a miss."""
+        with self.lock:
+            path = self.lookup(key)
+            if path is None:
+                self.index['stats']['misses'] += 1
+                return None
+            entry = self.index['entries'][key]
+            entry['last_used'] = time.time()
+            entry['hits'] = entry.get('hits', 0) + 1
+            self.index['stats']['hits'] += 1
+
+        out_dir.mkdir(parents=True, exist_ok=True)
+        output = out_dir / f"{target.artifact}{path.suffix}"
+        shutil.copyfile(path, output)
+        sidecar = path.with_name(path.name + FINGERPRINT_SUFFIX)
+        if sidecar.exists():
+            shutil.copyfile(sidecar, output.with_name(output.name + FINGERPRINT_SUFFIX))
+        return output
+
+    def store(self, target, key, image):
+        """Add a freshly built image and evict least-recently-used entries over the size limit"""
+        image = Path(image)
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        name = f"{key}{image.suffix}"
+        tmp = self.objects_dir / f".{name}.{threading.get_ident()}"
+        shutil.copyfile(image, tmp)
+        os.replace(tmp, self.objects_dir / name)
+        sidecar = image.with_name(image.name + FINGERPRINT_SUFFIX)
+        if sidecar.exists():
+            shutil.copyfile(sidecar, self.objects_dir / (name + FINGERPRINT_SUFFIX))
+
+        with self.lock:
+            now = time.time()
+            self.index['entries'][key] = {
+                'artifact': target.artifact, 'object': name, 'size': image.stat().st_size,
+                'created': now, 'last_used': now, 'hits': 0,
+            }
+            self._evict()
+
+    def _evict(self):
+        entries = self.index['entries']
+        total = sum(e['size'] for e in entries.values())
+        for key, entry in sorted(entries.items(), key=lambda item: item[1]['last_used']):
+            if total <= self.max_size:
+                break
+            for name in (entry['object'], entry['object'] + FINGERPRINT_SUFFIX):
+                try:
+                    (self.objects_dir / name).unlink()
+                except FileNotFoundError:
+                    pass
+            total -= entry['size']
+            del entries[key]
+            self.index['stats']['evictions'] += 1
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        self.index = self._load_index()
+
+    def print_stats(self):
+        stats = self.index['stats']
+        entries = self.index['entries']
+        lookups = stats['hits'] + stats['misses']
+        total = sum(e['size'] for e in entries.values())
+        print(f"📦 Build cache: {self.cache_dir}")
+        print(f"   Entries:   {len(entries)} ({total / 1024 / 1024:.1f} of {self.max_size / 1024 / 1024:.0f} MB)")
+        print(f"   Hits:      {stats['hits']}")
+        print(f"   Misses:    {stats['misses']}")
+        if lookups:
+            print(f"   Hit rate:  {100 * stats['hits'] / lookups:.0f}%")
+        print(f"   Evictions: {stats['evictions']}")
+        if entries:
+            print("\n   Artifact                                   Size  Hits  Last used")
+            for entry in sorted(entries.values(), key=lambda e: e['last_used'], reverse=True):
+                used = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['last_used']))
+                print(f"   {entry['artifact']:<40} {entry['size'] // 1024:>5}K {entry.get('hits', 0):>5}  {used}")
+
+
+def main():
+    import argparse
+    from tracing import add_profile_argument, setup_profile
+
+    from build_scheduler import REPO_ROOT, load_build_matrix, select_targets
+
+    parser = argparse.ArgumentParser(description='Inspect and manage the ZMK firmware build cache')
+    parser.add_argument('--stats', '-s', action='store_true', help='Show hit/miss statistics and cached artifacts')
+    parser.add_argument('--clear', action='store_true', help='Remove every cached image')
+    parser.add_argument('--keys', nargs='*', metavar='EXPR',
+                        help='Show the cache key and inputs of matching targets')
+    parser.add_argument('--max-size', type=float, default=DEFAULT_MAX_SIZE_MB,
+                        help=f'Cache size limit in MB (default: {DEFAULT_MAX_SIZE_MB})')
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    setup_profile(args)
+
+    cache = BuildCache(REPO_ROOT, args.max_size)
+    if args.clear:
+        cache.clear()
+        print(f"🧹 Cleared {cache.cache_dir}")
+    if args.keys is not None:
+        for target in select_targets(load_build_matrix(), args.keys or ['all']):
+            key = cache.key(target)
+            status = 'hit' if cache.lookup(key) else 'miss'
+            print(f"{target.artifact}: {key[:16]} ({status})")
+            for path, digest in cache.inputs(target)['files'].items():
+                print(f"   {digest[:12]}  {path}")
+    if args.stats or not (args.clear or args.keys is not None):
+        cache.print_stats()
+
+
+if __name__ == "__main__":
+    main()
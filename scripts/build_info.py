@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Build-info macro generation for ZMK builds
+Writes config/build_info.dtsi, a macro that types "Built from commit <hash>
+<timestamp>" (or "ZMK built <timestamp>"). The timestamp is the only volatile
+field: it is refreshed only when the stable inputs (the commit, and the config
+sources the keymap is built from) change, and the file is rewritten only when
+its content differs. An unchanged tree therefore leaves the keymap's
+dependencies untouched and `west build` has nothing to recompile.
+"""
+
+import hashlib
+import os
+import re
+import subprocess
+import time
+from pathlib import Path
+
+from tracing import traced
+
+# Constants
+CONFIG_DIR = Path(__file__).resolve().parent.parent / 'config'
+OUTPUT_NAME = 'build_info.dtsi'
+STATE_RE = re.compile(r'^// build-info: (.*)$', re.MULTILINE)
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+FORMAT = 2  # Bumped when the macro's encoding changes (2: capitals typed with shift), so old files are rewritten
+
+# ZMK keycode for each character the message can contain (anything else is typed as a space).
+# Capitals are typed with left shift held, so the macro types the message in its own case.
+KEYCODES = {**{str(n): f"N{n}" for n in range(10)},
+            **{c: c.upper() for c in 'abcdefghijklmnopqrstuvwxyz'},
+            **{c: f"LS({c})" for c in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'},
+            '-': 'MINUS', '_': 'UNDER', ':': 'COLON', ' ': 'SPACE', '.': 'DOT', '/': 'SLASH',
+            '<': 'LT', '>': 'GT'}
+KEYCODE_CHARS = {'MINUS': '-', 'UNDER': '_', 'COLON': ':', 'SPACE': ' ', 'DOT': '.', 'SLASH': '/',
+                 'LT': '<', 'GT': '>'}
+
+TEMPLATE = """// build-info: {state}
+/ {{
+   macros {{
+       build_time: build_time {{
+           compatible = "zmk,behavior-macro";
+           #binding-cells = <0>;
+           bindings = <&macro_tap{keycodes}>;
+       }};
+   }};
+}};
+"""
+
+
+def encode(message):
+    """The &kp bindings that type a message"""
+    return ''.join(f" &kp {KEYCODES.get(char, 'SPACE')}" for char in message)
+
+
+def decode(text):
+    """The message a build_info.dtsi types, or None if it has no &kp bindings"""
+    keys = re.findall(r'&kp (LS\(\w\)|\w+)', text)
+    if not keys:
+        return None
+    return ''.join(KEYCODE_CHARS.get(k, k[1:] if re.fullmatch(r'N\d', k) else k[3] if k.startswith('LS(') else k.lower())
+                   for k in keys)
+
+
+def current_commit(root=CONFIG_DIR.parent):
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root,
+                                capture_output=True, text=True)
+    except OSError:
+        return 'unknown'
+    return result.stdout.strip() if result.returncode == 0 and result.stdout.strip() else 'unknown'
+
+
+def sources_digest(config_dir=CONFIG_DIR):
+    """Digest of the config files a keymap build reads (everything in config/ but the output)"""
+    digest = hashlib.sha256()
+    for entry in sorted(os.scandir(config_dir), key=lambda e: e.name):
+        if entry.name.startswith(OUTPUT_NAME) or not entry.is_file():
+            continue
+        digest.update(entry.name.encode() + b'\0')
+        with open(entry.path, 'rb') as f:
+            digest.update(f.read())
+        digest.update(b'\0')
+    return digest.hexdigest()[:16]
+
+
+def stable_state(commit, config_dir=CONFIG_DIR):
+    """The fields that decide whether the message (and its timestamp) must change"""
+    return f"format={FORMAT} commit={commit or '-'} sources={sources_digest(config_dir)}"
+
+
+def current_state(config_dir=CONFIG_DIR):
+    """
+    (stable state, message) of the build_info.dtsi a build would compile now: the
+    existing file's, or the state generate() would write (message None) if there is none
+    """
+    try:
+        existing = (Path(config_dir) / OUTPUT_NAME).read_text()
+    except OSError:
+        return stable_state(None, config_dir), None
+    match = STATE_RE.search(existing)
+    return (match.group(1) if match else ''), decode(existing)
+
+
+def render(state, commit, timestamp):
+    message = f"Built from commit {commit} {timestamp}" if commit else f"ZMK built {timestamp}"
+    return message, TEMPLATE.format(state=state, keycodes=encode(message))
+
+
+@traced('build_info.generate')
+def generate(config_dir=CONFIG_DIR, commit=None, force=False):
+    """
+    Bring build_info.dtsi up to date. Returns (message, written): written is
+    False when the stable fields match the existing file, which is left alone.
+    """
+    path = Path(config_dir) / OUTPUT_NAME
+    state = stable_state(commit, config_dir)
+    try:
+        existing = path.read_text()
+    except OSError:
+        existing = None
+
+    if existing is not None and not force:
+        match = STATE_RE.search(existing)
+        if match and match.group(1) == state and decode(existing):
+            return decode(existing), False
+
+    message, content = render(state, commit, time.strftime(TIMESTAMP_FORMAT))
+    if content == existing:
+        return message, False
+    tmp = path.with_name(OUTPUT_NAME + '.tmp')
+    tmp.write_text(content)
+    os.replace(tmp, path)
+    return message, True
+
+
+def main():
+    import argparse
+    from tracing import add_profile_argument, setup_profile
+
+    parser = argparse.ArgumentParser(description='Generate config/build_info.dtsi, rewriting it only when it changes')
+    parser.add_argument('--commit', nargs='?', const='', metavar='HASH',
+                        help='Prefix the message with a commit (default hash: the current HEAD)')
+    parser.add_argument('--force', action='store_true', help='Refresh the timestamp even if nothing changed')
+    parser.add_argument('--config-dir', default=str(CONFIG_DIR), help='Directory to write build_info.dtsi to')
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    setup_profile(args)
+
+    commit = args.commit
+    if commit == '':
+        commit = current_commit()
+    message, written = generate(args.config_dir, commit, args.force)
+    if written:
+        print(f"Generated {OUTPUT_NAME}: {message}")
+    else:
+        print(f"{OUTPUT_NAME} unchanged: {message}")
+
+
+if __name__ == "__main__":
+    main()
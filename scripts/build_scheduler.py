@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+Parallel ZMK build scheduler
+Expands build.yaml once, selects targets with the same expressions as
+`just build`, runs the shared prerequisites once, and runs the `west build`
+jobs on a worker pool with one log file per target.
+"""
+
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from tracing import add_span, span, tracing_enabled
+from verify import write_fingerprint
+
+# Constants
+REPO_ROOT = Path(__file__).resolve().parent.parent
+PREREQUISITES = ['_check_upstream', '_check_west_update', '_adjust_leader_config', '_generate_build_info']
+MATRIX_KEYS = ['board', 'shield', 'snippet', 'artifact-name', 'cmake-args']
+
+# `west build` output lines that start each stage, in order (for trace spans)
+WEST_STAGES = [
+    ('west.configure', re.compile(r'^-- west build: generating a build system')),
+    ('west.devicetree', re.compile(r'^-- Found BOARD\.dts')),
+    ('west.kconfig', re.compile(r'^Parsing .*Kconfig$')),
+    ('west.cmake', re.compile(r'^Configuration saved to')),
+    ('west.compile', re.compile(r'^-- west build: building application')),
+    ('west.link', re.compile(r'Linking C executable zephyr/zephyr')),
+    ('west.image', re.compile(r'Generating .*zmk\.(uf2|hex|bin)|Converting to uf2')),
+]
+
+BuildResult = namedtuple('BuildResult', 'target ok seconds log_path output error cached', defaults=(False,))
+
+
+class BuildTarget(namedtuple('BuildTarget', 'board shield snippet artifact_name cmake_args')):
+    """One board/shield combination from build.yaml. Missing fields are empty strings."""
+
+    __slots__ = ()
+
+    @property
+    def artifact(self):
+        """Artifact name, defaulting to <shield>-<board> the way _build_single does"""
+        if self.artifact_name:
+            return self.artifact_name
+        if self.shield:
+            return f"{self.shield.replace(' ', '+')}-{self.board}"
+        return self.board
+
+    @property
+    def line(self):
+        """The comma-joined form that `just _parse_targets` greps"""
+        return ','.join(self)
+
+
+def _value(entry, key):
+    value = entry.get(key)
+    return '' if value is None else str(value)
+
+
+def load_build_matrix(path=None):
+    """Expand build.yaml (top-level arrays plus `include` entries) into BuildTargets"""
+    import itertools
+    import yaml
+
+    path = path or REPO_ROOT / 'build.yaml'
+    with open(path, 'r') as f:
+        config = yaml.safe_load(f) or {}
+
+    targets = []
+    axes = []
+    for key in MATRIX_KEYS:
+        value = config.get(key)
+        if value is None:
+            value = [None]
+        elif not isinstance(value, list):
+            value = [value]
+        axes.append(value)
+    for combination in itertools.product(*axes):
+        target = BuildTarget(*('' if v is None else str(v) for v in combination))
+        if target.board:
+            targets.append(target)
+
+    for entry in config.get('include') or []:
+        target = BuildTarget(*(_value(entry, key) for key in MATRIX_KEYS))
+        if target.board:
+            targets.append(target)
+    return targets
+
+
+def select_targets(matrix, expressions):
+    """
+    Select targets matching any of the expressions (case-insensitive regex
+    against the comma-joined matrix line; a leading "all" matches everything).
+    Each artifact appears once, in build.yaml order.
+    """
+    patterns = [re.compile(re.sub(r'^all', '.*', expr), re.IGNORECASE) for expr in expressions]
+    selected = []
+    seen = set()
+    for target in matrix:
+        if target.artifact in seen:
+            continue
+        if any(p.search(target.line) for p in patterns):
+            seen.add(target.artifact)
+            selected.append(target)
+    return selected
+
+
+def run_prerequisites(root=REPO_ROOT):
+    """
+    Run the upstream/west/leader/build-info steps once for the whole batch.
+    When tracing, each step runs as its own `just` call so it gets its own span.
+    """
+    steps = [[step] for step in PREREQUISITES] if tracing_enabled() else [PREREQUISITES]
+    for recipes in steps:
+        try:
+            with span('prereq.' + '+'.join(r.lstrip('_') for r in recipes)):
+                result = subprocess.run(['just'] + recipes, cwd=root)
+        except FileNotFoundError:
+            print("❌ 'just' command not found. Please ensure 'just' is installed and in your PATH.")
+            return False
+        if result.returncode != 0:
+            return False
+    return True
+
+
+def west_command(target, build_dir, root=REPO_ROOT, west_args=()):
+    """The `west build` invocation _build_single would run for this target"""
+    cmd = ['west', 'build', '-s', 'zmk/app', '-d', str(build_dir), '-b', target.board]
+    cmd.extend(west_args)
+    if target.snippet:
+        cmd.extend(['-S', target.snippet])
+    cmd.extend(['--', f"-DZMK_CONFIG={root / 'config'}"])
+    if target.shield:
+        cmd.append(f"-DSHIELD={target.shield}")
+    if target.cmake_args and target.cmake_args != 'null':
+        # Same substitutions as the Justfile: local workspace, EXTRA_CONF_FILE, no quotes
+        flags = target.cmake_args.replace('${GITHUB_WORKSPACE}', str(root))
+        flags = flags.replace('-DZMK_EXTRA_CONF_FILE=', '-DEXTRA_CONF_FILE=')
+        cmd.extend(shlex.split(flags.replace('"', '')))
+    return cmd
+
+
+class WestStageTracker:
+    """Turns `west build` output, fed line by line, into one trace span per stage"""
+
+    def __init__(self, artifact):
+        self.artifact = artifact
+        self.stage = -1
+        self.started = None
+
+    def feed(self, line, now=None):
+        for index in range(self.stage + 1, len(WEST_STAGES)):
+            if WEST_STAGES[index][1].search(line):
+                now = time.perf_counter() if now is None else now
+                self.close(now)
+                self.stage, self.started = index, now
+                return
+
+    def close(self, now=None):
+        if self.started is not None:
+            add_span(WEST_STAGES[self.stage][0], self.started, time.perf_counter() if now is None else now,
+                     target=self.artifact)
+            self.started = None
+
+
+def run_west_traced(cmd, root, log, artifact):
+    """Run west with its output copied to the log line by line, recording a span per build stage"""
+    tracker = WestStageTracker(artifact)
+    process = subprocess.Popen(cmd, cwd=root, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               stdin=subprocess.DEVNULL, text=True, errors='replace')
+    with process:
+        for line in process.stdout:
+            log.write(line)
+            tracker.feed(line.rstrip('\n'))
+    tracker.close()
+    return process.returncode
+
+
+def build_one(target, root=REPO_ROOT, west_args=(), log_dir=None, cache=None):
+    """
+    Build a single target with its output going to a log file, then copy the artifact.
+    With a BuildCache, a cached image for the same inputs is restored instead.
+    """
+    with span('build.target', target=target.artifact) as s:
+        result = _build_one(target, root, west_args, log_dir, cache)
+        s.set(ok=result.ok, cached=result.cached)
+    return result
+
+
+def _build_one(target, root, west_args, log_dir, cache):
+    build_dir = root / '.build' / target.artifact
+    log_dir = Path(log_dir or root / '.build' / 'logs')
+    log_path = log_dir / f"{target.artifact}.log"
+
+    start = time.monotonic()
+    key = None
+    if cache:
+        with span('build.cache_lookup', target=target.artifact):
+            key = cache.key(target, west_args)
+            output = cache.restore(target, key, root / 'firmware')
+        if output:
+            return BuildResult(target, True, time.monotonic() - start, None, output, None, True)
+
+    log_dir.mkdir(parents=True, exist_ok=True)
+    cmd = west_command(target, build_dir, root, west_args)
+    try:
+        with open(log_path, 'w') as log:
+            log.write(f"$ {shlex.join(cmd)}\n")
+            log.flush()
+            if tracing_enabled():
+                returncode = run_west_traced(cmd, root, log, target.artifact)
+            else:
+                returncode = subprocess.run(cmd, cwd=root, stdout=log, stderr=subprocess.STDOUT,
+                                            stdin=subprocess.DEVNULL).returncode
+    except FileNotFoundError:
+        return BuildResult(target, False, time.monotonic() - start, log_path, None, "'west' command not found")
+
+    if returncode != 0:
+        return BuildResult(target, False, time.monotonic() - start, log_path, None,
+                           f"west build exited with status {returncode}")
+
+    out_dir = root / 'firmware'
+    out_dir.mkdir(exist_ok=True)
+    for suffix in ('uf2', 'bin'):
+        image = build_dir / 'zephyr' / f"zmk.{suffix}"
+        if image.exists():
+            output = out_dir / f"{target.artifact}.{suffix}"
+            shutil.copyfile(image, output)
+            write_fingerprint(output, build_dir, root / 'config' / 'build_info.dtsi')
+            if cache:
+                cache.store(target, key, output)
+            return BuildResult(target, True, time.monotonic() - start, log_path, output, None)
+    return BuildResult(target, False, time.monotonic() - start, log_path, None, 'no zmk.uf2 or zmk.bin produced')
+
+
+def default_jobs():
+    return os.cpu_count() or 1
+
+
+def build_all(targets, jobs=None, root=REPO_ROOT, west_args=(), log_dir=None, cache=None):
+    """Build targets on a pool of `jobs` workers. Returns BuildResults in target order."""
+    if not targets:
+        return []
+    jobs = max(1, min(jobs or default_jobs(), len(targets)))
+    lock = threading.Lock()
+    print(f"🔨 Building {len(targets)} target(s) with {jobs} worker(s), logs in {log_dir or root / '.build' / 'logs'}")
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(build_one, t, root, west_args, log_dir, cache): t for t in targets}
+        for future in as_completed(futures):
+            result = future.result()
+            results[result.target.artifact] = result
+            with lock:
+                status = '✅' if result.ok else '❌'
+                source = ', cached' if result.cached else ''
+                print(f"{status} {result.target.artifact} ({result.seconds:.1f}s{source})")
+                sys.stdout.flush()
+    if cache:
+        cache.save()
+    return [results[t.artifact] for t in targets]
+
+
+def all_cached(targets, cache, west_args=()):
+    """True if every target can be restored from the cache (prerequisites can then be skipped)"""
+    return all(cache.lookup(cache.key(t, west_args)) for t in targets)
+
+
+def open_cache(root=REPO_ROOT):
+    """The firmware cache, or None when PyYAML (needed for west.yml) is missing"""
+    import importlib.util
+
+    if importlib.util.find_spec('yaml') is None:
+        return None
+    from build_cache import BuildCache
+    return BuildCache(root)
+
+
+def run_builds(targets, jobs=None, west_args=(), use_cache=True, prerequisites=True):
+    """
+    Build targets the way `just build` would: the shared prerequisites once
+    (skipped when every target is cached), then the parallel builds, then the
+    summary table. Returns the BuildResults, or None if the prerequisites failed.
+    """
+    start = time.monotonic()
+    cache = open_cache() if use_cache else None
+    if cache and all_cached(targets, cache, west_args):
+        print("📦 All targets are cached, skipping prerequisites")
+    elif prerequisites:
+        if not run_prerequisites():
+            print("❌ Build prerequisites failed")
+            return None
+        if cache:
+            cache.refresh()
+
+    results = build_all(targets, jobs, west_args=west_args, cache=cache)
+    print_summary(results, time.monotonic() - start)
+    return results
+
+
+def print_summary(results, wall_seconds=None):
+    """Print a table of per-target durations and return the number of successes"""
+    if not results:
+        return 0
+    width = max(len(r.target.artifact) for r in results)
+    print(f"\n   {'Target':<{width}}  Time")
+    for r in results:
+        status = '✅' if r.ok else '❌'
+        source = '  (cached)' if r.cached else ''
+        print(f"{status} {r.target.artifact:<{width}}  {r.seconds:6.1f}s{source}")
+        if r.error:
+            print(f"     {r.error} (see {r.log_path})")
+    succeeded = sum(1 for r in results if r.ok)
+    cached = sum(1 for r in results if r.cached)
+    total_seconds = sum(r.seconds for r in results)
+    line = f"\n🎉 Built {succeeded}/{len(results)} targets"
+    if cached:
+        line += f" ({cached} from cache)"
+    if wall_seconds is not None:
+        line += f" in {wall_seconds:.1f}s (sum of builds {total_seconds:.1f}s)"
+    print(line)
+    return succeeded
+
+
+def main():
+    import argparse
+    from tracing import add_profile_argument, setup_profile
+
+    parser = argparse.ArgumentParser(description='Build ZMK firmware for build.yaml targets in parallel',
+                                     epilog='Arguments after -- are passed on to west build (e.g. -- -p)')
+    parser.add_argument('expr', nargs='*', default=['all'],
+                        help='Target expressions, as for `just build` (default: all)')
+    parser.add_argument('--jobs', '-j', type=int, default=default_jobs(),
+                        help=f'Number of parallel builds (default: CPU count, {default_jobs()})')
+    parser.add_argument('--no-prereqs', action='store_true',
+                        help='Skip the upstream/west/leader/build-info prerequisites')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Always run west build, ignoring the firmware cache')
+    parser.add_argument('--offline', action='store_true',
+                        help='Do not fetch upstream or run west update (same as ZMK_OFFLINE=1)')
+    parser.add_argument('--list', '-l', action='store_true',
+                        help='List matching targets without building')
+    parser.add_argument('--dry-run', '-n', action='store_true',
+                        help='Show the west commands without running them')
+    add_profile_argument(parser)
+
+    argv = sys.argv[1:]
+    west_args = []
+    if '--' in argv:
+        split = argv.index('--')
+        argv, west_args = argv[:split], argv[split + 1:]
+    args = parser.parse_args(argv)
+    setup_profile(args)
+    if args.offline:
+        os.environ['ZMK_OFFLINE'] = '1'  # Inherited by the prerequisite recipes
+
+    try:
+        targets = select_targets(load_build_matrix(), args.expr or ['all'])
+    except ImportError:
+        print("❌ PyYAML is required to read build.yaml")
+        sys.exit(1)
+    if not targets:
+        print("No matching targets found. Aborting...", file=sys.stderr)
+        sys.exit(1)
+
+    if args.list:
+        for target in targets:
+            print(target.artifact)
+        return
+
+    if args.dry_run:
+        for target in targets:
+            print(shlex.join(west_command(target, REPO_ROOT / '.build' / target.artifact, west_args=west_args)))
+        return
+
+    results = run_builds(targets, args.jobs, west_args, not args.no_cache, not args.no_prereqs)
+    if results is None or not all(r.ok for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Combo and leader-sequence capacity analyzer
+Measures what the keymaps actually need (combos per key, key positions per
+combo, leader sequences and their length) from the preprocessed keymap model,
+compares it with the CONFIG_ZMK_COMBO_* / CONFIG_ZMK_LEADER_* limits in the
+.conf files, and estimates the static RAM each setting costs.
+"""
+
+import re
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+from keymap_model import CONFIG_DIR, keymap_files, load_models
+
+# Constants
+# Kconfig defaults (zmk app/Kconfig and zmk-leader-key) used when a .conf does not set a value
+KCONFIG_DEFAULTS = {
+    'CONFIG_ZMK_COMBO_MAX_COMBOS_PER_KEY': 5,
+    'CONFIG_ZMK_COMBO_MAX_KEYS_PER_COMBO': 4,
+    'CONFIG_ZMK_COMBO_MAX_PRESSED_COMBOS': 4,
+    'CONFIG_ZMK_LEADER_MAX_SEQUENCES': 32,
+    'CONFIG_ZMK_LEADER_MAX_KEYS_PER_SEQUENCE': 5,
+}
+POINTER_SIZE = 4  # nRF52840 / RP2040 are 32-bit
+COMBO_CFG_FIXED = 28  # combo_cfg fields besides key_positions (binding, timeouts, layer mask, ...)
+LEADER_CFG_FIXED = 24  # leader sequence fields besides the key list
+
+
+def combo_ram(limits, keymap_len, combo_count):
+    """Estimated static RAM (bytes) of the combo engine for the given limits"""
+    per_key = limits['CONFIG_ZMK_COMBO_MAX_COMBOS_PER_KEY']
+    keys = limits['CONFIG_ZMK_COMBO_MAX_KEYS_PER_COMBO']
+    pressed = limits['CONFIG_ZMK_COMBO_MAX_PRESSED_COMBOS']
+    lookup = keymap_len * per_key * POINTER_SIZE  # combo_lookup[ZMK_KEYMAP_LEN][MAX_COMBOS_PER_KEY]
+    configs = combo_count * (keys * 4 + COMBO_CFG_FIXED)  # key_positions[MAX_KEYS_PER_COMBO] per combo
+    candidates = per_key * (POINTER_SIZE + 4)  # candidate pointer plus timeout
+    pressed_keys = keys * POINTER_SIZE
+    active = pressed * (POINTER_SIZE + keys * POINTER_SIZE + 4)
+    return lookup + configs + candidates + pressed_keys + active
+
+
+def leader_ram(limits, sequence_count):
+    """Estimated static RAM (bytes) of the leader key for the given limits"""
+    sequences = limits['CONFIG_ZMK_LEADER_MAX_SEQUENCES']
+    keys = limits['CONFIG_ZMK_LEADER_MAX_KEYS_PER_SEQUENCE']
+    candidates = 2 * sequences * POINTER_SIZE  # candidate and completed-candidate lists
+    configs = sequence_count * (keys * 4 + LEADER_CFG_FIXED)
+    current = keys * 4
+    return candidates + configs + current
+
+
+def read_conf_limits(path):
+    """The CONFIG_ZMK_COMBO_* / CONFIG_ZMK_LEADER_* values set in a .conf file"""
+    values = {}
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                match = re.match(r'\s*(CONFIG_ZMK_(?:COMBO|LEADER)_\w+)\s*=\s*(\d+)', line)
+                if match:
+                    values[match.group(1)] = int(match.group(2))
+    except OSError:
+        pass
+    return values
+
+
+def conf_files_for(keymap_name, config_dir=CONFIG_DIR):
+    """The keymap's own .conf followed by the per-variant overlays (eyelash_corne_bureau.conf, ...)"""
+    stem = Path(keymap_name).stem
+    own = Path(config_dir) / f"{stem}.conf"
+    variants = sorted(p for p in Path(config_dir).glob(f"{stem}_*.conf"))
+    return ([own] if own.exists() else []) + variants
+
+
+def effective_limits(conf_files):
+    """Per .conf file: Kconfig defaults overridden by the base .conf, then by the file itself"""
+    base = dict(KCONFIG_DEFAULTS)
+    result = {}
+    for index, path in enumerate(conf_files):
+        limits = dict(base)
+        limits.update(read_conf_limits(path))
+        if index == 0:
+            base = limits
+        result[path] = limits
+    return result
+
+
+class Capacity:
+    """What one keymap needs, with the positions and combos that set each requirement"""
+
+    def __init__(self, model):
+        self.model = model
+        per_key = model.combos_per_key()
+        self.busiest_keys = sorted(per_key.items(), key=lambda item: (-item[1], str(item[0])))
+        self.max_combos_per_key = self.busiest_keys[0][1] if per_key else 0
+        self.max_keys_per_combo = max((len(c.key_positions) for c in model.combos), default=0)
+        self.leader_count = len(model.leader_sequences)
+        self.max_sequence_length = max((len(s.sequence) for s in model.leader_sequences), default=0)
+        self.symbolic = any(not isinstance(p, int) for p in per_key)
+        # Shared fragments have no layers; size the lookup table by the positions used
+        self.keymap_len = model.key_count or len(per_key)
+
+    def required(self, leader_margin=0, combo_margin=0):
+        """{option: value} tight limits (plus optional headroom)"""
+        return {
+            'CONFIG_ZMK_COMBO_MAX_COMBOS_PER_KEY': self.max_combos_per_key + combo_margin,
+            'CONFIG_ZMK_COMBO_MAX_KEYS_PER_COMBO': self.max_keys_per_combo,
+            'CONFIG_ZMK_LEADER_MAX_SEQUENCES': self.leader_count + leader_margin,
+            'CONFIG_ZMK_LEADER_MAX_KEYS_PER_SEQUENCE': self.max_sequence_length,
+        }
+
+    def ram(self, limits):
+        return (combo_ram(limits, self.keymap_len, len(self.model.combos)),
+                leader_ram(limits, self.leader_count))
+
+    def example(self, option):
+        """A combo or sequence that needs the full value of an option"""
+        model = self.model
+        if option == 'CONFIG_ZMK_COMBO_MAX_COMBOS_PER_KEY' and self.busiest_keys:
+            position, count = self.busiest_keys[0]
+            return f"key {position} is in {count} combos"
+        if option == 'CONFIG_ZMK_COMBO_MAX_KEYS_PER_COMBO':
+            for combo in model.combos:
+                if len(combo.key_positions) == self.max_keys_per_combo:
+                    return f"combo_{combo.name}"
+        if option == 'CONFIG_ZMK_LEADER_MAX_KEYS_PER_SEQUENCE':
+            for sequence in model.leader_sequences:
+                if len(sequence.sequence) == self.max_sequence_length:
+                    return f"{sequence.name} ({' '.join(sequence.sequence)})"
+        if option == 'CONFIG_ZMK_LEADER_MAX_SEQUENCES':
+            return f"{self.leader_count} sequences"
+        return ''
+
+
+def apply_limits(path, values):
+    """Rewrite or append CONFIG_ lines in a .conf file. Returns the options changed."""
+    with open(path, 'r') as f:
+        lines = f.read().splitlines()
+    changed = []
+    for option, value in values.items():
+        pattern = re.compile(rf'^\s*{option}\s*=')
+        for index, line in enumerate(lines):
+            if pattern.match(line):
+                if line.strip() != f"{option}={value}":
+                    lines[index] = f"{option}={value}"
+                    changed.append(option)
+                break
+        else:
+            lines.append(f"{option}={value}")
+            changed.append(option)
+    if changed:
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+    return changed
+
+
+def report(capacity, leader_margin, combo_margin, verbose=False):
+    """
+    Print one keymap's requirements against its .conf files.
+    Returns (undersized, maybe undersized): limits found short by an approximate model only count as the latter.
+    """
+    model = capacity.model
+    required = capacity.required(leader_margin, combo_margin)
+    conf_files = conf_files_for(model.name)
+    shared = capacity.symbolic and not conf_files and not model.fallbacks
+    print(f"📋 {model.name}: {len(model.combos)} combos, {capacity.leader_count} leader sequences"
+          + (" (symbolic key positions, shared fragment)" if shared else ''))
+    if model.fallbacks:
+        print("   ⚠️  Approximate: zmk-helpers is missing from the west workspace (run `just init`), "
+              "so the keymap was read with built-in stand-ins")
+    elif model.approximate and conf_files:
+        print("   ⚠️  Approximate: no key-label header resolved some key positions; they are counted by label")
+    for option, value in required.items():
+        print(f"   {option:<42} needs {value:>3}   {capacity.example(option)}")
+    if verbose and capacity.busiest_keys:
+        busiest = ', '.join(f"{p}:{n}" for p, n in capacity.busiest_keys[:8])
+        print(f"   Busiest keys (position:combos): {busiest}")
+
+    tight = dict(KCONFIG_DEFAULTS)
+    tight.update(required)
+    tight_combo, tight_leader = capacity.ram(tight)
+
+    undersized = uncertain = 0
+    if not conf_files:
+        print(f"   Tight limits cost about {tight_combo + tight_leader} bytes of RAM (no .conf file found)")
+    for path, limits in effective_limits(conf_files).items():
+        combo, leader = capacity.ram(limits)
+        problems = [f"{option.replace('CONFIG_ZMK_', '')}={limits[option]} < {value}"
+                    for option, value in required.items() if limits[option] < value]
+        if model.approximate:
+            uncertain += len(problems)
+            status = '⚠️ ' if problems else '✅'
+        else:
+            undersized += len(problems)
+            status = '❌' if problems else '✅'
+        waste = combo + leader - tight_combo - tight_leader
+        print(f"   {status} {path.name:<30} combo {combo:>6} B  leader {leader:>6} B"
+              + (f"   ({waste:+d} B vs tight)" if waste else ''))
+        for problem in problems:
+            print(f"      {'may be undersized' if model.approximate else 'undersized'}: {problem}")
+    print()
+    return undersized, uncertain
+
+
+def main():
+    import argparse
+    from tracing import add_profile_argument, setup_profile
+
+    parser = argparse.ArgumentParser(description='Size combo and leader-key limits from the keymaps')
+    parser.add_argument('keymaps', nargs='*',
+                        help='Keymaps to analyze (default: every config/*.keymap, including shared ones)')
+    parser.add_argument('--leader-margin', type=int, default=0,
+                        help='Spare leader sequences to leave room for (default: 0)')
+    parser.add_argument('--combo-margin', type=int, default=0,
+                        help='Spare combos per key to leave room for (default: 0)')
+    parser.add_argument('--check', action='store_true', help='Exit with status 1 if any limit is undersized')
+    parser.add_argument('--apply', action='store_true',
+                        help="Write the tight limits into each keymap's .conf files")
+    parser.add_argument('--verbose', '-v', action='store_true', help='Show the busiest key positions')
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    setup_profile(args)
+
+    models = load_models(args.keymaps or [p.name for p in keymap_files()])
+    undersized = uncertain = 0
+    for model in models.values():
+        capacity = Capacity(model)
+        short, maybe_short = report(capacity, args.leader_margin, args.combo_margin, args.verbose)
+        undersized += short
+        uncertain += maybe_short
+        if args.apply and model.approximate and conf_files_for(model.name):
+            print(f"📝 {model.name}: not applied, the limits are approximate")
+        elif args.apply and not capacity.symbolic:
+            values = capacity.required(args.leader_margin, args.combo_margin)
+            for path in conf_files_for(model.name)[:1]:  # Variants inherit from the base .conf
+                changed = apply_limits(path, values)
+                for variant in conf_files_for(model.name)[1:]:
+                    changed += apply_limits(variant, {o: v for o, v in values.items()
+                                                      if o in read_conf_limits(variant)})
+                print(f"📝 {model.name}: updated {len(changed)} setting(s)" if changed
+                      else f"📝 {model.name}: limits already tight")
+
+    if uncertain:
+        print(f"⚠️  {uncertain} limit(s) may be undersized; check again once `just init` has fetched the modules")
+    if undersized:
+        print(f"❌ {undersized} undersized limit(s): combos or leader sequences would be dropped")
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
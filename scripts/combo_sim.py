@@ -0,0 +1,650 @@
+#!/usr/bin/env python3
+"""
+Combo timing and conflict simulator
+Replays key-event timelines (press/release with millisecond timestamps)
+through a model of ZMK's combo engine followed by hold-tap and tap-dance
+resolution, using the definitions from the keymap model. Reports which
+combos fire, which are blocked or had to wait on longer candidates, and the
+latency each keystroke picks up, without building firmware.
+"""
+
+import random
+import sys
+import time
+from collections import namedtuple
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+from keymap_model import format_binding, load_model, parse_bindings, to_int
+
+# Constants
+DEFAULT_TAPPING_TERM = 200
+DEFAULT_FLAVOR = 'hold-preferred'
+WRAPPER_DEPTH = 4  # mod-morph / antecedent-morph levels followed to reach a hold-tap
+
+Event = namedtuple('Event', 'time position pressed')
+Keystroke = namedtuple('Keystroke', 'time origin source name action')
+ComboSpec = namedtuple('ComboSpec', 'index name mask positions timeout prior_idle layers action slow_release')
+HoldTapSpec = namedtuple('HoldTapSpec', 'name flavor tapping_term quick_tap prior_idle trigger_positions '
+                                        'trigger_on_release hold tap')
+TapDanceSpec = namedtuple('TapDanceSpec', 'name tapping_term actions')
+
+
+class SimResult:
+    """Outcome of one timeline"""
+
+    __slots__ = ('keystrokes', 'fired', 'blocked', 'ambiguous')
+
+    def __init__(self):
+        self.keystrokes = []  # Keystroke per output press, in output order
+        self.fired = []  # (combo name, time)
+        self.blocked = []  # (combo name, time all keys were down, reason)
+        self.ambiguous = []  # (combo name, ms spent waiting on longer candidates)
+
+    @property
+    def latencies(self):
+        return [k.time - k.origin for k in self.keystrokes]
+
+
+def _first_binding(tokens):
+    bindings = parse_bindings([str(t) for t in tokens]) if tokens else []
+    return bindings[0] if bindings else None
+
+
+def _prop_int(properties, name, default=None):
+    values = properties.get(name)
+    if isinstance(values, list) and values:
+        value = to_int(values[0])
+        if value is not None:
+            return value
+    return default
+
+
+class CompiledKeymap:
+    """Combos, bindings and behavior specs for one active layer, precomputed for fast replay"""
+
+    def __init__(self, model, layer=0):
+        self.model = model
+        self.layer = layer
+        self.combos = []
+        for combo in model.combos:
+            positions = tuple(p for p in combo.key_positions if isinstance(p, int))
+            if len(positions) != len(combo.key_positions):
+                continue  # Symbolic positions (keymap fragment without key labels)
+            mask = 0
+            for position in positions:
+                mask |= 1 << position
+            self.combos.append(ComboSpec(
+                len(self.combos), combo.name, mask, positions, combo.timeout_ms or 50,
+                combo.require_prior_idle_ms or 0, combo.layers,
+                ' '.join(format_binding(b) for b in combo.bindings), combo.slow_release))
+        self._index()
+        self.bindings = {}
+        self.hold_taps = {}
+        self.tap_dances = {}
+        for position in range(model.key_count):
+            binding = self._binding_at(position)
+            if binding is None:
+                continue
+            self.bindings[position] = format_binding(binding)
+            spec = self._behavior_spec(binding)
+            if isinstance(spec, HoldTapSpec):
+                self.hold_taps[position] = spec
+            elif isinstance(spec, TapDanceSpec):
+                self.tap_dances[position] = spec
+
+    def _index(self):
+        self.by_position = {}
+        for combo in self.combos:
+            for position in combo.positions:
+                self.by_position.setdefault(position, []).append(combo)
+        self.active_by_position = {
+            position: [c for c in combos if not c.layers or self.layer in c.layers]
+            for position, combos in self.by_position.items()
+        }
+
+    def with_timeouts(self, timeouts):
+        """A copy with some combo timeouts replaced ({name: ms}); bindings are shared"""
+        clone = object.__new__(CompiledKeymap)
+        clone.__dict__.update(self.__dict__)
+        clone.combos = [c._replace(timeout=timeouts.get(c.name, c.timeout)) for c in self.combos]
+        clone._index()
+        return clone
+
+    def combo(self, name):
+        for combo in self.combos:
+            if combo.name == name or f"combo_{combo.name}" == name:
+                return combo
+        return None
+
+    def _binding_at(self, position):
+        """Binding on the active layer, falling through &trans to lower layers"""
+        for index in range(self.layer, -1, -1):
+            if index >= len(self.model.layers):
+                continue
+            bindings = self.model.layers[index].bindings
+            if position < len(bindings) and bindings[position].behavior != 'trans':
+                return bindings[position]
+        return None
+
+    def _action(self, group, param):
+        """'&kp A' for a hold-tap half; behaviors with no binding cells take no parameter"""
+        if not group:
+            return '&?'
+        behavior = self.model.behaviors.get(group[0].behavior)
+        if behavior is not None and behavior.binding_cells == 0:
+            return '&' + group[0].behavior
+        return f"&{group[0].behavior} {param}".strip()
+
+    def _behavior_spec(self, binding, depth=0):
+        """HoldTapSpec / TapDanceSpec for a binding, looking through morph wrappers"""
+        behavior = self.model.behaviors.get(binding.behavior)
+        if behavior is None or depth > WRAPPER_DEPTH:
+            return None
+        properties = behavior.properties
+        if behavior.compatible == 'zmk,behavior-hold-tap':
+            hold, tap = ((properties.get('bindings') or []) + [[], []])[:2]
+            params = list(binding.params) + [''] * 2
+            flavor = properties.get('flavor')
+            return HoldTapSpec(
+                binding.behavior, flavor if isinstance(flavor, str) else DEFAULT_FLAVOR,
+                _prop_int(properties, 'tapping-term-ms', DEFAULT_TAPPING_TERM),
+                _prop_int(properties, 'quick-tap-ms', 0), _prop_int(properties, 'require-prior-idle-ms', 0),
+                frozenset(p for p in properties.get('hold-trigger-key-positions') or [] if isinstance(p, int))
+                if 'hold-trigger-key-positions' in properties else None,
+                properties.get('hold-trigger-on-release') is True,
+                self._action(hold, params[0]), self._action(tap, params[1]))
+        if behavior.compatible == 'zmk,behavior-tap-dance':
+            actions = [format_binding(group[0]) for group in properties.get('bindings') or [] if group]
+            return TapDanceSpec(binding.behavior, _prop_int(properties, 'tapping-term-ms', DEFAULT_TAPPING_TERM),
+                                actions or [format_binding(binding)])
+        if behavior.compatible == 'zmk,behavior-mod-morph':
+            groups = properties.get('bindings') or []
+            inner = groups[0][0] if groups and groups[0] else None
+        elif behavior.compatible == 'zmk,behavior-antecedent-morph':
+            inner = _first_binding(properties.get('defaults'))
+        else:
+            return None
+        return self._behavior_spec(inner, depth + 1) if inner else None
+
+
+class Simulator:
+    """
+    Two stages, as in the firmware's event chain:
+    the combo engine captures presses on combo positions until a combo
+    completes, a key outside the candidates arrives, a captured key is
+    released or the shortest candidate timeout (from the first press)
+    expires; the behavior stage then resolves hold-taps (capturing later
+    events until decided) and tap-dances (decided on the last tap, the
+    tapping term or an interrupting press).
+    """
+
+    def __init__(self, keymap):
+        self.keymap = keymap
+
+    def run(self, events):
+        result = SimResult()
+        stream = self._combos(sorted(events), result)
+        self._behaviors(stream, result)
+        return result
+
+    # -- combo engine ------------------------------------------------------
+
+    def _combos(self, events, result):
+        by_position = self.keymap.active_by_position
+        all_by_position = self.keymap.by_position
+        out = []  # (time, kind, key, pressed, origin); kind 'key' (position) or 'combo' (ComboSpec)
+        captured = []  # (position, press time)
+        candidates = []
+        first_time = 0
+        fully_pressed = None
+        active = {}  # combo index -> [ComboSpec, held mask]
+        combo_keys = {}  # position -> combo index while held as part of an active combo
+        last_tap = -1e9
+        held = 0
+        episodes = {}  # combo index -> time all its keys went down
+        fired_since = {}
+        reasons = {}
+
+        def cleanup(now, waited=False):
+            nonlocal captured, candidates, fully_pressed, last_tap
+            rest = captured
+            if fully_pressed is not None:
+                combo = fully_pressed
+                origin = max(t for p, t in captured if combo.mask >> p & 1)
+                out.append((now, 'combo', combo, True, origin))
+                result.fired.append((combo.name, now))
+                if waited or len(candidates) > 1:
+                    result.ambiguous.append((combo.name, now - origin))
+                active[combo.index] = [combo, combo.mask]
+                for position in combo.positions:
+                    combo_keys[position] = combo.index
+                fired_since[combo.index] = True
+                for other in candidates:
+                    if other is not combo:
+                        reasons[other.index] = f"combo_{combo.name} fired"
+                last_tap = now
+                rest = [(p, t) for p, t in captured if not combo.mask >> p & 1]
+            for position, pressed_at in rest:
+                out.append((now, 'key', position, True, pressed_at))
+                last_tap = now
+            captured = []
+            candidates = []
+            fully_pressed = None
+
+        def expire(until):
+            """Apply candidate timeouts that fall before `until`"""
+            nonlocal candidates
+            while candidates:
+                deadline = first_time + min(c.timeout for c in candidates)
+                if deadline > until:
+                    return
+                for c in candidates:
+                    if first_time + c.timeout <= deadline and c is not fully_pressed:
+                        reasons[c.index] = f"timeout ({c.timeout} ms)"
+                remaining = [c for c in candidates if first_time + c.timeout > deadline]
+                if len(remaining) < 2:
+                    if fully_pressed is not None and fully_pressed not in remaining:
+                        remaining.append(fully_pressed)
+                    candidates = remaining
+                    cleanup(deadline, waited=True)
+                    return
+                candidates = remaining
+
+        for t, position, pressed in events:
+            expire(t)
+            bit = 1 << position
+            if pressed:
+                held |= bit
+                for combo in all_by_position.get(position, ()):
+                    if held & combo.mask == combo.mask:
+                        episodes[combo.index] = t
+                        fired_since[combo.index] = False
+
+                if not captured:
+                    options = by_position.get(position)
+                    if options:
+                        idle = t - last_tap
+                        ready = [c for c in options if idle >= c.prior_idle]
+                        for c in options:
+                            if idle < c.prior_idle:
+                                reasons[c.index] = f"require-prior-idle ({c.prior_idle} ms, idle {idle:g} ms)"
+                        options = ready
+                    for c in all_by_position.get(position, ()):
+                        if c.layers and self.keymap.layer not in c.layers:
+                            reasons[c.index] = 'layer'
+                    if not options:
+                        out.append((t, 'key', position, True, t))
+                        last_tap = t
+                        continue
+                    candidates = options
+                    first_time = t
+                    captured = [(position, t)]
+                else:
+                    captured.append((position, t))
+                    narrowed = [c for c in candidates if c.mask & bit]
+                    if not narrowed:
+                        for c in candidates:
+                            reasons[c.index] = 'interrupted by a key outside the combo'
+                        cleanup(t)
+                        continue
+                    candidates = narrowed
+
+                pressed_mask = 0
+                for p, _ in captured:
+                    pressed_mask |= 1 << p
+                for c in candidates:
+                    if c.mask == pressed_mask:
+                        fully_pressed = c
+                        break
+                if fully_pressed is not None and len(candidates) == 1:
+                    cleanup(t)
+            else:
+                held &= ~bit
+                if any(p == position for p, _ in captured):
+                    if fully_pressed is None:
+                        for c in candidates:
+                            reasons[c.index] = 'key released before the combo completed'
+                    cleanup(t, waited=True)
+                for combo in all_by_position.get(position, ()):
+                    start = episodes.pop(combo.index, None)
+                    if start is not None and not fired_since.get(combo.index):
+                        result.blocked.append((combo.name, start, reasons.get(combo.index, 'not a candidate')))
+
+                index = combo_keys.pop(position, None)
+                if index is not None:
+                    entry = active.get(index)
+                    if entry is not None:
+                        combo = entry[0]
+                        entry[1] &= ~bit
+                        if not combo.slow_release or not entry[1]:
+                            out.append((t, 'combo', combo, False, t))
+                            del active[index]
+                    continue
+                out.append((t, 'key', position, False, t))
+
+        if captured:
+            expire(float('inf'))
+        return out
+
+    # -- hold-tap / tap-dance stage ----------------------------------------
+
+    def _behaviors(self, stream, result):
+        keymap = self.keymap
+        hold_taps = keymap.hold_taps
+        tap_dances = keymap.tap_dances
+        bindings = keymap.bindings
+        keystrokes = result.keystrokes
+        pending = None  # Undecided hold-tap: [spec, position, press time, origin, interrupt state]
+        buffer = []
+        dance = None  # [spec, position, taps, deadline, origin]
+        last_press = -1e9
+        last_tapped = {}  # position -> time of last hold-tap press resolved as tap
+        queue = list(reversed(stream))
+
+        def finish_dance(now):
+            nonlocal dance
+            spec, position, taps, _, origin = dance
+            action = spec.actions[min(taps, len(spec.actions)) - 1]
+            keystrokes.append(Keystroke(now, origin, 'dance', spec.name, action))
+            dance = None
+
+        def decide(now, hold):
+            nonlocal pending, buffer
+            spec, position, _, origin, _ = pending
+            if hold:
+                keystrokes.append(Keystroke(now, origin, 'hold', spec.name, spec.hold))
+            else:
+                keystrokes.append(Keystroke(now, origin, 'tap', spec.name, spec.tap))
+                last_tapped[position] = origin
+            pending = None
+            # Captured events are replayed at the decision time
+            replay, buffer = buffer, []
+            for item in reversed(replay):
+                queue.append((max(now, item[0]),) + item[1:])
+
+        while queue:
+            t, kind, key, pressed, origin = queue[-1]
+            if pending is not None:
+                deadline = pending[2] + pending[0].tapping_term
+                if deadline <= t:
+                    decide(deadline, True)
+                    continue
+            if dance is not None and dance[3] <= t:
+                finish_dance(dance[3])
+            queue.pop()
+
+            if pending is not None:
+                spec, ht_position = pending[0], pending[1]
+                if kind == 'key' and key == ht_position and not pressed:
+                    decide(t, False)
+                    queue.append((t, kind, key, pressed, origin))
+                    continue
+                buffer.append((t, kind, key, pressed, origin))
+                position = key if kind == 'key' else None
+                allowed = spec.trigger_positions is None or position in spec.trigger_positions
+                if pressed:
+                    pending[4].add(key if kind == 'key' else ('combo', key.index))
+                    if spec.flavor == 'hold-preferred':
+                        if not spec.trigger_on_release:
+                            decide(t, allowed)
+                    elif spec.flavor == 'tap-unless-interrupted':
+                        decide(t, False)
+                    elif spec.trigger_positions is not None and not allowed and not spec.trigger_on_release:
+                        decide(t, False)
+                else:
+                    token = key if kind == 'key' else ('combo', key.index)
+                    if token in pending[4] and spec.flavor in ('balanced', 'hold-preferred'):
+                        decide(t, allowed)
+                continue
+
+            if not pressed:
+                continue
+
+            if dance is not None and not (kind == 'key' and key == dance[1]):
+                finish_dance(t)
+
+            if kind == 'combo':
+                keystrokes.append(Keystroke(t, origin, 'combo', key.name, key.action))
+                last_press = t
+                continue
+
+            spec = hold_taps.get(key)
+            if spec is not None:
+                quick = spec.quick_tap and t - last_tapped.get(key, -1e9) < spec.quick_tap
+                idle = spec.prior_idle and t - last_press < spec.prior_idle
+                last_press = t
+                if quick or idle:
+                    keystrokes.append(Keystroke(t, origin, 'tap', spec.name, spec.tap))
+                    last_tapped[key] = origin
+                else:
+                    pending = [spec, key, t, origin, set()]
+                continue
+
+            spec = tap_dances.get(key)
+            if spec is not None:
+                last_press = t
+                if dance is not None:
+                    dance[2] += 1
+                    dance[3] = t + spec.tapping_term
+                else:
+                    dance = [spec, key, 1, t + spec.tapping_term, origin]
+                if dance[2] >= len(spec.actions):
+                    finish_dance(t)
+                continue
+
+            keystrokes.append(Keystroke(t, origin, 'key', str(key), bindings.get(key, '')))
+            last_press = t
+
+        if pending is not None:
+            decide(pending[2] + pending[0].tapping_term, True)
+            while queue:  # Events captured behind a hold-tap that never saw its release
+                t, kind, key, pressed, origin = queue.pop()
+                if pressed:
+                    keystrokes.append(Keystroke(t, origin, kind, str(key), bindings.get(key, '')))
+        if dance is not None:
+            finish_dance(dance[3])
+
+
+# ---------------------------------------------------------------------------
+# Timelines
+
+def parse_timelines(text):
+    """
+    Timelines in text form, separated by blank lines; one event per line:
+        <time ms> <position> <d|u>
+    Lines starting with # are comments.
+    """
+    timelines = []
+    current = []
+    for line in text.splitlines():
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            if current:
+                timelines.append(current)
+                current = []
+            continue
+        fields = line.replace(',', ' ').split()
+        if len(fields) != 3:
+            raise ValueError(f"Bad timeline line: {line!r}")
+        pressed = fields[2].lower() in ('d', 'down', 'p', 'press', '1')
+        current.append(Event(float(fields[0]), int(fields[1]), pressed))
+    if current:
+        timelines.append(current)
+    return timelines
+
+
+def chord(positions, start, spread, hold, rng):
+    """Pressing a combo: keys land within `spread` ms of each other (random order)"""
+    events = []
+    times = sorted(start + rng.uniform(0, spread) for _ in positions)
+    order = list(positions)
+    rng.shuffle(order)
+    for position, pressed_at in zip(order, times):
+        events.append(Event(pressed_at, position, True))
+        events.append(Event(times[-1] + hold + rng.uniform(0, spread), position, False))
+    return events
+
+
+def roll(positions, start, interval, overlap, rng):
+    """Typing the combo's keys as a fast roll: each key pressed `interval` ms apart, held `overlap` ms past the next"""
+    events = []
+    order = list(positions)
+    rng.shuffle(order)
+    t = start
+    for position in order:
+        events.append(Event(t, position, True))
+        events.append(Event(t + interval + overlap, position, False))
+        t += interval
+    return events
+
+
+def conflicts(keymap):
+    """Static conflicts: [(kind, combo, other, detail)]"""
+    found = []
+    combos = keymap.combos
+    for i, a in enumerate(combos):
+        for b in combos[i + 1:]:
+            shared_layers = not a.layers or not b.layers or set(a.layers) & set(b.layers)
+            if not shared_layers or not a.mask & b.mask:
+                continue
+            if a.mask == b.mask:
+                found.append(('duplicate', a, b, 'same key positions'))
+            elif a.mask & b.mask in (a.mask, b.mask):
+                small, large = (a, b) if a.mask & b.mask == a.mask else (b, a)
+                found.append(('prefix', small, large,
+                              f"waits up to {min(small.timeout, large.timeout)} ms for combo_{large.name}"))
+            elif a.timeout != b.timeout:
+                found.append(('overlap', a, b, f"share keys, timeouts {a.timeout}/{b.timeout} ms"))
+    for combo in combos:
+        taps = [p for p in combo.positions if p in keymap.hold_taps or p in keymap.tap_dances]
+        if taps:
+            found.append(('behavior', combo, None, f"positions {taps} are hold-taps/tap-dances"))
+    return found
+
+
+def sweep(keymap, combo, timeouts, trials, spread, interval, seed=1):
+    """[(timeout, fire rate of chords, false-fire rate of rolls, mean chord latency)]"""
+    rows = []
+    for timeout in timeouts:
+        simulator = Simulator(keymap.with_timeouts({combo.name: timeout}))
+        rng = random.Random(seed)
+        fired = false_fired = 0
+        latency = []
+        for _ in range(trials):
+            result = simulator.run(chord(combo.positions, 1000, spread, 80, rng))
+            hits = [k for k in result.keystrokes if k.source == 'combo' and k.name == combo.name]
+            if hits:
+                fired += 1
+                latency.append(hits[0].time - hits[0].origin)
+            result = simulator.run(roll(combo.positions, 1000, rng.uniform(*interval), rng.uniform(10, 40), rng))
+            if any(name == combo.name for name, _ in result.fired):
+                false_fired += 1
+        mean = sum(latency) / len(latency) if latency else float('nan')
+        rows.append((timeout, fired / trials, false_fired / trials, mean))
+    return rows
+
+
+def _range(text):
+    """"10:60:5" -> [10, 15, ..., 60]; "18,30,45" -> [18, 30, 45]"""
+    if ':' in text:
+        parts = [int(p) for p in text.split(':')]
+        start, stop, step = parts + [5] * (3 - len(parts))
+        return list(range(start, stop + 1, step))
+    return [int(p) for p in text.split(',')]
+
+
+def main():
+    import argparse
+    from tracing import add_profile_argument, setup_profile
+
+    parser = argparse.ArgumentParser(description='Simulate ZMK combo, hold-tap and tap-dance timing')
+    parser.add_argument('--keymap', '-k', default='eyelash_corne',
+                        help='Keymap to load (default: eyelash_corne)')
+    parser.add_argument('--layer', '-l', type=int, default=0, help='Active layer index (default: 0)')
+    subparsers = parser.add_subparsers(dest='command')
+
+    replay_parser = subparsers.add_parser('replay', help='Replay recorded timelines from a file (- for stdin)')
+    replay_parser.add_argument('file')
+    replay_parser.add_argument('--quiet', '-q', action='store_true', help='Only print totals')
+
+    subparsers.add_parser('conflicts', help='List overlapping, prefix and duplicate combos')
+
+    sweep_parser = subparsers.add_parser('sweep', help='Sweep combo timeouts with synthetic chords and rolls')
+    sweep_parser.add_argument('combos', nargs='*', help='Combo names (default: every combo on the layer)')
+    sweep_parser.add_argument('--timeouts', default='10:60:5', help='start:stop:step or a comma list (ms)')
+    sweep_parser.add_argument('--trials', type=int, default=200, help='Timelines per timeout (default: 200)')
+    sweep_parser.add_argument('--spread', type=float, default=25,
+                              help='Largest gap between chorded key presses in ms (default: 25)')
+    sweep_parser.add_argument('--interval', default='60,140',
+                              help='Inter-key interval range of rolls in ms (default: 60,140)')
+    sweep_parser.add_argument('--seed', type=int, default=1)
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    setup_profile(args)
+
+    path = Path(args.keymap)
+    if not path.exists():
+        path = Path(__file__).resolve().parent.parent / 'config' / f"{args.keymap.removesuffix('.keymap')}.keymap"
+    keymap = CompiledKeymap(load_model(path), args.layer)
+    print(f"📋 {path.name}, layer {args.layer}: {len(keymap.combos)} combos, "
+          f"{len(keymap.hold_taps)} hold-taps, {len(keymap.tap_dances)} tap-dances")
+    if keymap.model.approximate:
+        print("   ⚠️  Approximate: module headers are missing from the west workspace (run `just init`); "
+              "combos with unresolved key positions are not simulated")
+
+    if args.command == 'replay':
+        text = sys.stdin.read() if args.file == '-' else Path(args.file).read_text()
+        timelines = parse_timelines(text)
+        simulator = Simulator(keymap)
+        start = time.perf_counter()
+        results = [simulator.run(timeline) for timeline in timelines]
+        elapsed = time.perf_counter() - start
+        for number, result in enumerate(results, 1):
+            if args.quiet:
+                continue
+            print(f"\nTimeline {number}:")
+            for k in result.keystrokes:
+                print(f"   {k.time:8.1f} ms  +{k.time - k.origin:5.1f}  {k.source:<6} {k.action}")
+            for name, waited in result.ambiguous:
+                print(f"   ⏳ combo_{name} waited {waited:.1f} ms for longer candidates")
+            for name, at, reason in result.blocked:
+                print(f"   🚫 combo_{name} (keys down at {at:.1f} ms): {reason}")
+        latencies = [l for r in results for l in r.latencies]
+        print(f"\n{len(timelines)} timeline(s) in {elapsed * 1000:.1f} ms "
+              f"({len(timelines) / elapsed if elapsed else 0:.0f}/s); "
+              f"{sum(len(r.fired) for r in results)} combo(s) fired, "
+              f"{sum(len(r.blocked) for r in results)} blocked; mean added latency "
+              f"{sum(latencies) / len(latencies) if latencies else 0:.1f} ms")
+
+    elif args.command == 'sweep':
+        names = args.combos or [c.name for c in keymap.combos if not c.layers or args.layer in c.layers]
+        timeouts = _range(args.timeouts)
+        interval = tuple(float(v) for v in args.interval.split(','))
+        count = 0
+        start = time.perf_counter()
+        for name in names:
+            combo = keymap.combo(name)
+            if combo is None:
+                print(f"❌ No combo named {name}")
+                continue
+            print(f"\ncombo_{combo.name} {combo.positions} (configured {combo.timeout} ms)")
+            print("   timeout  fires  false-fires  latency")
+            for timeout, fire_rate, false_rate, latency in sweep(keymap, combo, timeouts, args.trials,
+                                                                  args.spread, interval, args.seed):
+                marker = ' <' if timeout == combo.timeout else ''
+                print(f"   {timeout:5d} ms  {fire_rate:5.0%}  {false_rate:9.0%}  {latency:6.1f} ms{marker}")
+            count += 2 * args.trials * len(timeouts)
+        elapsed = time.perf_counter() - start
+        print(f"\n{count} timelines in {elapsed:.2f}s ({count / elapsed if elapsed else 0:.0f}/s)")
+
+    else:
+        found = conflicts(keymap)
+        for kind, combo, other, detail in found:
+            pair = f"combo_{combo.name}" + (f" / combo_{other.name}" if other else '')
+            print(f"   {kind:<9} {pair:<50} {detail}")
+        print(f"{len(found)} finding(s)")
+
+
+if __name__ == "__main__":
+    main()
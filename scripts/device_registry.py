@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Registry of known ZMK devices
+Loads ~/.config/zmk/devices.yaml (or the older devices.conf) once into compact
+records indexed by serial, name, side and variant. The parsed result is cached
+in ~/.cache/zmk and reused until the file's mtime or size changes, so
+repeated CLI calls and shell completion do not re-import PyYAML or re-parse.
+"""
+
+import os
+import pickle
+from collections import namedtuple
+from pathlib import Path
+
+from matcher import load_rules
+
+# Constants
+CONFIG_DIR = Path.home() / ".config" / "zmk"
+CACHE_DIR = Path.home() / ".cache" / "zmk"
+CACHE_VERSION = 1
+STANDARD_KEYS = ('name', 'type', 'notes', 'side')
+
+
+def determine_firmware_variant(device_name, device_side=None):
+    """
+    Determine which firmware variant a device uses based on its name
+    (the variants are listed in device_rules.json).
+    Returns None for the base variant (no suffix).
+    """
+    return load_rules().variant(device_name)
+
+
+class Device(namedtuple('Device', 'serial name type notes side variant extra')):
+    """
+    One configured device. `extra` holds any other keys from devices.yaml.
+    `variant` is the explicit `variant:` key if present, otherwise derived from the name.
+    Also readable like the dicts the tools used before: device['name'], device.get('side').
+    """
+
+    __slots__ = ()
+
+    def get(self, key, default=None):
+        if key in self._fields and key != 'extra':
+            value = getattr(self, key)
+            return default if value is None else value
+        return self.extra.get(key, default)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key in self._fields and key != 'extra':
+                return getattr(self, key)
+            return self.extra[key]
+        return tuple.__getitem__(self, key)
+
+    def as_dict(self):
+        """The devices.yaml mapping for this device"""
+        data = {'name': self.name, 'type': self.type, 'notes': self.notes}
+        if self.side is not None:
+            data['side'] = self.side
+        data.update(self.extra)
+        return data
+
+
+def make_device(serial, info):
+    """Build a Device from a devices.yaml mapping, filling in the standard defaults"""
+    info = dict(info or {})
+    name = str(info.get('name') or '')
+    variant = info['variant'] if 'variant' in info else determine_firmware_variant(name)
+    extra = {k: v for k, v in info.items() if k not in STANDARD_KEYS}
+    return Device(str(serial), name, info.get('type') or 'unknown', info.get('notes') or '',
+                  info.get('side'), variant, extra)
+
+
+class DeviceRegistry:
+    """Known devices with O(1) lookup by serial and by (case-insensitive) name"""
+
+    def __init__(self, devices=(), path=None):
+        self.path = path
+        self.by_serial = {}
+        self.by_name = {}
+        self.by_side = {}
+        self.by_variant = {}
+        for device in devices:
+            self.add(device)
+
+    def add(self, device):
+        self.by_serial[device.serial] = device
+        self.by_name.setdefault(device.name.lower(), device)
+        self.by_side.setdefault(device.side or 'unknown', []).append(device)
+        self.by_variant.setdefault(device.variant, []).append(device)
+
+    def find_by_name(self, name):
+        return self.by_name.get(name.lower())
+
+    def with_side(self, side):
+        return list(self.by_side.get(side, []))
+
+    def with_variant(self, variant):
+        return list(self.by_variant.get(variant, []))
+
+    # Mapping interface, so code written against {serial: config} keeps working
+
+    def __len__(self):
+        return len(self.by_serial)
+
+    def __iter__(self):
+        return iter(self.by_serial)
+
+    def __contains__(self, serial):
+        return serial in self.by_serial
+
+    def __getitem__(self, serial):
+        return self.by_serial[serial]
+
+    def get(self, serial, default=None):
+        return self.by_serial.get(serial, default)
+
+    def items(self):
+        return self.by_serial.items()
+
+    def values(self):
+        return self.by_serial.values()
+
+    def keys(self):
+        return self.by_serial.keys()
+
+
+def _parse_yaml(path):
+    import yaml
+
+    with open(path, 'r') as f:
+        config = yaml.safe_load(f)
+    return [(serial, dict(info or {})) for serial, info in (config or {}).items()]
+
+
+def _parse_conf(path):
+    """serial:friendly_name:device_type:notes per line"""
+    entries = []
+    with open(path, 'r') as f:
+        for line_num, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            parts = line.split(':', 3)
+            if len(parts) < 2:
+                print(f"Warning: Invalid format at line {line_num}: {line}")
+                continue
+            entries.append((parts[0], {
+                'name': parts[1],
+                'type': parts[2] if len(parts) > 2 else "unknown",
+                'notes': parts[3] if len(parts) > 3 else "",
+            }))
+    return entries
+
+
+_memory_cache = {}
+
+
+def _cache_path(path):
+    return CACHE_DIR / f"devices-{path.name}.pickle"
+
+
+def _read_entries(path, stat):
+    """Parsed entries for path, from the in-process or on-disk cache when the file is unchanged"""
+    stamp = (str(path), stat.st_mtime_ns, stat.st_size)
+    if _memory_cache.get('stamp') == stamp:
+        return _memory_cache['entries']
+
+    cache_path = _cache_path(path)
+    try:
+        with open(cache_path, 'rb') as f:
+            cached = pickle.load(f)
+        if cached.get('version') == CACHE_VERSION and cached.get('stamp') == stamp:
+            _memory_cache.update(stamp=stamp, entries=cached['entries'])
+            return cached['entries']
+    except (OSError, EOFError, pickle.PickleError, AttributeError, ValueError):
+        pass
+
+    entries = _parse_yaml(path) if path.suffix == '.yaml' else _parse_conf(path)
+    _memory_cache.update(stamp=stamp, entries=entries)
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, 'wb') as f:
+            pickle.dump({'version': CACHE_VERSION, 'stamp': stamp, 'entries': entries}, f)
+        os.replace(tmp, cache_path)
+    except OSError:
+        pass
+    return entries
+
+
+def config_paths(config_dir=None):
+    config_dir = Path(config_dir or CONFIG_DIR)
+    return config_dir / "devices.yaml", config_dir / "devices.conf"
+
+
+def load_registry(config_dir=None, quiet=False):
+    """Load the device registry from devices.yaml, falling back to devices.conf"""
+    yaml_path, conf_path = config_paths(config_dir)
+    for path in (yaml_path, conf_path):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        try:
+            entries = _read_entries(path, stat)
+        except ImportError:
+            if not quiet:
+                print("PyYAML not found, falling back to conf format")
+            continue
+        except Exception as e:
+            if path == conf_path:
+                raise
+            if not quiet:
+                print(f"Error reading YAML config: {e}, falling back to conf format")
+            continue
+        return DeviceRegistry((make_device(serial, info) for serial, info in entries), path)
+
+    if not quiet:
+        print("No config file found. Create ~/.config/zmk/devices.yaml or ~/.config/zmk/devices.conf")
+    return DeviceRegistry()
+
+
+def load_device_config():
+    """Load the configured devices ({serial: Device}-like registry)"""
+    return load_registry()
+
+
+def _yaml_scalar(value):
+    """Quote a value for devices.yaml only when plain YAML would misread it"""
+    text = str(value)
+    if text == '' or text.strip() != text or any(c in text for c in ':#{}[],&*!|>\'"%@`') \
+            or text.lower() in ('yes', 'no', 'true', 'false', 'null', 'on', 'off', '~'):
+        return "'" + text.replace("'", "''") + "'"
+    return text
+
+
+def append_devices(devices, config_dir=None, conf_format=False):
+    """
+    Append new devices to devices.yaml (or devices.conf) atomically: the existing
+    text, comments included, is copied to a temporary file with the new entries
+    and renamed over the original, so readers never see a half-written file.
+    Returns the path written.
+    """
+    yaml_path, conf_path = config_paths(config_dir)
+    path = conf_path if conf_format else yaml_path
+    try:
+        existing = path.read_text()
+    except FileNotFoundError:
+        existing = ''
+
+    chunks = [existing]
+    for device in devices:
+        if conf_format:
+            chunks.append(f"\n{device.serial}:{device.name}:{device.type}:{device.notes}")
+            continue
+        lines = [f"\n{_yaml_scalar(device.serial)}:"]
+        for key, value in device.as_dict().items():
+            lines.append(f"  {key}: {_yaml_scalar(value)}")
+        chunks.append('\n'.join(lines) + '\n')
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, 'w') as f:
+        f.write(''.join(chunks))
+        f.flush()
+        os.fsync(f.fileno())
+    if path.exists():
+        os.chmod(tmp, path.stat().st_mode & 0o777)
+    os.replace(tmp, path)
+    return path
+
+
+def main():
+    import argparse
+    from tracing import add_profile_argument, setup_profile
+
+    parser = argparse.ArgumentParser(description='Query the ZMK device registry')
+    parser.add_argument('--serial', '-s', help='Show the device with this serial')
+    parser.add_argument('--name', '-n', help='Show the device with this friendly name')
+    parser.add_argument('--side', help='List devices for one side (left/right/unknown)')
+    parser.add_argument('--variant', help='List devices using a firmware variant ("base" for none)')
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    setup_profile(args)
+
+    registry = load_registry()
+    if args.serial or args.name:
+        device = registry.get(args.serial) if args.serial else registry.find_by_name(args.name)
+        if device is None:
+            raise SystemExit(1)
+        print(f"{device.serial}: {device.name} ({device.type}, {device.side or 'unknown'} side, "
+              f"variant {device.variant or 'base'})")
+        return
+
+    devices = list(registry.values())
+    if args.side:
+        devices = registry.with_side(args.side)
+    if args.variant:
+        variant = None if args.variant == 'base' else args.variant
+        devices = [d for d in devices if d.variant == variant]
+    for device in devices:
+        print(f"{device.serial:<24} {device.name:<24} {device.side or 'unknown':<8} {device.variant or 'base'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Incremental keymap drawing for ZMK config
+Parses each keymap with keymap-drawer only when one of its source files changed,
+splits the result into one document per layer and draws just the layers whose
+content hash is not cached yet, in parallel. The cached layer SVGs are then
+stacked into the final drawing. --watch redraws whenever a source file is saved.
+"""
+
+import hashlib
+import json
+import os
+import re
+import select
+import subprocess
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+from keymap_model import CONFIG_DIR, REPO_ROOT, load_models
+from tracing import span, traced
+
+# Constants
+DRAW_DIR = REPO_ROOT / 'draw'
+DRAW_CONFIG = DRAW_DIR / 'config.yaml'
+CACHE_DIR = REPO_ROOT / '.build' / 'draw'
+CACHE_VERSION = 1
+CACHE_MAX_AGE = 14 * 24 * 3600  # Layer drawings unused for two weeks are pruned
+DEFAULT_KEYMAP = 'eyelash_corne'
+OUTPUT_NAMES = {'eyelash_corne': 'base'}  # `just draw` has always written draw/base.*
+LAYOUTS = {
+    'eyelash_corne': REPO_ROOT / 'zmk-new_corne' / 'boards' / 'arm' / 'eyelash_corne' / 'eyelash_corne-layouts.dtsi',
+}
+VIRTUAL_LAYER = 'Combos'  # All combos are drawn on this extra layer
+WATCH_SUFFIXES = ('.keymap', '.dtsi', '.h', '.yaml')
+WATCH_DEBOUNCE = 0.05  # Editors save in several steps; collect them into one redraw
+WATCH_POLL = 0.2  # Used only without inotify
+
+DrawResult = namedtuple('DrawResult', 'keymap output layers drawn seconds')
+
+_SVG_TAG = re.compile(r'<svg\b[^>]*>')
+
+
+class DrawError(RuntimeError):
+    """keymap-drawer is missing or failed"""
+
+
+def _digest(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _file_digest(path):
+    try:
+        with open(path, 'rb') as f:
+            return _digest(f.read())
+    except OSError:
+        return 'missing'
+
+
+def split_layers(parsed):
+    """
+    One keymap-drawer document per layer of a parse result: the shared layout
+    and draw settings, that layer's bindings, and the combos drawn on it.
+    Returns [(layer name, document)] in layer order.
+    """
+    layers = parsed.get('layers') or {}
+    combos = parsed.get('combos') or []
+    shared = {key: value for key, value in parsed.items() if key not in ('layers', 'combos')}
+    documents = []
+    for name, bindings in layers.items():
+        document = dict(shared, layers={name: bindings})
+        on_layer = [combo for combo in combos if name in combo.get('l', layers)]
+        if on_layer:
+            document['combos'] = on_layer
+        documents.append((name, document))
+    return documents
+
+
+def composite(fragments):
+    """Stack per-layer SVG drawings vertically into one SVG document"""
+    placed = []
+    width = height = 0.0
+    for svg in fragments:
+        svg = re.sub(r'^\s*<\?xml[^>]*\?>\s*', '', svg)
+        tag = _SVG_TAG.search(svg)
+        if tag is None:
+            raise DrawError('layer drawing has no <svg> element')
+        size = {name: float(value) for name, value in re.findall(r'\b(width|height)="([\d.]+)', tag.group(0))}
+        placed.append(svg[:tag.start()] + f'<svg y="{height:g}"' + svg[tag.start() + 4:])
+        width = max(width, size.get('width', 0.0))
+        height += size.get('height', 0.0)
+    return (f'<svg width="{width:g}" height="{height:g}" viewBox="0 0 {width:g} {height:g}" class="keymap" '
+            'xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink">\n'
+            + '\n'.join(placed) + '\n</svg>\n')
+
+
+def _write_if_changed(path, text):
+    """Write text atomically unless the file already holds it. Returns True if written."""
+    path = Path(path)
+    try:
+        if path.read_text() == text:
+            return False
+    except OSError:
+        pass
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_text(text)
+    os.replace(tmp, path)
+    return True
+
+
+class KeymapDrawer:
+    """keymap-drawer behind a parse cache (per keymap) and a layer drawing cache (by content)"""
+
+    def __init__(self, config=DRAW_CONFIG, cache_dir=CACHE_DIR, jobs=None, command=('keymap',), force=False):
+        self.config = Path(config)
+        self.cache_dir = Path(cache_dir)
+        self.jobs = jobs or os.cpu_count() or 1
+        self.command = list(command)
+        self.force = force
+        (self.cache_dir / 'parse').mkdir(parents=True, exist_ok=True)
+        (self.cache_dir / 'layers').mkdir(parents=True, exist_ok=True)
+
+    def _run(self, args, stdin=None):
+        try:
+            result = subprocess.run(self.command + ['-c', str(self.config)] + args, input=stdin,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        except FileNotFoundError:
+            raise DrawError(f"{self.command[0]} not found (keymap-drawer is provided by `nix develop`)")
+        if result.returncode != 0:
+            raise DrawError(result.stderr.strip() or f"keymap {args[0]} exited with {result.returncode}")
+        return result.stdout
+
+    def sources_key(self, model):
+        """Hash of everything a parse depends on: the keymap, its includes and the draw config"""
+        files = sorted(set(model.dependencies) | {str(self.config)})
+        return _digest(f"v{CACHE_VERSION}", *(f"{path}:{_file_digest(path)}" for path in files))
+
+    def parse(self, keymap, key):
+        """keymap-drawer's parse of a keymap, combos moved to the virtual layer; cached by sources key"""
+        import yaml
+
+        stem = Path(keymap).stem
+        cached = self.cache_dir / 'parse' / f"{stem}-{key[:16]}.yaml"
+        if cached.exists() and not self.force:
+            with open(cached, 'r') as f:
+                return yaml.safe_load(f)
+
+        with span('draw.parse', keymap=stem):
+            parsed = yaml.safe_load(self._run(['parse', '-z', str(keymap), '--virtual-layers', VIRTUAL_LAYER]))
+        # Draw every combo on the virtual layer only (what `yq '.combos.[].l = ["Combos"]'` did)
+        for combo in parsed.get('combos') or []:
+            combo['l'] = [VIRTUAL_LAYER]
+        _write_if_changed(cached, yaml.safe_dump(parsed, sort_keys=False, allow_unicode=True))
+        for old in cached.parent.glob(f"{stem}-*.yaml"):
+            if old != cached:
+                old.unlink()
+        return parsed
+
+    def layer_path(self, document, layout):
+        key = _digest(f"v{CACHE_VERSION}", json.dumps(document, sort_keys=True, default=str),
+                      _file_digest(self.config), layout or '', _file_digest(layout) if layout else '')
+        return self.cache_dir / 'layers' / f"{key[:32]}.svg"
+
+    def draw_layer(self, name, document, layout, path):
+        import yaml
+
+        with span('draw.layer', layer=name):
+            svg = self._run(['draw', '-'] + (['-d', str(layout)] if layout else []),
+                            yaml.safe_dump(document, sort_keys=False, allow_unicode=True))
+        _write_if_changed(path, svg)
+
+    @traced('draw.run')
+    def draw(self, keymaps, output_dir=DRAW_DIR):
+        """
+        Bring the drawings of several keymaps up to date. Parses run in parallel,
+        then every missing layer of every keymap is drawn on one pool.
+        Returns DrawResults in keymap order.
+        """
+        import yaml
+
+        start = time.monotonic()
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        models = load_models(keymaps)
+        keys = {name: self.sources_key(model) for name, model in models.items()}
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            parsed = dict(zip(models, executor.map(lambda name: self.parse(models[name].path, keys[name]), models)))
+
+            plans = {}
+            missing = {}
+            for name, model in models.items():
+                stem = Path(name).stem
+                layout = LAYOUTS.get(stem)
+                plan = []
+                for layer, document in split_layers(parsed[name]):
+                    path = self.layer_path(document, layout)
+                    plan.append(path)
+                    if self.force or not path.exists():
+                        missing.setdefault(path, (layer, document, layout))
+                plans[name] = plan
+            futures = [executor.submit(self.draw_layer, layer, document, layout, path)
+                       for path, (layer, document, layout) in missing.items()]
+            for future in futures:
+                future.result()
+
+        results = []
+        for name, plan in plans.items():
+            stem = Path(name).stem
+            out_stem = OUTPUT_NAMES.get(stem, stem)
+            with span('draw.composite', keymap=stem, layers=len(plan)):
+                _write_if_changed(output_dir / f"{out_stem}.yaml",
+                                  yaml.safe_dump(parsed[name], sort_keys=False, allow_unicode=True))
+                _write_if_changed(output_dir / f"{out_stem}.svg", composite([p.read_text() for p in plan]))
+            for path in plan:
+                os.utime(path)
+            results.append(DrawResult(stem, output_dir / f"{out_stem}.svg", len(plan),
+                                      sum(1 for p in plan if p in missing), time.monotonic() - start))
+        self.prune()
+        return results
+
+    def prune(self, max_age=CACHE_MAX_AGE):
+        """Remove layer drawings that no drawing has used for max_age seconds"""
+        cutoff = time.time() - max_age
+        for path in (self.cache_dir / 'layers').glob('*.svg'):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except OSError:
+                pass
+
+    def watched_dirs(self, keymaps):
+        models = load_models(keymaps)
+        dirs = {os.path.dirname(path) for model in models.values() for path in model.dependencies}
+        return sorted(dirs | {str(self.config.parent)})
+
+
+def print_results(results):
+    for r in results:
+        print(f"🎨 {r.keymap}: {r.drawn}/{r.layers} layer(s) redrawn in {r.seconds:.2f}s → {os.path.relpath(r.output)}")
+
+
+def _mtimes(dirs):
+    stamps = {}
+    for directory in dirs:
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.name.endswith(WATCH_SUFFIXES):
+                try:
+                    stamps[entry.path] = entry.stat().st_mtime_ns
+                except OSError:
+                    pass
+    return stamps
+
+
+def watch(drawer, keymaps, output_dir):
+    """Redraw whenever a keymap source or the draw config is saved, until Ctrl-C"""
+    from usb_watch import IN_CLOSE_WRITE, IN_MOVED_TO, InotifySource
+
+    dirs = drawer.watched_dirs(keymaps)
+    try:
+        source = InotifySource(dirs, IN_CLOSE_WRITE | IN_MOVED_TO)
+    except (OSError, AttributeError):
+        source = None
+    print(f"👀 Watching {len(dirs)} director{'y' if len(dirs) == 1 else 'ies'} "
+          f"({'inotify' if source else 'polling'}); Ctrl-C to stop")
+    stamps = _mtimes(dirs) if source is None else None
+    try:
+        while True:
+            if source is not None:
+                select.select([source], [], [])
+                names = {event.get('DEVNAME', '') for event in source.read_events()}
+                time.sleep(WATCH_DEBOUNCE)
+                names |= {event.get('DEVNAME', '') for event in source.read_events()}
+                if not any(name.endswith(WATCH_SUFFIXES) for name in names):
+                    continue
+            else:
+                time.sleep(WATCH_POLL)
+                current = _mtimes(dirs)
+                if current == stamps:
+                    continue
+                stamps = current
+            try:
+                print_results(drawer.draw(keymaps, output_dir))
+            except DrawError as e:
+                print(f"❌ {e}")
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        print()
+    finally:
+        if source is not None:
+            source.close()
+
+
+def main():
+    import argparse
+    from tracing import add_profile_argument, setup_profile
+
+    parser = argparse.ArgumentParser(description='Draw the keymaps with keymap-drawer, redrawing only changed layers')
+    parser.add_argument('keymaps', nargs='*', help=f"Keymaps to draw (default: {DEFAULT_KEYMAP})")
+    parser.add_argument('--all', '-a', action='store_true', help=f"Draw every keymap in {os.path.relpath(CONFIG_DIR, REPO_ROOT)}/")
+    parser.add_argument('--output-dir', '-o', default=str(DRAW_DIR), help='Where to write <name>.yaml and <name>.svg')
+    parser.add_argument('--jobs', '-j', type=int, help='Layers drawn at once (default: CPU count)')
+    parser.add_argument('--force', '-f', action='store_true', help='Ignore the caches and redraw everything')
+    parser.add_argument('--watch', '-w', action='store_true', help='Keep running and redraw when a source is saved')
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    setup_profile(args)
+
+    keymaps = None if args.all else (args.keymaps or [DEFAULT_KEYMAP])
+    drawer = KeymapDrawer(jobs=args.jobs, force=args.force)
+    try:
+        print_results(drawer.draw(keymaps, args.output_dir))
+    except DrawError as e:
+        print(f"❌ {e}")
+        if not args.watch:
+            sys.exit(1)
+    if args.watch:
+        drawer.force = False
+        watch(drawer, keymaps, args.output_dir)
+
+
+if __name__ == "__main__":
+    main()
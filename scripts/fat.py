@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Read-only FAT12/16 reader
+Parses the boot sector and root directory of a block device or image file and
+reads small files such as INFO_UF2.TXT straight from it, so a candidate disk
+can be identified as a UF2 bootloader without a sudo mount/umount. Reading a
+block device needs read access to it (e.g. membership of the `disk` group);
+callers fall back to mounting when that fails.
+"""
+
+import os
+import struct
+import sys
+from collections import namedtuple
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+from tracing import traced
+from uf2 import parse_info
+
+# Constants
+BOOT_SECTOR_SIZE = 512
+DIR_ENTRY_SIZE = 32
+MAX_FILE_SIZE = 64 * 1024  # INFO_UF2.TXT and INDEX.HTM are tiny; never read more than this
+
+# Directory entry attributes
+ATTR_READ_ONLY = 0x01
+ATTR_HIDDEN = 0x02
+ATTR_SYSTEM = 0x04
+ATTR_VOLUME_ID = 0x08
+ATTR_DIRECTORY = 0x10
+ATTR_ARCHIVE = 0x20
+ATTR_LONG_NAME = 0x0F
+
+DirEntry = namedtuple('DirEntry', 'name attributes cluster size')
+
+
+class FatError(ValueError):
+    """The device does not hold a FAT12/16 file system this reader understands"""
+
+
+class FatVolume:
+    """A FAT12/16 volume opened read-only from a device node or image file"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.fd = os.open(self.path, os.O_RDONLY | getattr(os, 'O_CLOEXEC', 0))
+        try:
+            self._parse_boot_sector(self._read(0, BOOT_SECTOR_SIZE))
+        except Exception:
+            os.close(self.fd)
+            raise
+        self._fat = None
+        self._root = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _read(self, offset, size):
+        data = os.pread(self.fd, size, offset)
+        if len(data) < size:
+            raise FatError(f"short read at offset {offset} ({len(data)}/{size} bytes)")
+        return data
+
+    def _parse_boot_sector(self, sector):
+        if sector[510:512] != b'\x55\xAA':
+            raise FatError("no boot sector signature")
+        (self.bytes_per_sector, self.sectors_per_cluster, self.reserved_sectors, self.num_fats,
+         self.root_entries, total16, _media, self.fat_sectors) = struct.unpack_from('<HBHBHHBH', sector, 11)
+        total32 = struct.unpack_from('<I', sector, 32)[0]
+        self.total_sectors = total16 or total32
+
+        if self.bytes_per_sector not in (512, 1024, 2048, 4096):
+            raise FatError(f"unsupported sector size {self.bytes_per_sector}")
+        if not self.sectors_per_cluster or self.sectors_per_cluster & (self.sectors_per_cluster - 1):
+            raise FatError(f"invalid sectors per cluster {self.sectors_per_cluster}")
+        if not self.num_fats or not self.reserved_sectors or not self.total_sectors:
+            raise FatError("invalid BIOS parameter block")
+        if not self.fat_sectors or not self.root_entries:
+            raise FatError("FAT32 volumes are not supported")
+
+        root_sectors = (self.root_entries * DIR_ENTRY_SIZE + self.bytes_per_sector - 1) // self.bytes_per_sector
+        self.fat_start = self.reserved_sectors * self.bytes_per_sector
+        self.root_start = (self.reserved_sectors + self.num_fats * self.fat_sectors) * self.bytes_per_sector
+        data_sector = self.reserved_sectors + self.num_fats * self.fat_sectors + root_sectors
+        self.data_start = data_sector * self.bytes_per_sector
+        self.cluster_size = self.sectors_per_cluster * self.bytes_per_sector
+        self.cluster_count = (self.total_sectors - data_sector) // self.sectors_per_cluster
+        if self.cluster_count < 4085:
+            self.fat_type = 12
+        elif self.cluster_count < 65525:
+            self.fat_type = 16
+        else:
+            raise FatError("FAT32 volumes are not supported")
+        self.label = sector[43:54].decode('ascii', 'replace').strip() if sector[38] == 0x29 else ''
+
+    def files(self):
+        """The files in the root directory (long-name, deleted and label entries skipped)"""
+        if self._root is None:
+            data = self._read(self.root_start, self.root_entries * DIR_ENTRY_SIZE)
+            entries = []
+            for offset in range(0, len(data), DIR_ENTRY_SIZE):
+                first = data[offset]
+                if first == 0x00:
+                    break
+                attributes = data[offset + 11]
+                if first == 0xE5 or attributes & ATTR_LONG_NAME == ATTR_LONG_NAME:
+                    continue
+                if attributes & ATTR_VOLUME_ID:
+                    self.label = self.label or data[offset:offset + 11].decode('ascii', 'replace').strip()
+                    continue
+                base = data[offset:offset + 8].decode('ascii', 'replace').rstrip()
+                ext = data[offset + 8:offset + 11].decode('ascii', 'replace').rstrip()
+                if first == 0x05:
+                    base = '\xe5' + base[1:]
+                cluster, size = struct.unpack_from('<HI', data, offset + 26)
+                entries.append(DirEntry(f"{base}.{ext}" if ext else base, attributes, cluster, size))
+            self._root = entries
+        return self._root
+
+    def find(self, name):
+        """The root directory entry for an 8.3 name (case-insensitive), or None"""
+        name = name.upper()
+        return next((e for e in self.files() if e.name.upper() == name), None)
+
+    def _next_cluster(self, cluster):
+        if self._fat is None:
+            self._fat = self._read(self.fat_start, self.fat_sectors * self.bytes_per_sector)
+        offset = cluster * 2 if self.fat_type == 16 else cluster * 3 // 2
+        if offset + 2 > len(self._fat):
+            raise FatError(f"cluster {cluster} is past the end of the FAT")
+        value = struct.unpack_from('<H', self._fat, offset)[0]
+        if self.fat_type == 16:
+            return value
+        return value >> 4 if cluster & 1 else value & 0x0FFF
+
+    def read_file(self, name, limit=MAX_FILE_SIZE):
+        """Contents of a root directory file (at most `limit` bytes), or None if it does not exist"""
+        entry = self.find(name)
+        if entry is None or entry.attributes & ATTR_DIRECTORY:
+            return None
+        remaining = min(entry.size, limit)
+        end_of_chain = 0xFF8 if self.fat_type == 12 else 0xFFF8
+        chunks = []
+        cluster = entry.cluster
+        seen = set()
+        while remaining > 0:
+            if cluster < 2 or cluster >= end_of_chain or cluster in seen or cluster - 2 >= self.cluster_count:
+                raise FatError(f"broken cluster chain in {name}")
+            seen.add(cluster)
+            size = min(remaining, self.cluster_size)
+            chunks.append(self._read(self.data_start + (cluster - 2) * self.cluster_size, size))
+            remaining -= size
+            if remaining:
+                cluster = self._next_cluster(cluster)
+        return b''.join(chunks)
+
+
+@traced('detect.read_fat')
+def read_bootloader_info(path):
+    """
+    INFO_UF2.TXT of the FAT volume at path, parsed like uf2.read_info().
+    Returns {} for a readable FAT volume without INFO_UF2.TXT (not a UF2
+    bootloader) and None when the volume cannot be read (permissions, not FAT).
+    """
+    try:
+        with FatVolume(path) as volume:
+            data = volume.read_file('INFO_UF2.TXT')
+    except (OSError, FatError):
+        return None
+    if data is None:
+        return {}
+    return parse_info(data.decode('utf-8', 'replace'))
+
+
+def main():
+    import argparse
+    from tracing import add_profile_argument, setup_profile
+
+    parser = argparse.ArgumentParser(description='Read a FAT12/16 volume without mounting it')
+    parser.add_argument('device', help='Block device or image file')
+    parser.add_argument('--cat', metavar='NAME', help='Print a root directory file (e.g. INFO_UF2.TXT)')
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    setup_profile(args)
+
+    try:
+        with FatVolume(args.device) as volume:
+            if args.cat:
+                data = volume.read_file(args.cat)
+                if data is None:
+                    print(f"❌ {args.cat} not found on {args.device}")
+                    sys.exit(1)
+                sys.stdout.write(data.decode('utf-8', 'replace'))
+                return
+            print(f"💾 {args.device}: FAT{volume.fat_type}, label '{volume.label}', "
+                  f"{volume.cluster_count} clusters of {volume.cluster_size} bytes")
+            for entry in volume.files():
+                kind = 'dir ' if entry.attributes & ATTR_DIRECTORY else 'file'
+                print(f"   {kind} {entry.name:<12} {entry.size:>10} bytes")
+    except (OSError, FatError) as e:
+        print(f"❌ {args.device}: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
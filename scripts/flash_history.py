@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Flash history and delta UF2 images for ZMK flashing tools
+Keeps a copy of the image last flashed to each device (by USB serial). With
+delta mode on, a new image is diffed against that copy one flash page at a
+time and only the blocks of changed pages are written, as a smaller UF2 with
+its own block numbering; pages the new image no longer uses are erased. The
+full image is written whenever the history is missing, corrupt, or disagrees
+with what the bootloader reports in CURRENT.UF2.
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import time
+from collections import namedtuple
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+from tracing import add_profile_argument, setup_profile, traced
+from uf2 import BLOCK_SIZE, FLAG_NOT_MAIN_FLASH, HEADER, UF2Error, UF2Image, pack_image
+
+# Constants
+HISTORY_DIR = Path.home() / '.cache' / 'zmk' / 'flash-history'
+PAGE_SIZE = 4096  # nRF52 flash page: the bootloader erases and programs whole pages
+ERASED = b'\xff'  # Flash reads back all ones after an erase
+SPOT_CHECK_PAGES = 8  # Unchanged pages compared with CURRENT.UF2 before trusting the history
+MAX_DELTA_FRACTION = 0.6  # Beyond this share of changed pages the full image is written
+IMAGE_NAME = 'image.uf2'
+RECORD_NAME = 'record.json'
+DELTA_NAME = 'delta.uf2'
+
+FlashRecord = namedtuple('FlashRecord', 'serial image_sha256 firmware size flashed_at')
+# path is the file to write (the delta, or the full image); pages/total_pages count flash pages
+FlashPlan = namedtuple('FlashPlan', 'path delta pages total_pages reason')
+
+
+def image_sha256(image):
+    return hashlib.sha256(image.view).hexdigest()
+
+
+def page_blocks(image):
+    """
+    {page address: [(block offset, target address, payload)]} for a validated
+    image, or None if it has blocks that are not plain main-flash data.
+    """
+    pages = {}
+    for block in image.blocks():
+        if block.flags & FLAG_NOT_MAIN_FLASH:
+            return None
+        if block.target_addr // PAGE_SIZE != (block.target_addr + block.payload_size - 1) // PAGE_SIZE:
+            return None  # A block straddling two pages cannot be attributed to one
+        offset = block.index * BLOCK_SIZE
+        payload = bytes(image.view[offset + HEADER.size:offset + HEADER.size + block.payload_size])
+        pages.setdefault(block.target_addr - block.target_addr % PAGE_SIZE, []).append(
+            (offset, block.target_addr, payload))
+    return pages
+
+
+def changed_pages(base_pages, new_pages):
+    """
+    Addresses of the pages to write: those of the new image whose contents differ
+    from the base image, and those only the base image used (which must be erased,
+    or the old code stays on the device behind a shrunken image)
+    """
+    def content(blocks):
+        return sorted((addr, payload) for _, addr, payload in blocks)
+
+    changed = {page for page, blocks in new_pages.items()
+               if page not in base_pages or content(blocks) != content(base_pages[page])}
+    return sorted(changed | (set(base_pages) - set(new_pages)))
+
+
+def build_delta(image, new_pages, pages):
+    """
+    The blocks of the given pages as a UF2 file of their own, renumbered 0..n-1.
+    Pages the new image has no blocks for are written as erased (all 0xFF).
+    """
+    blocks = []
+    for page in pages:
+        if page in new_pages:
+            blocks += [bytes(image.view[offset:offset + BLOCK_SIZE]) for offset, _, _ in sorted(new_pages[page])]
+        else:
+            erased = pack_image(ERASED * PAGE_SIZE, page, image.family_id)
+            blocks += [erased[i:i + BLOCK_SIZE] for i in range(0, len(erased), BLOCK_SIZE)]
+    out = bytearray()
+    for number, data in enumerate(blocks):
+        block = bytearray(data)
+        fields = list(HEADER.unpack_from(block))
+        fields[5], fields[6] = number, len(blocks)  # blockNo, numBlocks
+        HEADER.pack_into(block, 0, *fields)
+        out += block
+    return bytes(out)
+
+
+def spot_check(mount_point, base_pages, pages, samples=SPOT_CHECK_PAGES):
+    """
+    Compare a few pages of the base image with the bootloader's CURRENT.UF2,
+    which reads back the flash contents in fixed-size blocks. Returns True if
+    they match, False if the device holds something else, None if CURRENT.UF2
+    cannot be read that way (missing, not a regular file, unexpected layout).
+    """
+    path = os.path.join(mount_point, 'CURRENT.UF2')
+    try:
+        if not os.path.isfile(path):
+            return None
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        first = os.pread(fd, HEADER.size, 0)
+        if len(first) < HEADER.size:
+            return None
+        fields = HEADER.unpack(first)
+        start, step = fields[3], fields[4]
+        if not step:
+            return None
+        chosen = pages[::max(1, len(pages) // samples)][:samples]
+        for page in chosen:
+            for _, addr, payload in base_pages[page]:
+                if (addr - start) % step:
+                    return None
+                block = os.pread(fd, BLOCK_SIZE, (addr - start) // step * BLOCK_SIZE)
+                if len(block) < BLOCK_SIZE or HEADER.unpack_from(block)[3] != addr:
+                    return None
+                if block[HEADER.size:HEADER.size + len(payload)] != payload:
+                    return False
+        return True
+    except (OSError, ValueError):
+        return None
+    finally:
+        os.close(fd)
+
+
+class FlashHistory:
+    """
+    The image last flashed to each device, in <root>/<serial>/. record() after
+    every successful flash; plan() decides what to write next time (a delta
+    only when delta mode is on).
+    """
+
+    def __init__(self, root=HISTORY_DIR, delta=False, check_current=True):
+        self.root = Path(root)
+        self.delta = delta
+        self.check_current = check_current
+
+    def _dir(self, serial):
+        return self.root / re.sub(r'[^A-Za-z0-9_.-]', '_', serial)
+
+    def get(self, serial):
+        """The FlashRecord for a serial, or None if there is none or its image copy is gone"""
+        directory = self._dir(serial)
+        try:
+            with open(directory / RECORD_NAME, 'r') as f:
+                data = json.load(f)
+            record = FlashRecord(**{field: data.get(field) for field in FlashRecord._fields})
+        except (OSError, ValueError, TypeError):
+            return None
+        return record if (directory / IMAGE_NAME).exists() else None
+
+    @traced('flash.history')
+    def record(self, serial, firmware_file):
+        """Remember the full image just flashed to a device"""
+        directory = self._dir(serial)
+        directory.mkdir(parents=True, exist_ok=True)
+        tmp = directory / (IMAGE_NAME + '.tmp')
+        shutil.copyfile(firmware_file, tmp)
+        with UF2Image(tmp) as image:
+            digest = image_sha256(image)
+            size = image.size
+        os.replace(tmp, directory / IMAGE_NAME)
+        record = FlashRecord(serial, digest, os.path.basename(str(firmware_file)), size, time.time())
+        tmp = directory / (RECORD_NAME + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(record._asdict(), f, indent=1)
+        os.replace(tmp, directory / RECORD_NAME)
+        (directory / DELTA_NAME).unlink(missing_ok=True)
+        return record
+
+    def forget(self, serial):
+        """Drop a device's history (e.g. when it did not come back with the flashed build)"""
+        shutil.rmtree(self._dir(serial), ignore_errors=True)
+
+    @traced('flash.plan')
+    def plan(self, serial, image, mount_point=None):
+        """
+        What to write for a validated image: a FlashPlan whose path is a delta UF2,
+        or the full image when delta mode is off or the history cannot be trusted.
+        """
+        full = lambda reason, pages=0, total=0: FlashPlan(image.path, False, pages, total, reason)
+        if not self.delta:
+            return full('delta mode off')
+        record = self.get(serial) if serial else None
+        if record is None:
+            return full('no flash history')
+
+        try:
+            base = UF2Image(self._dir(serial) / IMAGE_NAME).validate()
+        except (UF2Error, OSError) as e:
+            return full(f"history unreadable ({e})")
+        with base:
+            if image_sha256(base) != record.image_sha256:
+                return full('history copy does not match its record')
+            base_pages, new_pages = page_blocks(base), page_blocks(image)
+            if base_pages is None or new_pages is None:
+                return full('image has non-flash blocks')
+            if image.family_id != base.family_id:
+                return full('different chip family')
+
+            pages = changed_pages(base_pages, new_pages)
+            total = len(set(base_pages) | set(new_pages))
+            if len(pages) > total * MAX_DELTA_FRACTION:
+                return full(f"{len(pages)}/{total} pages changed", len(pages), total)
+
+            if self.check_current and mount_point is not None:
+                unchanged = [page for page in sorted(new_pages) if page not in pages and page in base_pages]
+                current = spot_check(mount_point, base_pages, unchanged) if unchanged else True
+                if current is None:
+                    return full('CURRENT.UF2 cannot be compared', len(pages), total)
+                if not current:
+                    return full(f"device no longer holds {record.firmware}", len(pages), total)
+
+            # An unchanged image still needs at least one page so the bootloader completes and resets
+            pages = pages or [min(new_pages)]
+            delta = self._dir(serial) / DELTA_NAME
+            tmp = delta.with_name(DELTA_NAME + '.tmp')
+            with open(tmp, 'wb') as f:
+                f.write(build_delta(image, new_pages, pages))
+            os.replace(tmp, delta)
+        return FlashPlan(str(delta), True, len(pages), total, f"{len(pages)}/{total} pages changed since {record.firmware}")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Show the flash history or what a delta flash would write')
+    parser.add_argument('firmware', nargs='?', help='Image to compare with a device\'s history')
+    parser.add_argument('--serial', '-s', help='Device serial (default: every device in the history)')
+    parser.add_argument('--forget', action='store_true', help='Delete the history of --serial')
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    setup_profile(args)
+
+    history = FlashHistory(delta=True)
+    if args.forget:
+        if not args.serial:
+            parser.error('--forget needs --serial')
+        history.forget(args.serial)
+        print(f"🧹 Forgot the flash history of {args.serial}")
+        return
+
+    serials = [args.serial] if args.serial else sorted(p.name for p in history.root.glob('*') if p.is_dir())
+    if not serials:
+        print(f"No flash history in {history.root}")
+        return
+    for serial in serials:
+        record = history.get(serial)
+        if record is None:
+            print(f"{serial}: no history")
+            continue
+        flashed = time.strftime('%Y-%m-%d %H:%M', time.localtime(record.flashed_at))
+        line = f"{serial}: {record.firmware} ({record.size // 1024} KiB), flashed {flashed}"
+        if args.firmware:
+            with UF2Image(args.firmware) as image:
+                plan = history.plan(serial, image.validate())
+            size = os.path.getsize(plan.path)
+            line += f"\n   {'delta' if plan.delta else 'full'}: {size // 1024} KiB to write, {plan.reason}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
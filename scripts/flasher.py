@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Concurrent UF2 flashing engine for ZMK tools
+Writes firmware to every mounted bootloader volume at once, fsyncs each file
+instead of the whole system, reports per-device progress, and treats the
+volume disappearing (the bootloader resetting) as completion.
+"""
+
+import errno
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from tracing import span, traced
+from uf2 import UF2Image, open_firmware
+
+# Constants
+CHUNK_SIZE = 64 * 1024  # Large writes keep the MSC bulk pipe busy
+COMPLETION_TIMEOUT = 10.0  # Seconds to wait for the bootloader to reset after the write
+COMPLETION_POLL = 0.02  # A stat() every 20 ms costs nothing compared with a fixed 1 s sleep
+
+# serial (the USB serial, if known) keys the flash history used for delta flashing
+FlashJob = namedtuple('FlashJob', 'name mount_point firmware_file serial', defaults=(None,))
+# delta is the FlashPlan when only changed pages were written, else None
+FlashResult = namedtuple('FlashResult', 'name ok bytes_written write_seconds total_seconds rebooted error delta',
+                         defaults=(None,))
+
+
+def mount_source(mount_point):
+    """Return the block device name (e.g. 'sdb') mounted at mount_point, if known"""
+    target = os.path.realpath(mount_point)
+    try:
+        with open('/proc/self/mountinfo', 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 10 or fields[4].replace('\\040', ' ') != target:
+                    continue
+                source = fields[fields.index('-') + 2]
+                if source.startswith('/dev/'):
+                    return os.path.basename(source)
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def find_mount_point(block_name):
+    """Where /dev/<block_name> is mounted (e.g. by a desktop automounter), or None"""
+    source = f"/dev/{block_name}"
+    try:
+        with open('/proc/self/mountinfo', 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 10:
+                    continue
+                if fields[fields.index('-') + 2] == source:
+                    return fields[4].replace('\\040', ' ')
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def volume_present(mount_point, block_name=None):
+    """A bootloader volume is gone once its block device (or its files) disappear"""
+    if block_name:
+        return os.path.exists(f"/sys/class/block/{block_name}")
+    try:
+        return os.path.exists(os.path.join(mount_point, 'INFO_UF2.TXT'))
+    except OSError:
+        return False
+
+
+def write_firmware(mount_point, firmware, progress=None, chunk_size=CHUNK_SIZE):
+    """
+    Stream a UF2 image (path or open UF2Image) onto CURRENT.UF2 in large
+    block-aligned chunks straight from the memory map, and fsync just that file.
+    progress(bytes_written, total_bytes) is called after every chunk.
+    Returns bytes written. An I/O error after the final byte is not a failure:
+    the bootloader resets as soon as it has the whole image.
+    """
+    image = firmware if isinstance(firmware, UF2Image) else UF2Image(firmware)
+    total = image.size
+    target = os.path.join(mount_point, 'CURRENT.UF2')
+    written = 0
+
+    try:
+        with open(target, 'wb', buffering=0) as dst:
+            for chunk in image.chunks(chunk_size):
+                view = chunk
+                while view:
+                    count = dst.write(view)
+                    view = view[count:]
+                    written += count
+                if progress:
+                    progress(written, total)
+            chunk = view = None
+            try:
+                with span('flash.fsync', bytes=written):
+                    os.fsync(dst.fileno())
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.EROFS):  # Not supported (e.g. pipes)
+                    raise
+    except OSError:
+        if written < total:
+            raise
+    finally:
+        if image is not firmware:
+            image.close()
+
+    return written
+
+
+@traced('flash.reset')
+def wait_for_reset(mount_point, block_name=None, timeout=COMPLETION_TIMEOUT):
+    """Wait for the bootloader volume to disappear. Returns True if it did."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not volume_present(mount_point, block_name):
+            return True
+        time.sleep(COMPLETION_POLL)
+    return False
+
+
+class ProgressReporter:
+    """Thread-safe per-device progress lines (one per quarter, plus completion)"""
+
+    def __init__(self, out=None, steps=4):
+        self.out = out or sys.stdout
+        self.steps = steps
+        self.lock = threading.Lock()
+        self.started = {}
+        self.reported = {}
+
+    def __call__(self, name, written, total):
+        now = time.monotonic()
+        with self.lock:
+            start = self.started.setdefault(name, now)
+            step = written * self.steps // total if total else self.steps
+            if step <= self.reported.get(name, 0):
+                return
+            self.reported[name] = step
+            elapsed = max(now - start, 1e-6)
+            rate = written / elapsed / 1024
+            self.out.write(f"   {name}: {written // 1024}/{total // 1024} KiB "
+                           f"({100 * written // max(total, 1)}%, {rate:.0f} KiB/s)\n")
+            self.out.flush()
+
+
+def flash_one(job, progress=None, timeout=COMPLETION_TIMEOUT, check=True, history=None):
+    """
+    Flash a single job and wait for its volume to go away. The image is
+    validated first, and with check=True also matched against the bootloader's
+    Board-ID, so a wrong or corrupt image fails before anything is written.
+    With a FlashHistory in delta mode, only the pages that changed since the
+    device's last flash are written. Nothing is recorded here: callers record
+    the image once the reset (and, if they verify, the new build) is confirmed.
+    """
+    start = time.monotonic()
+    block_name = mount_source(job.mount_point)
+    written = 0
+    plan = None
+    try:
+        with span('flash.validate', device=job.name):
+            image = open_firmware(job.firmware_file, job.mount_point if check else None)
+        with image:
+            if history is not None and job.serial:
+                plan = history.plan(job.serial, image, job.mount_point if check else None)
+            source = UF2Image(plan.path).validate() if plan is not None and plan.delta else image
+            with source, span('flash.write', device=job.name, bytes=source.size, delta=source is not image):
+                written = write_firmware(job.mount_point, source,
+                                         (lambda w, t: progress(job.name, w, t)) if progress else None)
+        write_seconds = time.monotonic() - start
+        rebooted = wait_for_reset(job.mount_point, block_name, timeout)
+        return FlashResult(job.name, True, written, write_seconds, time.monotonic() - start, rebooted, None,
+                           plan if plan is not None and plan.delta else None)
+    except Exception as e:
+        elapsed = time.monotonic() - start
+        return FlashResult(job.name, False, written, elapsed, elapsed, False, str(e))
+
+
+def flash_all(jobs, progress=None, timeout=COMPLETION_TIMEOUT, check=True, history=None):
+    """Flash every job concurrently. Returns FlashResults in job order."""
+    if not jobs:
+        return []
+    with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+        futures = [executor.submit(flash_one, job, progress, timeout, check, history) for job in jobs]
+        return [f.result() for f in futures]
+
+
+def record_history(history, jobs, results):
+    """Record the image of every job whose device took the flash and reset (for callers that do not verify)"""
+    for job, result in zip(jobs, results):
+        if result.ok and result.rebooted and job.serial:
+            history.record(job.serial, job.firmware_file)
+
+
+def print_summary(results):
+    """Print a per-device summary table and return the number of successes"""
+    print("\n   Device                         Size      Write   Reset     KiB/s")
+    for r in results:
+        rate = r.bytes_written / r.write_seconds / 1024 if r.write_seconds > 0 else 0
+        status = '✅' if r.ok else '❌'
+        reset = f"{r.total_seconds - r.write_seconds:5.2f}s" if r.rebooted else ' n/a  '
+        print(f"{status} {r.name:<30} {r.bytes_written // 1024:>5} KiB  {r.write_seconds:5.2f}s  {reset}  {rate:8.0f}")
+        if r.delta:
+            print(f"     delta: {r.delta.reason}")
+        if r.error:
+            print(f"     {r.error}")
+    return sum(1 for r in results if r.ok)
@@ -0,0 +1,507 @@
+#!/usr/bin/env python3
+"""
+Fleet flashing pipeline
+Builds (or restores from the cache) the firmware for a whole device inventory,
+then flashes each device the moment it shows up in bootloader mode, in any
+order and for as long as it takes. Every device is tracked from pending to
+verified, failed flashes are retried, and the run ends once the inventory is
+done, with the total and per-device latency.
+
+devices.yaml usually lists a board twice: as a keyboard and as its bootloader,
+whose USB serial may differ. Both entries (same name, variant and side) make up
+one inventory item, and arrivals are matched on any of its serials. A
+bootloader that is not registered is matched on the `board_id:` of the item
+(the Board-ID line of INFO_UF2.TXT) when exactly one pending item has it.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+from auto_flash_functions import load_script, mount_device, unmount_device
+from device_registry import load_registry
+from fat import read_bootloader_info
+from flash_history import FlashHistory
+from flasher import FlashJob, ProgressReporter, find_mount_point, flash_one
+from tracing import add_profile_argument, setup_profile, span
+from usb_watch import BootloaderWatcher
+from verify import MISMATCH, OK_STATES, VERIFY_TIMEOUT, verify_flashed
+
+# Constants
+FIRMWARE_DIR = Path(__file__).resolve().parent.parent / 'firmware'
+DEFAULT_TIMEOUT = 900.0  # Seconds to wait for the whole inventory
+DEFAULT_RETRIES = 2
+FLASHABLE_TYPES = {'keyboard', 'bootloader', 'unknown'}
+WAKE_INTERVAL = 0.25  # How often the arrival loop looks at finished flashes
+MOUNT_WAIT = 1.0  # Give a desktop automounter this long before mounting ourselves
+
+# Device states
+PENDING = 'pending'
+FLASHING = 'flashing'
+REBOOTED = 'rebooted'
+VERIFIED = 'verified'
+UNVERIFIED = 'unverified'  # Reset but did not come back; flashed again if it re-enters the bootloader
+FAILED = 'failed'
+
+
+class InventoryItem(namedtuple('InventoryItem', 'device entries')):
+    """
+    One board: `device` is its keyboard entry (its bootloader entry when it has
+    none) and `entries` every registry entry with its name, variant and side.
+    """
+
+    __slots__ = ()
+
+    @property
+    def name(self):
+        return self.device.name
+
+    @property
+    def side(self):
+        return self.device.side
+
+    @property
+    def variant(self):
+        return self.device.variant
+
+
+class FleetDevice:
+    """
+    One inventory item and its progress through the pipeline (times are time.monotonic()).
+    `serials` are the USB serials its bootloader may report (default: the device's own).
+    """
+
+    def __init__(self, device, firmware_file, serials=None, board_id=None, verifiable=True):
+        self.device = device
+        self.firmware_file = firmware_file
+        self.serials = set(serials or [device.serial])
+        self.board_id = board_id
+        self.verifiable = verifiable
+        self.state = PENDING
+        self.attempts = 0
+        self.error = None
+        self.finished = False
+        self.arrived = None
+        self.rebooted = None
+        self.verified = None
+        self.done = None
+        self.result = None
+
+    @property
+    def name(self):
+        return self.device.name
+
+
+def mount_disk(disk):
+    """Mount point for a bootloader disk: the automounter's if it shows up, else a temporary one"""
+    deadline = time.monotonic() + MOUNT_WAIT
+    while True:
+        mount_point = find_mount_point(disk.name)
+        if mount_point:
+            return mount_point, False
+        if time.monotonic() >= deadline:
+            break
+        time.sleep(0.1)
+    temp_mount = f"/tmp/zmk-fleet-{disk.name}"
+    if mount_device(disk.path, temp_mount):
+        return temp_mount, True
+    return None, False
+
+
+def unmount_disk(mount_point):
+    unmount_device(mount_point)
+    try:
+        os.rmdir(mount_point)
+    except OSError:
+        pass
+
+
+def fleet_device(item, firmware_file):
+    """A FleetDevice for an InventoryItem: matched on all its serials, verified through its keyboard entry"""
+    board_ids = {str(e.get('board_id')) for e in item.entries if e.get('board_id')}
+    return FleetDevice(item.device, firmware_file, [e.serial for e in item.entries],
+                       board_ids.pop() if len(board_ids) == 1 else None, item.device.type != 'bootloader')
+
+
+def verify_entry(entry, timeout):
+    """Wait for a flashed device to re-enumerate and compare it with its build fingerprint"""
+    return verify_flashed([(entry.name, entry.device.serial, entry.firmware_file)], timeout)[0]
+
+
+class FleetPipeline:
+    """
+    Streams bootloader arrivals from a BootloaderWatcher into a flash queue.
+    Arrivals are matched to the inventory by the USB serial behind the disk;
+    an unknown serial registered under an item's name (in `registry`), or an
+    unregistered one whose INFO_UF2.TXT Board-ID only one pending item has,
+    is matched to that item.
+    mount(disk) returns (mount_point, needs_unmount), unmount(mount_point)
+    cleans up, verify(entry, timeout) returns the device's Verification
+    (None skips verification) and read_info(path) the INFO_UF2.TXT of an
+    unmounted disk; all four can be replaced for testing, as can log, which
+    receives the progress lines.
+    """
+
+    def __init__(self, entries, watcher, mount=mount_disk, unmount=unmount_disk, verify=verify_entry,
+                 retries=DEFAULT_RETRIES, check=True, progress=None, verify_timeout=VERIFY_TIMEOUT, log=print,
+                 history=None, registry=None, read_info=read_bootloader_info):
+        self.entries = list(entries)
+        self.devices = {serial: entry for entry in self.entries for serial in entry.serials}
+        self.watcher = watcher
+        self.mount = mount
+        self.unmount = unmount
+        self.verify = verify
+        self.retries = retries
+        self.check = check
+        self.progress = progress
+        self.verify_timeout = verify_timeout
+        self.log = log
+        self.history = history
+        self.registry = registry
+        self.read_info = read_info
+        self.lock = threading.Lock()
+        self.retry_disks = []
+        self.ignored = set()
+        self.start = None
+
+    def pending(self):
+        return [entry for entry in self.entries if not entry.finished]
+
+    def unreachable(self):
+        """
+        Entries no arrival can ever be matched to: every serial they could
+        report also belongs to another entry, and no Board-ID tells them apart
+        """
+        owners = {}
+        for entry in self.entries:
+            for serial in entry.serials:
+                owners.setdefault(serial, []).append(entry)
+        board_ids = [entry.board_id for entry in self.entries]
+        return [entry for entry in self.entries
+                if all(len(owners[serial]) > 1 for serial in entry.serials)
+                and (entry.board_id is None or board_ids.count(entry.board_id) > 1)]
+
+    def run(self, timeout=DEFAULT_TIMEOUT):
+        """
+        Flash devices as they arrive until all are done or timeout expires. Entries
+        that can never arrive fail up front instead of holding the run open.
+        Returns the entries.
+        """
+        self.start = time.monotonic()
+        deadline = self.start + timeout
+        for entry in self.unreachable():
+            shared = ', '.join(sorted(e.name for e in self.entries if e is not entry and e.serials & entry.serials))
+            entry.state, entry.finished, entry.done = FAILED, True, self.start
+            entry.error = f"can never be matched, its serials also belong to {shared}"
+            self.log(f"❌ {entry.name}: {entry.error}")
+        with ThreadPoolExecutor(max_workers=max(1, len(self.entries))) as executor:
+            while self.pending():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                with self.lock:
+                    retry_disks, self.retry_disks = self.retry_disks, []
+                for disk in retry_disks:
+                    self.watcher.forget(disk.name)
+                for disk in self.watcher.wait_for_devices(min(remaining, WAKE_INTERVAL)):
+                    self.arrive(disk, executor)
+        return self.entries
+
+    def match(self, disk):
+        """(entry, None) for the entry an arriving bootloader disk belongs to, else (None, reason)"""
+        entry = self.devices.get(disk.serial)
+        if entry is not None:
+            return entry, None
+        known = self.registry.get(disk.serial) if self.registry is not None and disk.serial else None
+        if known is not None:
+            # Registered under a type the inventory skips (e.g. "controller"): pair it by name
+            candidates = [entry for entry in self.entries
+                          if (entry.name.lower(), entry.device.variant) == (known.name.lower(), known.variant)
+                          and known.side in (None, entry.device.side)]
+            if len(candidates) == 1:
+                return candidates[0], None
+            return None, f"{known.name} ({known.side or 'side unknown'}) is not in the inventory"
+
+        board_id = (self.read_info(disk.path) or {}).get('Board-ID')
+        serial = disk.serial or 'unknown'
+        if not board_id:
+            return None, f"serial {serial} is not in the inventory and its Board-ID cannot be read"
+        candidates = [entry for entry in self.pending() if entry.board_id == board_id]
+        if len(candidates) == 1:
+            return candidates[0], None
+        names = ', '.join(entry.name for entry in candidates) or 'no pending device'
+        return None, f"serial {serial} is not in the inventory and Board-ID {board_id} matches {names}"
+
+    def arrive(self, disk, executor):
+        entry, reason = self.match(disk)
+        if entry is None:
+            if disk.name not in self.ignored:
+                self.ignored.add(disk.name)
+                self.log(f"⚠️  {disk.path}: {reason}, ignoring")
+            return
+
+        now = time.monotonic()
+        with self.lock:
+            if entry.finished or entry.state in (FLASHING, REBOOTED):
+                return
+            entry.state = FLASHING
+            entry.attempts += 1
+            entry.arrived = entry.arrived or now
+        self.log(f"📥 {entry.name} on {disk.path} after {now - self.start:.1f}s"
+                 + (f" (attempt {entry.attempts})" if entry.attempts > 1 else ''))
+        executor.submit(self._process, entry, disk)
+
+    def _process(self, entry, disk):
+        try:
+            with span('fleet.device', device=entry.name, attempt=entry.attempts):
+                self._flash(entry, disk)
+        except Exception as e:
+            self._failed(entry, disk, str(e))
+
+    def _flash(self, entry, disk):
+        mount_point, needs_unmount = self.mount(disk)
+        if not mount_point:
+            self._failed(entry, disk, f"could not mount {disk.path}")
+            return
+        try:
+            result = flash_one(FlashJob(entry.name, mount_point, entry.firmware_file, entry.device.serial),
+                               self.progress, check=self.check, history=self.history)
+        finally:
+            if needs_unmount:
+                self.unmount(mount_point)
+        entry.result = result
+        if not result.ok:
+            self._failed(entry, disk, result.error)
+            return
+        if not result.rebooted:
+            # The bootloader did not take the image; the volume is still there to try again
+            if self.history is not None:
+                self.history.forget(entry.device.serial)
+            self._failed(entry, disk, "volume still present after the write, the device did not reset")
+            return
+
+        with self.lock:
+            entry.state = REBOOTED
+            entry.rebooted = time.monotonic()
+        delta = f" (delta, {result.delta.pages}/{result.delta.total_pages} pages)" if result.delta else ''
+        self.log(f"🔄 {entry.name}: {result.bytes_written // 1024} KiB{delta} in {result.write_seconds:.2f}s, "
+                 f"reset after {result.total_seconds - result.write_seconds:.2f}s")
+
+        verify = self.verify if entry.verifiable else None
+        verification = verify(entry, self.verify_timeout) if verify is not None else None
+        if self.history is not None:
+            # Only a device that reset (and verified, when verifying) becomes the next delta's base
+            if verification is None or verification.state in OK_STATES:
+                self.history.record(entry.device.serial, entry.firmware_file)
+            else:
+                self.history.forget(entry.device.serial)  # Next time, write the whole image
+        with self.lock:
+            if verification is None:
+                entry.finished = True
+                if self.verify is not None:
+                    entry.error = 'not verified, devices.yaml has no keyboard entry for it'
+            elif verification.state in OK_STATES:
+                entry.state = VERIFIED
+                entry.verified = time.monotonic()
+                entry.finished = True
+            else:
+                entry.error = '; '.join(verification.problems)
+                if verification.state == MISMATCH:
+                    entry.state = FAILED
+                    entry.finished = True
+                else:
+                    entry.state = UNVERIFIED  # Stays pending until it verifies or the run times out
+            entry.done = time.monotonic() if entry.finished else None
+        icon = {VERIFIED: '✅', FAILED: '❌', UNVERIFIED: '⚠️ '}.get(entry.state, '☑️ ')
+        self.log(f"{icon} {entry.name}: {entry.state}"
+                 + (f" ({entry.error})" if entry.error else ''))
+
+    def _failed(self, entry, disk, error):
+        with self.lock:
+            entry.error = error
+            if entry.attempts <= self.retries:
+                entry.state = PENDING
+                self.retry_disks.append(disk)
+            else:
+                entry.state = FAILED
+                entry.finished = True
+                entry.done = time.monotonic()
+        retry = "retrying while it is in bootloader mode" if entry.state == PENDING else "giving up"
+        self.log(f"❌ {entry.name}: {error} ({retry})")
+
+
+def select_inventory(registry, names=None, variant=None, side=None):
+    """
+    Boards to flash as InventoryItems, the keyboard and bootloader entries of a
+    board paired by name, variant and side; optionally narrowed by name, variant or side
+    """
+    devices = [d for d in registry.values() if d.type in FLASHABLE_TYPES]
+    if names:
+        wanted = {name.lower() for name in names}
+        devices = [d for d in devices if d.name.lower() in wanted]
+    if variant:
+        devices = [d for d in devices if (d.variant or 'base') == variant]
+    if side:
+        devices = [d for d in devices if d.side == side]
+
+    boards = {}
+    for device in devices:
+        boards.setdefault((device.name.lower(), device.variant, device.side), []).append(device)
+    # An entry registered without a side belongs to the one sided board of its name, if there is one
+    for name, board_variant, board_side in [key for key in boards if key[2] is None]:
+        sided = [key for key in boards if key[:2] == (name, board_variant) and key[2] is not None]
+        if len(sided) == 1:
+            boards[sided[0]] += boards.pop((name, board_variant, None))
+    items = []
+    for entries in boards.values():
+        keyboards = [d for d in entries if d.type != 'bootloader']
+        items.append(InventoryItem((keyboards or entries)[0], entries))
+    return items
+
+
+def prepare_firmware(devices, firmware_dir=FIRMWARE_DIR, build=True, jobs=None, use_cache=True):
+    """
+    Build every target the inventory (InventoryItems) needs in one batch (cache
+    hits are restored) and pick each device's image. Returns (FleetDevices,
+    problems), or None if the build failed.
+    """
+    from build_scheduler import load_build_matrix, run_builds, select_targets
+
+    auto_build = load_script('auto-build')
+    auto_flash = load_script('auto-flash')
+    problems = []
+    sided = []
+    for device in devices:
+        if device.side not in ('left', 'right'):
+            problems.append(f"{device.name}: side unknown, set `side:` in devices.yaml so the right half is flashed")
+        else:
+            sided.append(device)
+
+    if build and sided:
+        # Anchored on the artifact name, so eyelash_corne_left does not also pull in every left variant
+        expressions = sorted({f",{target}-" for d in sided
+                              for target in auto_build.get_build_targets_for_device(d.name, d.side)})
+        try:
+            targets = select_targets(load_build_matrix(), expressions)
+        except ImportError:
+            print("❌ PyYAML is required to read build.yaml")
+            return None
+        print(f"🔨 Firmware for {len(sided)} device(s): {len(targets)} build target(s)")
+        results = run_builds(targets, jobs, use_cache=use_cache)
+        if results is None:
+            return None
+        for result in results:
+            if not result.ok:
+                problems.append(f"{result.target.artifact}: {result.error}")
+
+    entries = []
+    for device in sided:
+        firmware_file = auto_flash.find_firmware_file(device.name, device.side, Path(firmware_dir))
+        if firmware_file:
+            entries.append(fleet_device(device, firmware_file))
+        else:
+            problems.append(f"{device.name}: no firmware found in {firmware_dir}")
+    return entries, problems
+
+
+def print_report(entries, wall_seconds):
+    """Per-device latency table (seconds from the start of the run) and the totals"""
+    width = max([len(e.name) for e in entries] + [6])
+    print(f"\n   {'Device':<{width}}  {'State':<9} Tries   Arrive    Flash    Reset   Verify     Done")
+
+    def seconds(value):
+        return f"{value:7.1f}s" if value is not None else '       -'
+
+    start = time.monotonic() - wall_seconds
+    for e in sorted(entries, key=lambda e: (e.done is None, e.done or 0)):
+        status = {VERIFIED: '✅', REBOOTED: '☑️ ', UNVERIFIED: '⚠️ ', FAILED: '❌'}.get(e.state, '⏳')
+        r = e.result if e.result is not None and e.result.ok else None
+        print(f"{status} {e.name:<{width}}  {e.state:<9} {e.attempts:>5} "
+              f"{seconds(e.arrived - start if e.arrived else None)} "
+              f"{seconds(r.write_seconds if r else None)} "
+              f"{seconds(r.total_seconds - r.write_seconds if r and r.rebooted else None)} "
+              f"{seconds(e.verified - e.rebooted if e.verified else None)} "
+              f"{seconds(e.done - start if e.done else None)}")
+        if e.error and e.state != VERIFIED:
+            print(f"     {e.error}")
+
+    flashed = [e for e in entries if e.finished and e.state in (VERIFIED, REBOOTED)]
+    verified = sum(1 for e in entries if e.state == VERIFIED)
+    print(f"\n🎉 Flashed {len(flashed)}/{len(entries)} device(s) ({verified} verified) in {wall_seconds:.1f}s")
+    return len(flashed)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Build and flash a whole device inventory as devices enter bootloader mode')
+    parser.add_argument('devices', nargs='*', help='Device names to flash (default: every keyboard in devices.yaml)')
+    parser.add_argument('--variant', help='Only devices using this firmware variant ("base" for none)')
+    parser.add_argument('--side', choices=['left', 'right'], help='Only one side')
+    parser.add_argument('--firmware-dir', '-f', default=str(FIRMWARE_DIR), help='Directory containing firmware files')
+    parser.add_argument('--no-build', action='store_true', help='Use the firmware already in --firmware-dir')
+    parser.add_argument('--no-cache', action='store_true', help='Always run west build, ignoring the firmware cache')
+    parser.add_argument('--jobs', '-j', type=int, help='Parallel builds (default: CPU count)')
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES,
+                        help=f'Extra attempts for a device whose flash fails (default: {DEFAULT_RETRIES})')
+    parser.add_argument('--timeout', '-t', type=float, default=DEFAULT_TIMEOUT,
+                        help=f'Give up on devices that have not arrived after this many seconds (default: {DEFAULT_TIMEOUT:.0f})')
+    parser.add_argument('--no-verify', action='store_true',
+                        help='Do not wait for flashed devices to come back with their new firmware')
+    parser.add_argument('--force', action='store_true',
+                        help="Skip the family/address check against the bootloader's Board-ID")
+    parser.add_argument('--delta', action='store_true',
+                        help='Write only the flash pages that changed since each device was last flashed')
+    parser.add_argument('--dry-run', '-n', action='store_true', help='Show the inventory and firmware, then stop')
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    setup_profile(args)
+
+    registry = load_registry()
+    devices = select_inventory(registry, args.devices, args.variant, args.side)
+    if not devices:
+        print("No matching devices in ~/.config/zmk/devices.yaml")
+        sys.exit(1)
+
+    prepared = prepare_firmware(devices, args.firmware_dir, build=not (args.no_build or args.dry_run),
+                                jobs=args.jobs, use_cache=not args.no_cache)
+    if prepared is None:
+        sys.exit(1)
+    entries, problems = prepared
+    for problem in problems:
+        print(f"⚠️  {problem}")
+    if not entries:
+        print("❌ Nothing to flash")
+        sys.exit(1)
+
+    print(f"\n📋 Inventory: {len(entries)} device(s)")
+    for entry in entries:
+        print(f"   {entry.name:<24} {entry.device.side:<5}  {os.path.basename(entry.firmware_file)}")
+        if not entry.verifiable and not args.no_verify:
+            print("      ⚠️  only a bootloader entry in devices.yaml, so it is flashed but not verified")
+    if args.dry_run:
+        return
+
+    print(f"\n⏳ Put the devices into bootloader mode (double-tap reset) in any order; "
+          f"waiting up to {args.timeout:.0f}s. Ctrl-C stops early.")
+    start = time.monotonic()
+    with BootloaderWatcher() as watcher:
+        pipeline = FleetPipeline(entries, watcher, verify=None if args.no_verify else verify_entry,
+                                 retries=args.retries, check=not args.force, progress=ProgressReporter(),
+                                 history=FlashHistory(delta=args.delta), registry=registry)
+        try:
+            pipeline.run(args.timeout)
+        except KeyboardInterrupt:
+            print("\n🛑 Stopped; flashes already under way were completed")
+
+    if print_report(entries, time.monotonic() - start) < len(entries) or problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
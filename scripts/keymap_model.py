@@ -0,0 +1,1037 @@
+#!/usr/bin/env python3
+"""
+Keymap model for ZMK config analysis
+Runs the keymaps through a small C preprocessor (#include, #define, #if*, macro
+expansion with # and ##), parses the resulting devicetree, and exposes layers,
+combos, behaviors and leader sequences. Scanned files and finished models are
+cached in .build/ and invalidated by mtime, then content hash, so only changed
+files are re-read.
+"""
+
+import hashlib
+import os
+import pickle
+import re
+import sys
+from collections import namedtuple
+from pathlib import Path
+
+# Constants
+REPO_ROOT = Path(__file__).resolve().parent.parent
+CONFIG_DIR = REPO_ROOT / 'config'
+CACHE_PATH = REPO_ROOT / '.build' / 'keymap-model.pickle'
+CACHE_VERSION = 2
+MAX_INCLUDE_DEPTH = 40
+MARKER = '\x01'  # Brackets "file:line" location markers in the preprocessed text
+
+DIRECTIVES = {'define', 'undef', 'include', 'if', 'ifdef', 'ifndef', 'elif', 'else', 'endif',
+              'error', 'warning', 'pragma', 'line'}
+
+Binding = namedtuple('Binding', 'behavior params')
+Layer = namedtuple('Layer', 'index name display_name bindings sensor_bindings source')
+Combo = namedtuple('Combo', 'name key_positions bindings timeout_ms require_prior_idle_ms layers slow_release source')
+Behavior = namedtuple('Behavior', 'label name compatible binding_cells properties source')
+LeaderSequence = namedtuple('LeaderSequence', 'name sequence bindings source')
+Macro = namedtuple('Macro', 'name params variadic body')
+
+
+# Stand-in for the zmk-helpers macros, which are only present after `west update`.
+# Used only when the real header cannot be found on the include path; a model
+# built on it (or without the module's key-label headers) is marked approximate.
+
+FALLBACK_HELPERS = r'''
+#define ZMK_HOLD_TAP(name, ...) / { behaviors { name: name { compatible = "zmk,behavior-hold-tap"; #binding-cells = <2>; __VA_ARGS__ }; }; };
+#define ZMK_TAP_DANCE(name, ...) / { behaviors { name: name { compatible = "zmk,behavior-tap-dance"; #binding-cells = <0>; __VA_ARGS__ }; }; };
+#define ZMK_MOD_MORPH(name, ...) / { behaviors { name: name { compatible = "zmk,behavior-mod-morph"; #binding-cells = <0>; __VA_ARGS__ }; }; };
+#define ZMK_STICKY_KEY(name, ...) / { behaviors { name: name { compatible = "zmk,behavior-sticky-key"; #binding-cells = <1>; __VA_ARGS__ }; }; };
+#define ZMK_MACRO(name, ...) / { macros { name: name { compatible = "zmk,behavior-macro"; #binding-cells = <0>; __VA_ARGS__ }; }; };
+#define ZMK_MACRO_ONE_PARAM(name, ...) / { macros { name: name { compatible = "zmk,behavior-macro-one-param"; #binding-cells = <1>; __VA_ARGS__ }; }; };
+#define ZMK_MACRO_TWO_PARAM(name, ...) / { macros { name: name { compatible = "zmk,behavior-macro-two-param"; #binding-cells = <2>; __VA_ARGS__ }; }; };
+#define ZMK_LAYER(name, layout) / { keymap { compatible = "zmk,keymap"; layer_ ## name { display-name = #name; bindings = <layout>; }; }; };
+#define ZMK_COMBO(name, combo_bindings, keypos, combo_layers, ...) / { combos { compatible = "zmk,combos"; combo_ ## name { bindings = <combo_bindings>; key-positions = <keypos>; layers = <combo_layers>; __VA_ARGS__ }; }; };
+#define UC_MACRO(name, unicode_bindings) / { macros { name: name { compatible = "zmk,behavior-macro"; #binding-cells = <0>; bindings = <unicode_bindings>; }; }; };
+#define ZMK_UNICODE_SINGLE(name, L0, L1, L2, L3) UC_MACRO(name, &kp L0 &kp L1 &kp L2 &kp L3)
+'''
+
+
+FALLBACK_HEADERS = {
+    'zmk-helpers/helper.h': FALLBACK_HELPERS,
+}
+
+
+# ---------------------------------------------------------------------------
+# Source scanning (cached per file)
+
+def scan_source(text):
+    """
+    Strip comments and join continuation lines.
+    Returns [(line_number, logical_line)] for non-blank lines.
+    """
+    out = []
+    i = 0
+    n = len(text)
+    in_string = False
+    while i < n:
+        c = text[i]
+        if in_string:
+            out.append(c)
+            if c == '\\' and i + 1 < n:
+                out.append(text[i + 1])
+                i += 2
+                continue
+            if c == '"' or c == '\n':
+                in_string = False
+            i += 1
+        elif c == '"':
+            in_string = True
+            out.append(c)
+            i += 1
+        elif text.startswith('//', i):
+            end = text.find('\n', i)
+            i = n if end < 0 else end
+        elif text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            end = n if end < 0 else end + 2
+            out.append(' ' + '\n' * text.count('\n', i, end))  # Keep line numbers intact
+            i = end
+        else:
+            out.append(c)
+            i += 1
+
+    lines = []
+    pending = None
+    for number, line in enumerate(''.join(out).split('\n'), 1):
+        if pending is not None:
+            start, joined = pending
+            line = joined + ' ' + line
+        else:
+            start = number
+        stripped = line.rstrip()
+        if stripped.endswith('\\'):
+            pending = (start, stripped[:-1])
+            continue
+        pending = None
+        if stripped.strip():
+            lines.append((start, stripped))
+    if pending is not None and pending[1].strip():
+        lines.append(pending)
+    return lines
+
+
+# ---------------------------------------------------------------------------
+# Macro expansion
+
+TOKEN_RE = re.compile(r'''
+    [ \t\r\n]+
+  | [A-Za-z_][A-Za-z0-9_]*
+  | \.?[0-9](?:[eEpP][+-]|[A-Za-z0-9_.])*
+  | "(?:\\.|[^"\\])*"
+  | \#\#
+  | .
+''', re.VERBOSE | re.DOTALL)
+
+
+class Painted(str):
+    """An identifier that named a macro while that macro was being expanded; never expanded again"""
+    __slots__ = ()
+
+
+def tokenize(text):
+    return [' ' if tok[0] in ' \t\r\n' else tok for tok in TOKEN_RE.findall(text)]
+
+
+def _is_ident(tok):
+    return tok[0].isalpha() or tok[0] == '_'
+
+
+def _strip(tokens):
+    start, end = 0, len(tokens)
+    while start < end and tokens[start] == ' ':
+        start += 1
+    while end > start and tokens[end - 1] == ' ':
+        end -= 1
+    return tokens[start:end]
+
+
+def _collect_args(tokens, open_index):
+    """Split the arguments of a macro call starting at '('. Returns (args, close_index)."""
+    depth = 0
+    args = [[]]
+    for k in range(open_index + 1, len(tokens)):
+        tok = tokens[k]
+        if tok == '(':
+            depth += 1
+        elif tok == ')':
+            if depth == 0:
+                return [_strip(a) for a in args], k
+            depth -= 1
+        elif tok == ',' and depth == 0:
+            args.append([])
+            continue
+        args[-1].append(tok)
+    return None, None
+
+
+class MacroExpander:
+    """Object-like and function-like macros with #, ## and __VA_ARGS__"""
+
+    def __init__(self):
+        self.macros = {}
+
+    def define(self, text):
+        match = re.match(r'([A-Za-z_]\w*)(\(([^)]*)\))?\s*(.*)', text, re.DOTALL)
+        if not match:
+            return
+        name, has_params, params, body = match.groups()
+        variadic = False
+        if has_params is not None:
+            params = [p.strip() for p in params.split(',') if p.strip()]
+            if params and params[-1] == '...':
+                params[-1] = '__VA_ARGS__'
+                variadic = True
+        else:
+            params = None
+        self.macros[name] = Macro(name, params, variadic, _strip(tokenize(body)))
+
+    def undef(self, name):
+        self.macros.pop(name, None)
+
+    def expand(self, tokens, disabled=frozenset()):
+        out = []
+        i = 0
+        n = len(tokens)
+        macros = self.macros
+        while i < n:
+            tok = tokens[i]
+            macro = macros.get(tok) if type(tok) is str and _is_ident(tok) else None
+            if macro is None:
+                out.append(tok)
+                i += 1
+                continue
+            if tok in disabled:
+                out.append(Painted(tok))
+                i += 1
+                continue
+            if macro.params is None:
+                out.extend(self.expand(self._paste(list(macro.body)), disabled | {tok}))
+                i += 1
+                continue
+
+            j = i + 1
+            while j < n and tokens[j] == ' ':
+                j += 1
+            if j >= n or tokens[j] != '(':
+                out.append(tok)
+                i += 1
+                continue
+            args, close = _collect_args(tokens, j)
+            if args is None:
+                out.append(tok)
+                i += 1
+                continue
+            body = self._substitute(macro, args, disabled)
+            out.extend(self.expand(body, disabled | {tok}))
+            i = close + 1
+        return out
+
+    def _substitute(self, macro, args, disabled):
+        params = macro.params
+        if macro.variadic:
+            fixed = len(params) - 1
+            rest = args[fixed:]
+            args = args[:fixed]
+            variadic = []
+            for index, arg in enumerate(rest):
+                if index:
+                    variadic.append(',')
+                variadic.extend(arg)
+            args.append(variadic)
+        if len(args) < len(params):
+            args = args + [[]] * (len(params) - len(args))
+        values = dict(zip(params, args))
+
+        body = macro.body
+        result = []
+        expanded = {}
+        k = 0
+        while k < len(body):
+            tok = body[k]
+            if tok == '#':
+                j = k + 1
+                while j < len(body) and body[j] == ' ':
+                    j += 1
+                if j < len(body) and body[j] in values:
+                    text = ''.join(values[body[j]]).replace('\\', '\\\\').replace('"', '\\"')
+                    result.append(f'"{text}"')
+                    k = j + 1
+                    continue
+            if tok in values:
+                prev = next((t for t in reversed(result) if t != ' '), None)
+                following = next((t for t in body[k + 1:] if t != ' '), None)
+                if prev == '##' or following == '##':
+                    result.extend(values[tok] or [''])
+                else:
+                    if tok not in expanded:
+                        expanded[tok] = self.expand(values[tok], disabled)
+                    result.extend(expanded[tok])
+            else:
+                result.append(tok)
+            k += 1
+        return self._paste(result)
+
+    @staticmethod
+    def _paste(tokens):
+        if '##' not in tokens:
+            return tokens
+        out = []
+        k = 0
+        while k < len(tokens):
+            tok = tokens[k]
+            if tok == '##':
+                while out and out[-1] == ' ':
+                    out.pop()
+                k += 1
+                while k < len(tokens) and tokens[k] == ' ':
+                    k += 1
+                left = out.pop() if out else ''
+                right = tokens[k] if k < len(tokens) else ''
+                out.extend(tokenize(str(left) + str(right)) or [''])
+            else:
+                out.append(tok)
+            k += 1
+        return [t for t in out if t != '']
+
+    def evaluate(self, expression):
+        """Evaluate an #if expression (unknown identifiers are 0)"""
+        expression = re.sub(r'defined\s*\(\s*(\w+)\s*\)|defined\s+(\w+)',
+                            lambda m: '1' if (m.group(1) or m.group(2)) in self.macros else '0', expression)
+        text = ''.join(self.expand(tokenize(expression)))
+        text = re.sub(r'[A-Za-z_]\w*', '0', text)
+        text = re.sub(r'(\d+)[uUlL]+', r'\1', text)
+        text = text.replace('&&', ' and ').replace('||', ' or ')
+        text = re.sub(r'!(?!=)', ' not ', text)
+        if not re.fullmatch(r'[\d\s()+\-*/%<>=!&|^~x a-fnotd]*', text):
+            return False
+        try:
+            return bool(eval(text.replace('/', '//'), {'__builtins__': {}}, {}))
+        except Exception:
+            return False
+
+
+# ---------------------------------------------------------------------------
+# Preprocessing
+
+class Preprocessor:
+    """
+    Preprocesses a keymap the way the ZMK build does, recording the include graph.
+    Output text carries MARKER-delimited "file:line" markers for source locations.
+    """
+
+    def __init__(self, include_dirs, read_lines):
+        self.include_dirs = [Path(d) for d in include_dirs]
+        self.read_lines = read_lines
+        self.expander = MacroExpander()
+        self.includes = {}  # file -> [included file or "<name>" for external headers]
+        self.files = set()  # Local files the output depends on
+        self.probes = set()  # Paths that were looked for but did not exist
+        self.fallbacks = set()  # Module headers substituted with built-in stand-ins
+        self.output = []
+
+    def resolve(self, name, current_dir, quoted):
+        search = ([current_dir] if quoted else []) + self.include_dirs
+        for directory in search:
+            candidate = directory / name
+            if candidate.is_file():
+                return candidate.resolve()
+            self.probes.add(str(candidate))
+        return None
+
+    def run(self, path):
+        path = Path(path).resolve()
+        self._process(str(path), self.read_lines(path), path.parent, 0)
+        return ''.join(self.output)
+
+    def _emit(self, location, lines):
+        text = ' '.join(lines)
+        self.output.append(f"{MARKER}{location}{MARKER}")
+        self.output.extend(self.expander.expand(tokenize(text)))
+        self.output.append('\n')
+
+    def _process(self, name, lines, current_dir, depth):
+        if depth > MAX_INCLUDE_DEPTH:
+            return
+        self.includes.setdefault(name, [])
+        if not name.startswith('<'):
+            self.files.add(name)
+
+        stack = []  # (active, taken, parent_active)
+        active = True
+        pending = []
+        pending_start = None
+        paren_depth = 0
+
+        def flush():
+            nonlocal pending, pending_start, paren_depth
+            if pending:
+                self._emit(f"{name}:{pending_start}", pending)
+            pending = []
+            pending_start = None
+            paren_depth = 0
+
+        for number, line in lines:
+            stripped = line.lstrip()
+            directive = None
+            if stripped.startswith('#'):
+                match = re.match(r'#\s*([a-z]+)\b\s*(.*)', stripped, re.DOTALL)
+                if match and match.group(1) in DIRECTIVES:
+                    directive, argument = match.group(1), match.group(2).strip()
+
+            if directive is None:
+                if active:
+                    if pending_start is None:
+                        pending_start = number
+                    pending.append(line)
+                    paren_depth += line.count('(') - line.count(')')
+                    if paren_depth <= 0:
+                        flush()
+                continue
+
+            flush()
+            if directive in ('ifdef', 'ifndef'):
+                defined = argument.split()[0] in self.expander.macros if argument else False
+                taken = defined if directive == 'ifdef' else not defined
+                stack.append((active, taken))
+                active = active and taken
+            elif directive == 'if':
+                taken = active and self.expander.evaluate(argument)
+                stack.append((active, taken))
+                active = taken
+            elif directive == 'elif':
+                parent, taken = stack[-1] if stack else (True, True)
+                now = parent and not taken and self.expander.evaluate(argument)
+                stack[-1] = (parent, taken or now)
+                active = now
+            elif directive == 'else':
+                parent, taken = stack[-1] if stack else (True, True)
+                active = parent and not taken
+                stack[-1] = (parent, True)
+            elif directive == 'endif':
+                active = stack.pop()[0] if stack else True
+            elif not active:
+                continue
+            elif directive == 'define':
+                self.expander.define(argument)
+            elif directive == 'undef':
+                self.expander.undef(argument.split()[0] if argument else '')
+            elif directive == 'include':
+                self._include(name, argument, current_dir, depth)
+        flush()
+
+    def _include(self, name, argument, current_dir, depth):
+        match = re.match(r'"([^"]+)"|<([^>]+)>', argument)
+        if not match:
+            match = re.match(r'"([^"]+)"|<([^>]+)>', ''.join(self.expander.expand(tokenize(argument))).strip())
+            if not match:
+                return
+        quoted = match.group(1) is not None
+        target = match.group(1) or match.group(2)
+
+        resolved = self.resolve(target, current_dir, quoted)
+        if resolved:
+            self.includes[name].append(str(resolved))
+            self._process(str(resolved), self.read_lines(resolved), resolved.parent, depth + 1)
+        elif target in FALLBACK_HEADERS:
+            virtual = f"<{target}>"
+            self.includes[name].append(virtual)
+            self.fallbacks.add(target)
+            self._process(virtual, scan_source(FALLBACK_HEADERS[target]), current_dir, depth + 1)
+        else:
+            self.includes[name].append(f"<{target}>")
+
+
+# ---------------------------------------------------------------------------
+# Devicetree parsing
+
+DTS_TOKEN_RE = re.compile(r'''
+    (?P<marker>\x01[^\x01]*\x01)
+  | (?P<ws>\s+)
+  | (?P<string>"(?:\\.|[^"\\])*")
+  | (?P<cells><[^<>]*>)
+  | (?P<bytes>\[[^\]]*\])
+  | (?P<directive>/[a-z][a-z-]*/)
+  | (?P<ref>&[A-Za-z_][\w]*)
+  | (?P<name>[A-Za-z0-9_,.+\-\#@?]+)
+  | (?P<punct>.)
+''', re.VERBOSE)
+
+
+class Node:
+    """A devicetree node; properties hold lists of ('cells', [tokens]) / ('string', s) / ('ref', label)"""
+
+    __slots__ = ('name', 'labels', 'props', 'children', 'source')
+
+    def __init__(self, name, source=None):
+        self.name = name
+        self.labels = []
+        self.props = {}
+        self.children = {}
+        self.source = source
+
+    def walk(self):
+        yield self
+        for child in self.children.values():
+            yield from child.walk()
+
+    def string(self, prop):
+        for kind, value in self.props.get(prop) or ():
+            if kind == 'string':
+                return value
+        return None
+
+    def cells(self, prop):
+        """All cell tokens of a property, across every <...> group"""
+        tokens = []
+        for kind, value in self.props.get(prop) or ():
+            if kind == 'cells':
+                tokens.extend(value)
+        return tokens
+
+    def cell_groups(self, prop):
+        return [value for kind, value in self.props.get(prop) or () if kind == 'cells']
+
+    def merge(self, other):
+        for label in other.labels:
+            if label not in self.labels:
+                self.labels.append(label)
+        self.props.update(other.props)
+        for name, child in other.children.items():
+            if name in self.children:
+                self.children[name].merge(child)
+            else:
+                self.children[name] = child
+
+
+def split_cells(text):
+    """Split the inside of <...> into tokens, keeping parenthesised expressions whole"""
+    text = re.sub(MARKER + '[^' + MARKER + ']*' + MARKER, ' ', text)
+    tokens = []
+    current = []
+    depth = 0
+    for c in text:
+        if c.isspace() and depth == 0:
+            if current:
+                tokens.append(''.join(current))
+                current = []
+            continue
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth = max(depth - 1, 0)
+        current.append(c)
+    if current:
+        tokens.append(''.join(current))
+    return tokens
+
+
+class DtsParser:
+    """Lenient parser for preprocessed ZMK devicetree source"""
+
+    def __init__(self, text):
+        self.tokens = []
+        location = None
+        for match in DTS_TOKEN_RE.finditer(text):
+            kind = match.lastgroup
+            value = match.group()
+            if kind == 'marker':
+                location = value.strip(MARKER)
+            elif kind != 'ws':
+                self.tokens.append((kind, value, location))
+        self.pos = 0
+        self.root = Node('/')
+        self.overrides = []  # (label, Node) for "&label { ... };"
+
+    def peek(self, offset=0):
+        index = self.pos + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None, None)
+
+    def skip_statement(self):
+        depth = 0
+        while self.pos < len(self.tokens):
+            kind, value, _ = self.tokens[self.pos]
+            self.pos += 1
+            if value == '{':
+                depth += 1
+            elif value == '}':
+                depth -= 1
+                if depth <= 0 and self.peek()[1] == ';':
+                    self.pos += 1
+                    return
+            elif value == ';' and depth == 0:
+                return
+
+    def parse(self):
+        while self.pos < len(self.tokens):
+            kind, value, location = self.peek()
+            if value == '/' and self.peek(1)[1] == '{':
+                self.pos += 2
+                self.parse_body(self.root)
+            elif kind == 'ref' and self.peek(1)[1] == '{':
+                node = Node(value[1:], location)
+                self.pos += 2
+                self.parse_body(node)
+                self.overrides.append((value[1:], node))
+            elif value == ';':
+                self.pos += 1
+            elif kind == 'directive':
+                self.skip_statement()
+            elif kind == 'name':
+                self.parse_item(self.root)  # Nodes outside "/ { }" are merged into the root
+            else:
+                self.pos += 1
+        return self.root
+
+    def parse_body(self, node):
+        while self.pos < len(self.tokens):
+            kind, value, _ = self.peek()
+            if value == '}':
+                self.pos += 1
+                if self.peek()[1] == ';':
+                    self.pos += 1
+                return
+            if value == ';':
+                self.pos += 1
+            elif kind == 'name':
+                self.parse_item(node)
+            else:
+                self.skip_statement()
+
+    def parse_item(self, node):
+        labels = []
+        while self.peek()[0] == 'name' and self.peek(1)[1] == ':':
+            labels.append(self.peek()[1])
+            self.pos += 2
+        kind, name, location = self.peek()
+        if kind != 'name':
+            return
+        self.pos += 1
+        following = self.peek()[1]
+
+        if following == '{':
+            self.pos += 1
+            child = node.children.get(name)
+            if child is None:
+                child = node.children[name] = Node(name, location)
+            for label in labels:
+                if label not in child.labels:
+                    child.labels.append(label)
+            self.parse_body(child)
+        elif following == '=':
+            self.pos += 1
+            values = []
+            while self.pos < len(self.tokens):
+                kind, value, _ = self.peek()
+                self.pos += 1
+                if value == ';':
+                    break
+                if kind == 'cells':
+                    values.append(('cells', split_cells(value[1:-1])))
+                elif kind == 'string':
+                    values.append(('string', value[1:-1]))
+                elif kind == 'ref':
+                    values.append(('ref', value[1:]))
+                elif kind == 'bytes':
+                    values.append(('bytes', value[1:-1].split()))
+                elif value == '}':
+                    self.pos -= 1
+                    break
+            node.props[name] = values
+        elif following == ';':
+            self.pos += 1
+            node.props[name] = True
+        else:
+            self.skip_statement()
+
+
+# ---------------------------------------------------------------------------
+# Model
+
+def to_int(token):
+    """Integer value of a cell token (literal or simple arithmetic), else None"""
+    if isinstance(token, int):
+        return token
+    try:
+        return int(token, 0)
+    except (TypeError, ValueError):
+        pass
+    if token and re.fullmatch(r'[\d\s()+\-*/%<>|&^~x]+', token):
+        try:
+            return int(eval(token.replace('/', '//'), {'__builtins__': {}}, {}))
+        except Exception:
+            return None
+    return None
+
+
+def parse_bindings(tokens):
+    """Split cell tokens into Bindings, each starting at a &reference"""
+    bindings = []
+    for token in tokens:
+        if token.startswith('&'):
+            bindings.append(Binding(token[1:], []))
+        elif bindings:
+            value = to_int(token)
+            bindings[-1].params.append(token if value is None else value)
+    return [Binding(b.behavior, tuple(b.params)) for b in bindings]
+
+
+def format_binding(binding):
+    return ' '.join(['&' + binding.behavior] + [str(p) for p in binding.params])
+
+
+class KeymapModel:
+    """Everything other tools need to know about one keymap"""
+
+    def __init__(self, path, root, overrides, includes, files, fallbacks):
+        self.path = str(path)
+        self.includes = includes
+        self.dependencies = sorted(files)
+        self.fallbacks = sorted(fallbacks)
+        self.layers = []
+        self.combos = []
+        self.behaviors = {}
+        self.leader_sequences = []
+        self.warnings = []
+        self._build(root, overrides)
+
+    @property
+    def name(self):
+        return Path(self.path).name
+
+    @property
+    def external_includes(self):
+        return sorted({target[1:-1] for targets in self.includes.values()
+                       for target in targets if target.startswith('<')})
+
+    @property
+    def approximate(self):
+        """Built on stand-ins for module headers, or with key positions no header resolved"""
+        return bool(self.fallbacks) or any(not isinstance(position, int)
+                                           for combo in self.combos for position in combo.key_positions)
+
+    @property
+    def key_count(self):
+        return max((len(layer.bindings) for layer in self.layers), default=0)
+
+    def _build(self, root, overrides):
+        by_label = {}
+        for node in root.walk():
+            for label in node.labels:
+                by_label[label] = node
+        for label, node in overrides:
+            if label in by_label:
+                by_label[label].merge(node)
+
+        for node in root.walk():
+            compatible = node.string('compatible')
+            if compatible == 'zmk,keymap':
+                for child in node.children.values():
+                    if 'bindings' in child.props:
+                        self.layers.append(Layer(
+                            len(self.layers), child.name, child.string('display-name') or child.name,
+                            parse_bindings(child.cells('bindings')),
+                            parse_bindings(child.cells('sensor-bindings')), child.source))
+            elif compatible == 'zmk,combos':
+                for child in node.children.values():
+                    if 'key-positions' in child.props:
+                        self.combos.append(self._combo(child))
+            elif compatible and compatible.startswith('zmk,behavior-'):
+                label = node.labels[0] if node.labels else node.name
+                cells = [to_int(t) for t in node.cells('#binding-cells')]
+                properties = {}
+                for prop, values in node.props.items():
+                    if prop in ('compatible', '#binding-cells') or values is True:
+                        properties[prop] = values
+                    elif prop == 'bindings':
+                        properties[prop] = [parse_bindings(g) for g in node.cell_groups(prop)]
+                    else:
+                        tokens = node.cells(prop)
+                        ints = [to_int(t) for t in tokens]
+                        properties[prop] = ints if tokens and None not in ints else (tokens or node.string(prop))
+                self.behaviors[label] = Behavior(label, node.name, compatible,
+                                                 cells[0] if cells else None, properties, node.source)
+                if compatible == 'zmk,behavior-leader-key':
+                    for child in node.children.values():
+                        if 'sequence' in child.props:
+                            name = child.name
+                            if name.startswith('leader_sequence_'):
+                                name = name[len('leader_sequence_'):]
+                            self.leader_sequences.append(LeaderSequence(
+                                name, tuple(child.cells('sequence')),
+                                parse_bindings(child.cells('bindings')), child.source))
+
+    def _combo(self, node):
+        positions = []
+        for token in node.cells('key-positions'):
+            value = to_int(token)
+            if value is None:
+                self.warnings.append(f"{node.name}: unresolved key position {token}")
+            positions.append(token if value is None else value)
+
+        def single(prop):
+            values = [to_int(t) for t in node.cells(prop)]
+            return values[0] if values else None
+
+        layers = [to_int(t) for t in node.cells('layers')]
+        name = node.name[len('combo_'):] if node.name.startswith('combo_') else node.name
+        return Combo(name, tuple(positions), parse_bindings(node.cells('bindings')),
+                     single('timeout-ms'), single('require-prior-idle-ms'),
+                     tuple(l for l in layers if l is not None),
+                     node.props.get('slow-release') is True, node.source)
+
+    def combos_per_key(self):
+        """{key position: number of combos using it}"""
+        counts = {}
+        for combo in self.combos:
+            for position in combo.key_positions:
+                counts[position] = counts.get(position, 0) + 1
+        return counts
+
+    def layer_index(self, name):
+        for layer in self.layers:
+            if layer.name == name or layer.display_name == name:
+                return layer.index
+        return None
+
+    def to_dict(self):
+        return {
+            'path': self.path,
+            'dependencies': self.dependencies,
+            'external_includes': self.external_includes,
+            'fallbacks': self.fallbacks,
+            'approximate': self.approximate,
+            'layers': [{'index': l.index, 'name': l.name, 'display_name': l.display_name,
+                        'bindings': [format_binding(b) for b in l.bindings]} for l in self.layers],
+            'combos': [{'name': c.name, 'key_positions': list(c.key_positions),
+                        'bindings': [format_binding(b) for b in c.bindings], 'timeout_ms': c.timeout_ms,
+                        'require_prior_idle_ms': c.require_prior_idle_ms, 'layers': list(c.layers),
+                        'source': c.source} for c in self.combos],
+            'behaviors': {label: {'compatible': b.compatible, 'binding_cells': b.binding_cells, 'source': b.source}
+                          for label, b in self.behaviors.items()},
+            'leader_sequences': [{'name': s.name, 'sequence': list(s.sequence),
+                                  'bindings': [format_binding(b) for b in s.bindings], 'source': s.source}
+                                 for s in self.leader_sequences],
+            'warnings': self.warnings,
+        }
+
+
+# ---------------------------------------------------------------------------
+# Caching
+
+def default_include_dirs(root=REPO_ROOT):
+    """
+    config/ plus the include/ directory of every west project in config/west.yml
+    that is checked out (as keymap-drawer uses). ZMK and Zephyr are left out so
+    keycodes stay symbolic.
+    """
+    from workspace_state import west_projects
+
+    dirs = [root / 'config']
+    for name, path in west_projects(root / 'config' / 'west.yml'):
+        include = root / path / 'include'
+        if name not in ('zmk', 'zephyr') and include.is_dir():
+            dirs.append(include)
+    return dirs
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class ModelCache:
+    """
+    Persistent cache of scanned source files and finished models.
+    A file is re-read only when its mtime or size changed, and re-scanned only
+    when its content hash changed. A model is rebuilt only when one of the files
+    it depends on changed, or a header it could not find has appeared.
+    """
+
+    def __init__(self, path=CACHE_PATH, enabled=True):
+        self.path = Path(path)
+        self.enabled = enabled
+        self.dirty = False
+        self.scanned = 0  # Files (re)scanned during this run
+        self.data = {'version': CACHE_VERSION, 'files': {}, 'models': {}}
+        if enabled:
+            try:
+                with open(self.path, 'rb') as f:
+                    data = pickle.load(f)
+                if data.get('version') == CACHE_VERSION:
+                    self.data = data
+            except (OSError, EOFError, pickle.PickleError, AttributeError, ImportError):
+                pass
+
+    def _entry(self, path):
+        """(digest, lines) for a file, refreshing the cache entry if it changed"""
+        key = str(path)
+        stat = os.stat(key)
+        entry = self.data['files'].get(key)
+        if entry and entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            return entry
+        with open(key, 'rb') as f:
+            content = f.read()
+        digest = _digest(content)
+        if not entry or entry['digest'] != digest:
+            self.scanned += 1
+            entry = {'digest': digest, 'lines': scan_source(content.decode('utf-8', 'replace'))}
+        entry['mtime'] = stat.st_mtime_ns
+        entry['size'] = stat.st_size
+        self.data['files'][key] = entry
+        self.dirty = True
+        return entry
+
+    def read_lines(self, path):
+        return self._entry(path)['lines']
+
+    def _valid(self, cached):
+        for path, digest in cached['files'].items():
+            try:
+                if self._entry(path)['digest'] != digest:
+                    return False
+            except OSError:
+                return False
+        return not any(os.path.exists(p) for p in cached['probes'])
+
+    def model(self, keymap, include_dirs=None):
+        keymap = Path(keymap).resolve()
+        include_dirs = [Path(d) for d in (include_dirs or default_include_dirs())]
+        key = (str(keymap), tuple(str(d) for d in include_dirs))
+
+        cached = self.data['models'].get(key)
+        if cached and self._valid(cached):
+            return cached['model']
+
+        preprocessor = Preprocessor(include_dirs, self.read_lines)
+        parser = DtsParser(preprocessor.run(keymap))
+        root = parser.parse()
+        model = KeymapModel(keymap, root, parser.overrides, preprocessor.includes,
+                            preprocessor.files, preprocessor.fallbacks)
+        self.data['models'][key] = {
+            'files': {path: self._entry(path)['digest'] for path in preprocessor.files},
+            'probes': sorted(preprocessor.probes),
+            'model': model,
+        }
+        self.dirty = True
+        return model
+
+    def save(self):
+        if not (self.enabled and self.dirty):
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix('.tmp')
+            with open(tmp, 'wb') as f:
+                pickle.dump(self.data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.path)
+            self.dirty = False
+        except OSError:
+            pass
+
+
+def keymap_files(config_dir=CONFIG_DIR):
+    return sorted(Path(config_dir).glob('*.keymap'))
+
+
+def load_model(keymap, include_dirs=None, use_cache=True):
+    """Load one keymap model through the persistent cache"""
+    cache = ModelCache(enabled=use_cache)
+    model = cache.model(keymap, include_dirs)
+    cache.save()
+    return model
+
+
+def load_models(keymaps=None, include_dirs=None, use_cache=True):
+    """Load several keymap models sharing one cache. Returns {name: KeymapModel}."""
+    cache = ModelCache(enabled=use_cache)
+    models = {}
+    for keymap in keymaps or keymap_files():
+        path = Path(keymap)
+        if not path.exists() and not path.suffix:
+            path = CONFIG_DIR / f"{keymap}.keymap"
+        elif not path.exists():
+            path = CONFIG_DIR / path.name
+        models[path.name] = cache.model(path, include_dirs)
+    cache.save()
+    if not keymaps:
+        # Shared fragments such as jjb.keymap are covered by the keymaps including them
+        included = {p for m in models.values() for p in m.dependencies if p != m.path}
+        models = {name: m for name, m in models.items() if m.path not in included}
+    return models
+
+
+def print_summary(model):
+    print(f"📋 {model.name}")
+    local = [os.path.relpath(p, REPO_ROOT) for p in model.dependencies]
+    print(f"   Includes: {len(local)} local file(s), {len(model.external_includes)} external header(s)")
+    if model.fallbacks:
+        print(f"   Using built-in stand-ins for: {', '.join(model.fallbacks)}")
+    if model.approximate:
+        print("   ⚠️  Approximate: module headers are missing from the west workspace (run `just init`)")
+    print(f"   Layers: {len(model.layers)} ({model.key_count} keys)   Combos: {len(model.combos)}   "
+          f"Behaviors: {len(model.behaviors)}   Leader sequences: {len(model.leader_sequences)}")
+    for warning in model.warnings[:5]:
+        print(f"   ⚠️  {warning}")
+    if len(model.warnings) > 5:
+        print(f"   ⚠️  ... and {len(model.warnings) - 5} more warning(s)")
+
+
+def print_includes(model, name=None, indent=0, seen=None):
+    """Print the include tree below name (default: the keymap itself)"""
+    seen = set() if seen is None else seen
+    name = name or model.path
+    for target in model.includes.get(name, []):
+        if target.startswith('<'):
+            label = target + (' (built-in stand-in)' if target[1:-1] in model.fallbacks else '')
+        else:
+            label = os.path.relpath(target, REPO_ROOT)
+        print(f"{'   ' * (indent + 1)}{label}")
+        if target not in seen and not target.startswith('<'):
+            seen.add(target)
+            print_includes(model, target, indent + 1, seen)
+
+
+def main():
+    import argparse
+    from tracing import add_profile_argument, setup_profile
+    import json
+
+    parser = argparse.ArgumentParser(description='Inspect the preprocessed ZMK keymap model')
+    parser.add_argument('keymaps', nargs='*', help='Keymaps to load (default: all config/*.keymap)')
+    parser.add_argument('--includes', '-i', action='store_true', help='Show the include tree')
+    parser.add_argument('--leader-count', action='store_true',
+                        help='Print the largest number of leader sequences in any keymap')
+    parser.add_argument('--json', action='store_true', help='Dump the models as JSON')
+    parser.add_argument('--no-cache', action='store_true', help='Ignore and do not update the model cache')
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    setup_profile(args)
+
+    models = load_models(args.keymaps, use_cache=not args.no_cache)
+    if args.leader_count:
+        print(max((len(m.leader_sequences) for m in models.values()), default=0))
+        return
+    if args.json:
+        json.dump({name: m.to_dict() for name, m in models.items()}, sys.stdout, indent=1)
+        print()
+        return
+
+    for model in models.values():
+        print_summary(model)
+        if args.includes:
+            print_includes(model)
+        print()
+
+
+if __name__ == "__main__":
+    # Run through the importable module so pickled models refer to keymap_model, not __main__
+    sys.path.insert(0, str(Path(__file__).parent))
+    import keymap_model
+    keymap_model.main()
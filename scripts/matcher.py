@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Device and firmware matching for ZMK tools
+Bootloader keywords, keyboard aliases and firmware variants come from
+device_rules.json and are compiled once into alternation regexes. The firmware
+directory is indexed by side and variant in a single scan, so lookups do not
+re-glob it on every detection tick.
+"""
+
+import json
+import os
+import re
+import sys
+from pathlib import Path
+
+# Constants
+RULES_PATH = Path(__file__).resolve().parent / 'device_rules.json'
+SIDES = ('left', 'right')
+
+_rules = {}
+_indexes = {}
+
+
+class KeywordMatcher:
+    """Case-insensitive substring search for any of a set of keywords, as one compiled regex"""
+
+    def __init__(self, keywords):
+        self.keywords = tuple(k.lower() for k in keywords)
+        # Longest first, so 'root hub' is reported rather than 'hub'
+        alternatives = sorted(set(self.keywords), key=len, reverse=True)
+        self.regex = re.compile('|'.join(map(re.escape, alternatives))) if alternatives else None
+
+    def __iter__(self):
+        return iter(self.keywords)
+
+    def __len__(self):
+        return len(self.keywords)
+
+    def search(self, *texts):
+        """The first keyword found in any of texts, or None"""
+        if self.regex is None:
+            return None
+        # One lower-cased search over all the texts beats a case-insensitive pattern per text
+        match = self.regex.search('\n'.join(filter(None, texts)).lower())
+        return match.group(0) if match else None
+
+    def findall(self, text):
+        return set(self.regex.findall(text.lower())) if self.regex is not None and text else set()
+
+
+def as_matcher(keywords):
+    """A KeywordMatcher for keywords (a matcher or any iterable of strings)"""
+    return keywords if isinstance(keywords, KeywordMatcher) else KeywordMatcher(keywords)
+
+
+class Rules:
+    """The compiled contents of a rules file"""
+
+    def __init__(self, data):
+        self.bootloader = KeywordMatcher(data.get('bootloader_keywords', []))
+        self.ignore = KeywordMatcher(data.get('ignore_keywords', []))
+        self.variants = tuple(v.lower() for v in data.get('variants', []))
+        self.variant_matcher = KeywordMatcher(self.variants)
+        self.keyboards = {name.lower(): KeywordMatcher(aliases or [name])
+                          for name, aliases in data.get('keyboards', {}).items()}
+        self.firmware_board = data.get('firmware_board', '')
+
+    def variant(self, device_name):
+        """The firmware variant named in a device name, or None for the base firmware"""
+        found = self.variant_matcher.findall(device_name)
+        # Rule order decides when a name contains more than one variant
+        return next((v for v in self.variants if v in found), None)
+
+    def keyboard_aliases(self, target):
+        """Aliases of the keyboard a name refers to ('crkbd' for 'corne'), or None if unknown"""
+        target = target.lower()
+        for name, aliases in self.keyboards.items():
+            if target in name or aliases.search(target):
+                return aliases
+        return None
+
+
+def load_rules(path=RULES_PATH):
+    """Rules from a JSON file, compiled once per process (empty rules if the file is unreadable)"""
+    path = Path(path)
+    rules = _rules.get(path)
+    if rules is None:
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Could not read {path}: {e}", file=sys.stderr)
+            data = {}
+        rules = _rules[path] = Rules(data)
+    return rules
+
+
+class FirmwareIndex:
+    """
+    UF2 images in a firmware directory keyed by (side, variant), newest first,
+    from one directory scan. Names follow the build artifacts:
+    <board>_<side>[_<variant>]-<shield>.uf2.
+    """
+
+    def __init__(self, firmware_dir, board=None):
+        self.firmware_dir = Path(firmware_dir)
+        board = board if board is not None else load_rules().firmware_board
+        self.pattern = re.compile(rf"^{re.escape(board)}_({'|'.join(SIDES)})(?:_([A-Za-z0-9]+))?-.*\.uf2$")
+        self.stamp = None
+        self.images = {}
+
+    def _stamp(self):
+        try:
+            stat = self.firmware_dir.stat()
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_ino
+
+    def refresh(self):
+        """Rescan if files were added, removed or renamed since the last scan"""
+        stamp = self._stamp()
+        if stamp == self.stamp and stamp is not None:
+            return self
+        images = {}
+        try:
+            entries = list(os.scandir(self.firmware_dir))
+        except OSError:
+            entries = []
+        for entry in entries:
+            match = self.pattern.match(entry.name)
+            if not match:
+                continue
+            try:
+                ctime = entry.stat().st_ctime
+            except OSError:
+                continue
+            key = (match.group(1), match.group(2).lower() if match.group(2) else None)
+            images.setdefault(key, []).append((ctime, entry.path))
+        self.images = {key: [path for _, path in sorted(found, reverse=True)] for key, found in images.items()}
+        self.stamp = stamp
+        return self
+
+    def find(self, side, variant=None):
+        """The newest image for a side and variant, falling back to the base firmware; None if missing"""
+        sides = [side] if side in SIDES else list(SIDES)
+        keys = ([(s, variant) for s in sides] if variant else []) + [(s, None) for s in sides]
+        for key in keys:
+            if key in self.images:
+                return self.images[key][0]
+        return None
+
+
+def firmware_index(firmware_dir):
+    """The shared, up-to-date FirmwareIndex for a directory"""
+    key = os.path.abspath(firmware_dir)
+    index = _indexes.get(key)
+    if index is None:
+        index = _indexes[key] = FirmwareIndex(key)
+    return index.refresh()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Show how the device rules classify names and firmware')
+    parser.add_argument('names', nargs='*', help='Device, USB vendor/product or keyboard names to classify')
+    parser.add_argument('--firmware-dir', '-f', default=str(RULES_PATH.parent.parent / 'firmware'),
+                        help='Firmware directory to index')
+    args = parser.parse_args()
+
+    rules = load_rules()
+    for name in args.names:
+        aliases = rules.keyboard_aliases(name)
+        print(f"{name}: variant {rules.variant(name) or 'base'}, "
+              f"bootloader keyword {rules.bootloader.search(name) or '-'}, "
+              f"ignored keyword {rules.ignore.search(name) or '-'}, "
+              f"keyboard aliases {', '.join(aliases) if aliases else '-'}")
+
+    index = firmware_index(args.firmware_dir)
+    print(f"\n{args.firmware_dir}: {sum(len(paths) for paths in index.images.values())} image(s)")
+    for (side, variant), paths in sorted(index.images.items(), key=lambda item: (item[0][0], item[0][1] or '')):
+        print(f"   {side:<5} {variant or 'base':<10} {os.path.basename(paths[0])}"
+              + (f" (+{len(paths) - 1} older)" if len(paths) > 1 else ''))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,84 +3,48 @@
 import os
 import sys
 import argparse
-import subprocess
-import tempfile
 import time
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.insert(0, str(Path(__file__).parent))
+import aio
+from block_devices import list_block_devices
+from fat import read_bootloader_info
+from matcher import load_rules
+from uf2 import board_target, family_name, read_info
+from usb_watch import BootloaderWatcher
+from tracing import add_profile_argument, setup_profile
 
 # Constants
 MAX_DEVICE_SIZE_MB = 64  # Maximum size for ZMK bootloader devices
 REQUIRED_FILES = ['CURRENT.UF2', 'INFO_UF2.TXT']
-INFO_FILE_FIELDS = ['UF2 Bootloader', 'Model:', 'Board-ID:', 'Date:']
-MOUNT_OPTIONS = ['rw', 'uid=1000', 'gid=1000']
+INFO_FILE_FIELDS = ['UF2 Bootloader', 'Model', 'Board-ID', 'Date']
 DEFAULT_WAIT_SECONDS = 5
-DEVICE_CHECK_INTERVAL = 0.5  # How often to check for new devices
-MAX_PARALLEL_MOUNTS = 8  # Maximum concurrent mount attempts
-
-def run_command(cmd, check=True):
-   """Execute shell command and return output"""
-   result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-   if check and result.returncode != 0:
-       raise subprocess.CalledProcessError(result.returncode, cmd, result.stderr)
-   return result.stdout.strip(), result.stderr.strip(), result.returncode
+DEVICE_CHECK_INTERVAL = 2.0  # Fallback rescan interval; new disks wake the scan immediately
 
 def get_block_devices():
-   """Get list of block devices with their sizes"""
-   devices = []
-   stdout, _, _ = run_command("lsblk -b -n -o NAME,SIZE,TYPE | grep disk")
-   
-   for line in stdout.splitlines():
-       parts = line.split()
-       if len(parts) >= 3:
-           name = f"/dev/{parts[0]}"
-           size_bytes = int(parts[1])
-           size_mb = size_bytes / (1024 * 1024)
-           if size_mb <= MAX_DEVICE_SIZE_MB:
-               devices.append((name, size_mb))
-   
-   return devices
-
-def is_mounted(device):
-   """Check if device is already mounted"""
-   stdout, _, _ = run_command(f"mount | grep '^{device}'", check=False)
-   return bool(stdout)
+   """Get the disks small enough to be a bootloader, with their sizes and mount state"""
+   return [disk for disk in list_block_devices()
+           if 0 < disk.size_mb <= MAX_DEVICE_SIZE_MB]
 
 def mount_device(device, mount_point):
    """Mount device to specified mount point"""
-   mount_opts = ','.join(MOUNT_OPTIONS)
-   cmd = f"sudo mount -o {mount_opts} {device} {mount_point}"
-   _, stderr, returncode = run_command(cmd, check=False)
-   return returncode == 0, stderr
-
-def unmount_device(mount_point):
-   """Unmount device at mount point"""
-   cmd = f"sudo umount {mount_point}"
-   _, stderr, returncode = run_command(cmd, check=False)
-   return returncode == 0, stderr
+   return aio.call(aio.mount(device, mount_point))
 
-def extract_keyboard_info(mount_point):
+def extract_keyboard_info(mount_point, info=None):
    """Extract keyboard information from INFO_UF2.TXT"""
-   info_path = Path(mount_point) / 'INFO_UF2.TXT'
+   if info is None:
+       info = read_info(mount_point)
    keyboard_info = {}
-   
-   try:
-       with open(info_path, 'r') as f:
-           content = f.read()
-           
-       # Extract model information
-       for line in content.splitlines():
-           line = line.strip()
-           if line.startswith('Model:'):
-               keyboard_info['model'] = line.split(':', 1)[1].strip()
-           elif line.startswith('Board-ID:'):
-               keyboard_info['board_id'] = line.split(':', 1)[1].strip()
-           elif 'UF2 Bootloader' in line:
-               keyboard_info['bootloader'] = True
-               
-   except Exception:
-       pass
-   
+   if 'Model' in info:
+       keyboard_info['model'] = info['Model']
+   if 'Board-ID' in info:
+       keyboard_info['board_id'] = info['Board-ID']
+   if 'UF2 Bootloader' in info:
+       keyboard_info['bootloader'] = True
+   target = board_target(info)
+   if target:
+       keyboard_info['family'] = ', '.join(family_name(f) for f in target.family_ids)
    return keyboard_info
 
 def check_zmk_criteria(mount_point, verbose=False):
@@ -95,73 +59,67 @@ def check_zmk_criteria(mount_point, verbose=False):
                print(f"Missing required file: {filename}")
            return False, {}
    
-   # Check INFO_UF2.TXT content and extract keyboard info
-   info_path = mount_path / 'INFO_UF2.TXT'
-   try:
-       with open(info_path, 'r') as f:
-           content = f.read()
-           
-       found_fields = sum(1 for field in INFO_FILE_FIELDS if field in content)
-       if found_fields < len(INFO_FILE_FIELDS) - 1:  # Allow one missing field
-           if verbose:
-               print(f"INFO_UF2.TXT missing expected fields (found {found_fields}/{len(INFO_FILE_FIELDS)})")
-           return False, {}
-           
-       keyboard_info = extract_keyboard_info(mount_point)
-       return True, keyboard_info
-           
-   except Exception as e:
+   # Check INFO_UF2.TXT fields and extract keyboard info
+   return check_info_fields(read_info(mount_point), verbose)
+
+def check_info_fields(info, verbose=False):
+   """Check parsed INFO_UF2.TXT fields against the ZMK bootloader criteria and return keyboard info"""
+   if not info:
        if verbose:
-           print(f"Error reading INFO_UF2.TXT: {e}")
+           print("Error reading INFO_UF2.TXT")
        return False, {}
 
-def check_device_zmk(device, size_mb, verbose=False):
-   """Check if a device is a ZMK bootloader device and return keyboard info"""
+   found_fields = sum(1 for field in INFO_FILE_FIELDS if field in info)
+   if found_fields < len(INFO_FILE_FIELDS) - 1:  # Allow one missing field
+       if verbose:
+           print(f"INFO_UF2.TXT missing expected fields (found {found_fields}/{len(INFO_FILE_FIELDS)})")
+       return False, {}
+   if verbose and 'Board-ID' in info and board_target(info) is None:
+       print(f"Unknown Board-ID {info['Board-ID']}: firmware family cannot be checked before flashing")
+
+   return True, extract_keyboard_info(None, info)
+
+async def check_device_zmk(disk, verbose=False):
+   """Check if a disk is a ZMK bootloader device and return keyboard info"""
+   device = disk.path
    if verbose:
-       print(f"\nChecking device: {device} ({size_mb:.1f} MB)")
+       print(f"\nChecking device: {device} ({disk.size_mb:.1f} MB)")
    
-   # Skip if already mounted
-   if is_mounted(device):
+   # Skip if already mounted (the disk or one of its partitions, from the inventory's mount table)
+   if disk.is_mounted:
        if verbose:
            print(f"Device already mounted")
        return False, None, {}
    
-   # Create temporary mount point
-   temp_mount = tempfile.mkdtemp(prefix="zmk_", dir="/tmp")
-   
-   try:
-       # Try to mount device
-       success, error = mount_device(device, temp_mount)
-       if not success:
-           if verbose:
-               print(f"Failed to mount: {error}")
-           os.rmdir(temp_mount)
-           return False, None, {}
-       
-       is_zmk, keyboard_info = check_zmk_criteria(temp_mount, verbose)
-       
-       # Always unmount temp mount
-       unmount_device(temp_mount)
-       os.rmdir(temp_mount)
-       
+   # Read INFO_UF2.TXT straight from the FAT volume; mount only if the device cannot be read
+   info = await aio.to_thread(read_bootloader_info, device)
+   if info is not None:
+       is_zmk, keyboard_info = check_info_fields(info, verbose)
        if is_zmk and verbose:
            model = keyboard_info.get('model', 'Unknown')
            board_id = keyboard_info.get('board_id', 'Unknown')
-           print(f"ZMK bootloader device detected: {model} (Board: {board_id})")
+           print(f"ZMK bootloader device detected without mounting: {model} (Board: {board_id})")
        elif verbose:
-           print(f"Not a ZMK bootloader device")
-           
+           print("Not a ZMK bootloader device")
        return is_zmk, device, keyboard_info
+
+   # Temporary mount, always unmounted and removed (also when a faster probe wins)
+   async with aio.temp_mount(device) as temp_mount:
+       if temp_mount is None:
+           if verbose:
+               print(f"Failed to mount {device}")
+           return False, None, {}
        
-   except Exception as e:
-       if verbose:
-           print(f"Error processing device: {e}")
-       try:
-           unmount_device(temp_mount)
-           os.rmdir(temp_mount)
-       except:
-           pass
-       return False, None, {}
+       is_zmk, keyboard_info = await aio.to_thread(check_zmk_criteria, temp_mount, verbose)
+   
+   if is_zmk and verbose:
+       model = keyboard_info.get('model', 'Unknown')
+       board_id = keyboard_info.get('board_id', 'Unknown')
+       print(f"ZMK bootloader device detected: {model} (Board: {board_id})")
+   elif verbose:
+       print(f"Not a ZMK bootloader device")
+       
+   return is_zmk, device, keyboard_info
 
 def mount_zmk_device(device, mount_location, verbose=False):
    """Mount a confirmed ZMK device to final location"""
@@ -195,70 +153,61 @@ def match_keyboard_name(keyboard_info, target_name):
    if target_lower in board_id:
        return True
        
-   # Check for common keyboard name patterns
-   keyboard_patterns = {
-       'sofle': ['sofle'],
-       'corne': ['corne', 'crkbd'],
-       'glove80': ['glove80', 'glove'],
-       'planck': ['planck'],
-       'zen': ['zen', 'corneish']
-   }
-   
-   for pattern_name, patterns in keyboard_patterns.items():
-       if target_lower in pattern_name or any(p in target_lower for p in patterns):
-           return any(p in model or p in board_id for p in patterns)
-           
+   # Keyboard aliases from device_rules.json (e.g. corne -> crkbd)
+   aliases = load_rules().keyboard_aliases(target_name)
+   if aliases is not None:
+       return aliases.search(model, board_id) is not None
+          
    return False
 
+async def find_zmk_device(devices, verbose, keyboard_name):
+   """Probe devices concurrently; the first ZMK device matching the name wins and the other probes are cancelled"""
+   async def probe(disk):
+       try:
+           return await check_device_zmk(disk, verbose)
+       except Exception as e:
+           if verbose:
+               print(f"Error checking {disk.path}: {e}")
+           return False, None, {}
+   
+   def accept(result):
+       is_zmk, _, keyboard_info = result
+       return is_zmk and match_keyboard_name(keyboard_info, keyboard_name)
+   
+   return await aio.first_match([probe(disk) for disk in devices], accept)
+
 def scan_and_mount(mount_location, no_mount, verbose, wait_seconds, keyboard_name=None):
    """Scan for devices and mount ZMK device matching keyboard name"""
    start_time = time.time()
    checked_devices = set()
    
-   while True:
-       # Get current devices
-       current_devices = get_block_devices()
-       new_devices = [(dev, size) for dev, size in current_devices if dev not in checked_devices]
+   with BootloaderWatcher() as watcher:
+       while True:
+           # Get current devices
+           current_devices = get_block_devices()
+           new_devices = [disk for disk in current_devices if disk.path not in checked_devices]
        
-       if new_devices:
-           if verbose and len(new_devices) > 0:
-               print(f"\nScanning {len(new_devices)} new device(s)...")
+           if new_devices:
+               if verbose and len(new_devices) > 0:
+                   print(f"\nScanning {len(new_devices)} new device(s)...")
+               checked_devices.update(disk.path for disk in new_devices)
            
-           # Check devices in parallel
-           with ThreadPoolExecutor(max_workers=min(len(new_devices), MAX_PARALLEL_MOUNTS)) as executor:
-               futures = {
-                   executor.submit(check_device_zmk, device, size_mb, verbose): (device, size_mb)
-                   for device, size_mb in new_devices
-               }
-               
-               for future in as_completed(futures):
-                   device, size_mb = futures[future]
-                   checked_devices.add(device)
-                   
-                   try:
-                       is_zmk, found_device, keyboard_info = future.result()
-                       if is_zmk and match_keyboard_name(keyboard_info, keyboard_name):
-                           # Cancel remaining futures
-                           for f in futures:
-                               if f != future and not f.done():
-                                   f.cancel()
-                           
-                           if no_mount:
-                               return found_device, keyboard_info
-                           else:
-                               mount_path = mount_zmk_device(found_device, mount_location, verbose)
-                               return mount_path, keyboard_info
-                   except Exception as e:
-                       if verbose:
-                           print(f"Error checking {device}: {e}")
+               found = aio.call(find_zmk_device(new_devices, verbose, keyboard_name))
+               if found:
+                   _, found_device, keyboard_info = found
+                   if no_mount:
+                       return found_device, keyboard_info
+                   else:
+                       mount_path = mount_zmk_device(found_device, mount_location, verbose)
+                       return mount_path, keyboard_info
        
-       # Check if we should continue waiting
-       elapsed = time.time() - start_time
-       if elapsed >= wait_seconds:
-           break
+           # Check if we should continue waiting
+           elapsed = time.time() - start_time
+           if elapsed >= wait_seconds:
+               break
            
-       # Wait before next check
-       time.sleep(DEVICE_CHECK_INTERVAL)
+           # Wait until a new bootloader disk shows up
+           watcher.wait_for_devices(min(wait_seconds - elapsed, DEVICE_CHECK_INTERVAL))
    
    return None, {}
 
@@ -272,7 +221,9 @@ def main():
                       help=f'Seconds to wait for device (default: {DEFAULT_WAIT_SECONDS})')
    parser.add_argument('--no-wait', action='store_true', help='Do not wait for devices')
    
+   add_profile_argument(parser)
    args = parser.parse_args()
+   setup_profile(args)
    
    # Determine wait time
    wait_seconds = 0 if args.no_wait else args.wait
@@ -0,0 +1,522 @@
+#!/usr/bin/env python3
+"""
+Snapshot test runner for ZMK native_posix tests
+Discovers test cases (directories with events.patterns and
+keycode_events.snapshot), builds one native_posix_64 binary per distinct
+set of build inputs, runs the simulations in parallel, filters their output
+through events.patterns in-process and diffs it against the snapshot.
+"""
+
+import difflib
+import hashlib
+import json
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+from build_scheduler import REPO_ROOT, default_jobs, run_west_traced
+from tracing import span, tracing_enabled
+
+# Constants
+BOARD = 'native_posix_64'
+BUILD_ROOT = REPO_ROOT / '.build' / 'tests'
+STATE_PATH = BUILD_ROOT / 'state.json'
+PATTERNS_FILE = 'events.patterns'
+SNAPSHOT_FILE = 'keycode_events.snapshot'
+BUILD_SUFFIXES = ('.keymap', '.conf', '.overlay', '.dtsi', '.h')
+RUN_TIMEOUT = 120  # Seconds a zmk.exe simulation may take
+PREFIX_RE = re.compile(r'.*> ')  # Same as sed -e "s/.*> //"
+
+TestCase = namedtuple('TestCase', 'name path')
+TestResult = namedtuple('TestResult', 'case status build_key build_seconds run_seconds message')
+
+
+# ---------------------------------------------------------------------------
+# events.patterns: the subset of sed used by ZMK tests
+
+def bre_to_python(pattern):
+    """Translate a (GNU) sed basic regular expression into Python syntax"""
+    out = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\' and i + 1 < len(pattern):
+            n = pattern[i + 1]
+            if n in '(){}+?|':
+                out.append(n)
+            elif n == 'n':
+                out.append('\\n')
+            else:
+                out.append('\\' + n)
+            i += 2
+            continue
+        if c in '(){}+?|':
+            out.append('\\' + c)
+        else:
+            out.append(c)
+        i += 1
+    return ''.join(out)
+
+
+def _replacement(text):
+    """sed replacement (\\1, &) -> a function for re.sub"""
+    parts = []
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c == '\\' and i + 1 < len(text):
+            n = text[i + 1]
+            parts.append(('group', int(n)) if n.isdigit() else ('text', '\n' if n == 'n' else n))
+            i += 2
+        elif c == '&':
+            parts.append(('group', 0))
+            i += 1
+        else:
+            parts.append(('text', c))
+            i += 1
+
+    def expand(match):
+        return ''.join(match.group(v) or '' if kind == 'group' else v for kind, v in parts)
+    return expand
+
+
+class SedScript:
+    """
+    Compiled `sed -n` script supporting [/addr/]s/re/repl/[gp], [/addr/]p and
+    [/addr/]d, which covers the events.patterns files ZMK tests use.
+    Raises ValueError for anything else (the runner then falls back to sed).
+    """
+
+    def __init__(self, text):
+        self.commands = []
+        for raw in text.splitlines():
+            line = raw.strip()
+            if not line or line.startswith('#'):
+                continue
+            for command in self._split_commands(line):
+                self.commands.append(self._compile(command))
+
+    @staticmethod
+    def _split_commands(line):
+        """Split on ; outside of s/// fields"""
+        commands = []
+        current = []
+        fields_left = 0
+        delimiter = None
+        i = 0
+        while i < len(line):
+            c = line[i]
+            if fields_left and c == '\\' and i + 1 < len(line):
+                current.append(line[i:i + 2])
+                i += 2
+                continue
+            if fields_left and c == delimiter:
+                fields_left -= 1
+            elif not fields_left and c == '/':
+                delimiter, fields_left = '/', 1
+            elif not fields_left and c == 's' and i + 1 < len(line) and not line[i + 1].isalnum():
+                delimiter, fields_left = line[i + 1], 2
+                current.append(c + line[i + 1])
+                i += 2
+                continue
+            elif not fields_left and c == ';':
+                commands.append(''.join(current).strip())
+                current = []
+                i += 1
+                continue
+            current.append(c)
+            i += 1
+        if ''.join(current).strip():
+            commands.append(''.join(current).strip())
+        return [c for c in commands if c]
+
+    def _compile(self, command):
+        address = None
+        if command.startswith('/'):
+            end = 1
+            while end < len(command):
+                if command[end] == '\\':
+                    end += 2
+                    continue
+                if command[end] == '/':
+                    break
+                end += 1
+            address = re.compile(bre_to_python(command[1:end]))
+            command = command[end + 1:].lstrip()
+        if command in ('p', 'd'):
+            return (address, command, None, None, None)
+        if command.startswith('s') and len(command) > 1:
+            delimiter = command[1]
+            fields = []
+            current = []
+            i = 2
+            while i < len(command) and len(fields) < 2:
+                c = command[i]
+                if c == '\\' and i + 1 < len(command):
+                    current.append(delimiter if command[i + 1] == delimiter else command[i:i + 2])
+                    i += 2
+                    continue
+                if c == delimiter:
+                    fields.append(''.join(current))
+                    current = []
+                else:
+                    current.append(c)
+                i += 1
+            flags = command[i:].strip()
+            if len(fields) != 2 or set(flags) - set('gp'):
+                raise ValueError(f"Unsupported sed command: {command!r}")
+            return (address, 's', re.compile(bre_to_python(fields[0])), _replacement(fields[1]), flags)
+        raise ValueError(f"Unsupported sed command: {command!r}")
+
+    def run(self, lines):
+        """Apply the script to lines (as sed -n does) and return the printed lines"""
+        out = []
+        for line in lines:
+            space = line
+            for address, kind, regex, replacement, flags in self.commands:
+                if address is not None and not address.search(space):
+                    continue
+                if kind == 'p':
+                    out.append(space)
+                elif kind == 'd':
+                    break
+                else:
+                    space, count = regex.subn(replacement, space, count=0 if 'g' in flags else 1)
+                    if count and 'p' in flags:
+                        out.append(space)
+        return out
+
+
+# ---------------------------------------------------------------------------
+# Discovery and build grouping
+
+def discover(paths):
+    """Test cases below the given paths, sorted by name"""
+    cases = []
+    for path in paths:
+        path = Path(path).resolve()
+        candidates = [path] if (path / PATTERNS_FILE).exists() else \
+            sorted(p.parent for p in path.rglob(PATTERNS_FILE))
+        for directory in candidates:
+            name = os.path.relpath(directory, REPO_ROOT) if directory.is_relative_to(REPO_ROOT) else str(directory)
+            cases.append(TestCase(name, directory))
+    return sorted(set(cases), key=lambda c: c.name)
+
+
+def _digest_files(paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(path.name.encode() + b'\0')
+        digest.update(path.read_bytes() + b'\0')
+    return digest.hexdigest()
+
+
+class BuildInputs:
+    """Content hashes of everything that shapes a test's zmk.exe"""
+
+    def __init__(self, west_args=()):
+        self.west_args = list(west_args)
+        self._models = None
+        self._revisions = None
+
+    def revisions(self):
+        if self._revisions is None:
+            try:
+                from build_cache import manifest_revisions
+                self._revisions = manifest_revisions(REPO_ROOT)
+            except ImportError:
+                self._revisions = {}
+        return self._revisions
+
+    def files(self, case):
+        """The test's config files plus everything its keymap includes locally"""
+        files = {p.resolve() for p in case.path.iterdir() if p.is_file() and p.suffix in BUILD_SUFFIXES}
+        keymap = case.path / f"{BOARD}.keymap"
+        if keymap.exists():
+            if self._models is None:
+                from keymap_model import ModelCache
+                self._models = ModelCache()
+            model = self._models.model(keymap, [case.path, REPO_ROOT / 'config'])
+            files |= {Path(p) for p in model.dependencies}
+        return sorted(files)
+
+    def key(self, case):
+        """Same key <=> same binary: file contents (not paths), ZMK revisions and west arguments"""
+        contents = sorted(hashlib.sha256(p.read_bytes()).hexdigest() + p.suffix for p in self.files(case))
+        payload = {'files': contents, 'revisions': self.revisions(), 'west_args': self.west_args, 'board': BOARD}
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    def save(self):
+        if self._models is not None:
+            self._models.save()
+
+
+def case_key(build_key, case):
+    """Build key plus the files that only affect filtering and comparison"""
+    extra = [case.path / PATTERNS_FILE, case.path / SNAPSHOT_FILE]
+    return hashlib.sha256((build_key + _digest_files([p for p in extra if p.exists()])).encode()).hexdigest()
+
+
+def load_state():
+    try:
+        with open(STATE_PATH, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state):
+    BUILD_ROOT.mkdir(parents=True, exist_ok=True)
+    tmp = STATE_PATH.with_suffix('.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(tmp, STATE_PATH)
+
+
+# ---------------------------------------------------------------------------
+# Building and running
+
+class Builder:
+    """Builds each distinct binary once; concurrent callers for the same key wait for it"""
+
+    def __init__(self, west_args=(), rebuild=True):
+        self.west_args = list(west_args)
+        self.rebuild = rebuild
+        self.locks = {}
+        self.results = {}
+        self.lock = threading.Lock()
+
+    def build_dir(self, key):
+        return BUILD_ROOT / 'builds' / key[:16]
+
+    def executable(self, key):
+        return self.build_dir(key) / 'zephyr' / 'zmk.exe'
+
+    def build(self, key, case):
+        """(exe path or None, seconds spent building, error)"""
+        with self.lock:
+            lock = self.locks.setdefault(key, threading.Lock())
+        with lock:
+            if key in self.results:
+                return self.results[key][0], 0.0, self.results[key][2]
+            start = time.monotonic()
+            exe = self.executable(key)
+            stamp = self.build_dir(key) / 'inputs.sha256'
+            error = None
+            fresh = exe.exists() and stamp.exists() and stamp.read_text().strip() == key
+            if not fresh and not self.rebuild:
+                error = "no build for these inputs (run without --no-build)"
+            elif not fresh:
+                error = self._west_build(key, case)
+                if error is None:
+                    stamp.write_text(key + '\n')
+            seconds = time.monotonic() - start
+            self.results[key] = (None if error else exe, seconds, error)
+            return self.results[key]
+
+    def _west_build(self, key, case):
+        build_dir = self.build_dir(key)
+        shutil.rmtree(build_dir, ignore_errors=True)
+        build_dir.mkdir(parents=True)
+        cmd = ['west', 'build', '-s', 'zmk/app', '-d', str(build_dir), '-b', BOARD] + self.west_args + \
+              ['--', '-DCONFIG_ASSERT=y', f"-DZMK_CONFIG={case.path}"]
+        try:
+            with open(build_dir / 'build.log', 'w') as log:
+                log.write(f"$ {shlex.join(cmd)}\n")
+                log.flush()
+                if tracing_enabled():
+                    returncode = run_west_traced(cmd, REPO_ROOT, log, f"test-{key[:12]}")
+                else:
+                    returncode = subprocess.run(cmd, cwd=REPO_ROOT, stdout=log, stderr=subprocess.STDOUT,
+                                                stdin=subprocess.DEVNULL).returncode
+        except FileNotFoundError:
+            return "'west' command not found"
+        if returncode != 0:
+            return f"west build exited with status {returncode} (see {build_dir / 'build.log'})"
+        return None
+
+
+def filter_events(output, patterns_path):
+    """Strip the log prefix and apply events.patterns, in-process when possible"""
+    lines = [PREFIX_RE.sub('', line, count=1) for line in output.splitlines()]
+    try:
+        script = SedScript(patterns_path.read_text())
+    except ValueError:
+        result = subprocess.run(['sed', '-n', '-f', str(patterns_path)], input='\n'.join(lines) + '\n',
+                                capture_output=True, text=True)
+        return lines, result.stdout.splitlines()
+    return lines, script.run(lines)
+
+
+def run_case(case, build_key, builder, accept=False, verbose=False):
+    exe, build_seconds, error = builder.build(build_key, case)
+    if error:
+        return TestResult(case, 'error', build_key, build_seconds, 0.0, error)
+
+    out_dir = BUILD_ROOT / case.name.replace(os.sep, '__')
+    out_dir.mkdir(parents=True, exist_ok=True)
+    start = time.monotonic()
+    try:
+        with span('test.run', case=case.name):
+            result = subprocess.run([str(exe)], capture_output=True, text=True, errors='replace',
+                                    timeout=RUN_TIMEOUT, stdin=subprocess.DEVNULL)
+    except subprocess.TimeoutExpired:
+        return TestResult(case, 'error', build_key, build_seconds, time.monotonic() - start,
+                          f"zmk.exe did not finish within {RUN_TIMEOUT}s")
+    full, events = filter_events(result.stdout, case.path / PATTERNS_FILE)
+    run_seconds = time.monotonic() - start
+
+    (out_dir / 'keycode_events.full.log').write_text('\n'.join(full) + '\n')
+    log_text = ''.join(line + '\n' for line in events)
+    (out_dir / 'keycode_events.log').write_text(log_text)
+    if verbose:
+        print(f"--- {case.name}\n{log_text}", end='')
+
+    snapshot_path = case.path / SNAPSHOT_FILE
+    if accept:
+        snapshot_path.write_text(log_text)
+    expected = snapshot_path.read_text().splitlines() if snapshot_path.exists() else []
+    # Like diff -Z: trailing whitespace does not count
+    if [l.rstrip() for l in expected] == [l.rstrip() for l in events]:
+        return TestResult(case, 'passed', build_key, build_seconds, run_seconds, '')
+    diff = '\n'.join(difflib.unified_diff(expected, events, str(snapshot_path), 'keycode_events.log', lineterm=''))
+    return TestResult(case, 'failed', build_key, build_seconds, run_seconds, diff)
+
+
+def write_junit(results, path):
+    from xml.sax.saxutils import quoteattr, escape
+
+    failures = sum(1 for r in results if r.status == 'failed')
+    errors = sum(1 for r in results if r.status == 'error')
+    skipped = sum(1 for r in results if r.status == 'skipped')
+    total = sum(r.build_seconds + r.run_seconds for r in results)
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+             f'<testsuite name="zmk" tests="{len(results)}" failures="{failures}" errors="{errors}" '
+             f'skipped="{skipped}" time="{total:.3f}">']
+    for r in results:
+        lines.append(f'  <testcase classname="zmk" name={quoteattr(r.case.name)} '
+                     f'time="{r.build_seconds + r.run_seconds:.3f}">')
+        if r.status == 'failed':
+            lines.append(f'    <failure message="snapshot mismatch">{escape(r.message)}</failure>')
+        elif r.status == 'error':
+            lines.append(f'    <error message={quoteattr(r.message)}/>')
+        elif r.status == 'skipped':
+            lines.append(f'    <skipped message={quoteattr(r.message)}/>')
+        lines.append('  </testcase>')
+    lines.append('</testsuite>')
+    Path(path).write_text('\n'.join(lines) + '\n')
+
+
+def write_json(results, path):
+    report = [{'name': r.case.name, 'status': r.status, 'build_key': r.build_key[:16],
+               'build_seconds': round(r.build_seconds, 3), 'run_seconds': round(r.run_seconds, 3),
+               'message': r.message} for r in results]
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=1)
+
+
+def main():
+    import argparse
+    from tracing import add_profile_argument, setup_profile
+
+    parser = argparse.ArgumentParser(description='Run ZMK snapshot tests with shared native_posix builds',
+                                     epilog='Arguments after -- are passed on to west build')
+    parser.add_argument('paths', nargs='+', help='Test directories, or directories to search for tests')
+    parser.add_argument('--jobs', '-j', type=int, default=default_jobs(),
+                        help=f'Parallel builds and simulations (default: CPU count, {default_jobs()})')
+    parser.add_argument('--changed-only', action='store_true',
+                        help='Skip tests whose inputs are unchanged since they last passed')
+    parser.add_argument('--no-build', action='store_true', help='Only run existing builds')
+    parser.add_argument('--auto-accept', action='store_true', help='Overwrite snapshots with the new output')
+    parser.add_argument('--verbose', '-v', action='store_true', help='Print the filtered events')
+    parser.add_argument('--list', '-l', action='store_true', help='List test cases grouped by build')
+    parser.add_argument('--junit', metavar='PATH', help='Write a JUnit XML report')
+    parser.add_argument('--json', metavar='PATH', help='Write a JSON report')
+    add_profile_argument(parser)
+
+    argv = sys.argv[1:]
+    west_args = []
+    if '--' in argv:
+        split = argv.index('--')
+        argv, west_args = argv[:split], argv[split + 1:]
+    args = parser.parse_args(argv)
+    setup_profile(args)
+
+    cases = discover(args.paths)
+    if not cases:
+        print("❌ No test cases found (directories with events.patterns)")
+        sys.exit(1)
+
+    inputs = BuildInputs(west_args)
+    keys = {case: inputs.key(case) for case in cases}
+    inputs.save()
+    groups = {}
+    for case, key in keys.items():
+        groups.setdefault(key, []).append(case)
+
+    if args.list:
+        for key, members in groups.items():
+            print(f"{key[:16]}: {', '.join(c.name for c in members)}")
+        return
+
+    state = load_state()
+    results = []
+    todo = []
+    for case in cases:
+        if args.changed_only and state.get(case.name) == case_key(keys[case], case):
+            results.append(TestResult(case, 'skipped', keys[case], 0.0, 0.0, 'unchanged since last pass'))
+        else:
+            todo.append(case)
+
+    print(f"🧪 {len(todo)} test(s) in {len({keys[c] for c in todo})} build group(s)"
+          + (f", {len(cases) - len(todo)} unchanged" if len(todo) != len(cases) else ''))
+    builder = Builder(west_args, rebuild=not args.no_build)
+    start = time.monotonic()
+    print_lock = threading.Lock()
+
+    def task(case):
+        result = run_case(case, keys[case], builder, args.auto_accept, args.verbose)
+        with print_lock:
+            icon = {'passed': '✅', 'failed': '❌', 'error': '💥'}[result.status]
+            print(f"{icon} {case.name} ({result.run_seconds:.2f}s"
+                  + (f", build {result.build_seconds:.1f}s" if result.build_seconds else '') + ')')
+            if result.status != 'passed':
+                print(result.message)
+            sys.stdout.flush()
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        results.extend(executor.map(task, todo))
+
+    for r in results:
+        if r.status == 'passed':
+            state[r.case.name] = case_key(r.build_key, r.case)
+        elif r.status != 'skipped':
+            state.pop(r.case.name, None)
+    save_state(state)
+
+    results.sort(key=lambda r: r.case.name)
+    if args.junit:
+        write_junit(results, args.junit)
+    if args.json:
+        write_json(results, args.json)
+
+    counts = {status: sum(1 for r in results if r.status == status)
+              for status in ('passed', 'failed', 'error', 'skipped')}
+    print(f"\n{counts['passed']} passed, {counts['failed']} failed, {counts['error']} errors, "
+          f"{counts['skipped']} skipped in {time.monotonic() - start:.1f}s")
+    if counts['failed'] or counts['error']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
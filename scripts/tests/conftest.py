@@ -0,0 +1,6 @@
+"""Pytest setup for the scripts: make the flat modules in scripts/ importable"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,73 @@
+"""The scan shared by auto-flash and reset-settings: one inventory pass, INFO read without mounting"""
+
+from collections import namedtuple
+
+import pytest
+
+import auto_flash_functions
+from auto_flash_functions import find_devices_to_flash, load_script
+from device_registry import make_device
+from usb_devices import UsbDevice
+
+Disk = namedtuple('Disk', 'name path label usb_serial mount_point')
+
+
+class FakeDisk(Disk):
+    __slots__ = ()
+
+    def could_be_bootloader(self):
+        return self.mount_point is None
+
+
+INFOS = {
+    '/dev/sdb': {'Board-ID': 'nRF52840-nicenano'},
+    '/dev/sdc': {},  # A FAT volume without INFO_UF2.TXT
+}
+
+
+@pytest.fixture
+def scan(monkeypatch):
+    """Two unmounted disks (one a bootloader, one not); records what gets mounted"""
+    mounted = []
+    monkeypatch.setattr(auto_flash_functions, 'find_bootloader_mount_points', lambda: [])
+    monkeypatch.setattr(auto_flash_functions, 'detect_bootloader_devices', lambda: [
+        UsbDevice('001', '005', '239a', '0029', 'Adafruit', 'nRF UF2', 'BOOT0001', '1-1')])
+    monkeypatch.setattr(auto_flash_functions, 'list_block_devices', lambda: [
+        FakeDisk('sdb', '/dev/sdb', 'NICENANO', 'BOOT0001', None),
+        FakeDisk('sdc', '/dev/sdc', 'USBSTICK', 'STICK01', None)])
+    monkeypatch.setattr(auto_flash_functions, 'read_bootloader_info', INFOS.get)
+    monkeypatch.setattr(auto_flash_functions, 'mount_device',
+                        lambda path, mount_point: mounted.append((path, mount_point)) or True)
+    return mounted
+
+
+@pytest.fixture
+def known():
+    device = make_device('BOOT0001', {'name': 'corne', 'type': 'bootloader', 'side': 'left'})
+    return {device.serial: device}
+
+
+def test_only_the_chosen_bootloader_is_mounted(scan, known):
+    flashable = find_devices_to_flash(known, lambda name, side: f"/fw/{name}_{side}.uf2")
+    assert [(item[0], item[1]['name'], item[2], item[3]) for item in flashable] == [
+        ('/tmp/zmk-flash-1', 'corne', '/fw/corne_left.uf2', True)]
+    assert scan == [('/dev/sdb', '/tmp/zmk-flash-1')]
+
+
+def test_seen_volumes_are_not_offered_again(scan, known):
+    found = set()
+    assert find_devices_to_flash(known, lambda name, side: '/fw/a.uf2', found_devices=found)
+    assert find_devices_to_flash(known, lambda name, side: '/fw/a.uf2', found_devices=found) == []
+    assert '/dev/sdb' in found and '/dev/sdc' in found
+
+
+def test_scripts_share_the_scan_with_their_own_firmware(scan, known, tmp_path, monkeypatch):
+    (tmp_path / 'settings_reset-nice_nano_v2-zmk.uf2').write_bytes(b'')
+    reset = load_script('reset-settings').find_flashable_devices_once(known, tmp_path)
+    assert [(item[0], item[2]) for item in reset] == [
+        ('/tmp/zmk-reset-1', str(tmp_path / 'settings_reset-nice_nano_v2-zmk.uf2'))]
+
+    auto_flash = load_script('auto-flash')
+    monkeypatch.setattr(auto_flash, 'find_firmware_file', lambda name, side, firmware_dir: f"{firmware_dir}/{name}.uf2")
+    flashable = auto_flash.find_flashable_devices_once(known, '/fw')
+    assert [(item[0], item[2]) for item in flashable] == [('/tmp/zmk-flash-1', '/fw/corne.uf2')]
@@ -0,0 +1,36 @@
+"""Capacity verdicts: a keymap read with stand-in headers can only say a limit may be undersized"""
+
+import pytest
+
+import combo_capacity
+from combo_capacity import Capacity, report
+from test_keymap_model import add_helpers, make_workspace, model
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    return make_workspace(tmp_path)
+
+
+@pytest.fixture
+def conf(workspace, monkeypatch):
+    """test.conf allows one combo per key, where LT0 is in two"""
+    path = workspace / 'config' / 'test.conf'
+    path.write_text('CONFIG_ZMK_COMBO_MAX_COMBOS_PER_KEY=1\n')
+    monkeypatch.setattr(combo_capacity, 'conf_files_for', lambda name: [path])
+    return path
+
+
+def test_verdict_with_the_module(workspace, conf):
+    add_helpers(workspace)
+    capacity = Capacity(model(workspace))
+    assert capacity.max_combos_per_key == 2
+    assert report(capacity, 0, 0) == (1, 0)
+
+
+def test_verdict_without_the_module_is_approximate(workspace, conf, capsys):
+    capacity = Capacity(model(workspace))
+    assert capacity.max_combos_per_key == 2
+    assert report(capacity, 0, 0) == (0, 1)
+    out = capsys.readouterr().out
+    assert 'Approximate' in out and 'may be undersized: COMBO_MAX_COMBOS_PER_KEY=1 < 2' in out
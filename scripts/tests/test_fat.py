@@ -0,0 +1,161 @@
+"""FAT12/16 reader against generated bootloader volumes: INFO_UF2.TXT, CURRENT.UF2 and broken images"""
+
+import os
+import struct
+
+import pytest
+
+from bench_fixtures import make_fat_image
+from fat import MAX_FILE_SIZE, FatError, FatVolume, read_bootloader_info
+from uf2 import pack_image
+
+INFO = (b"UF2 Bootloader 0.6.0 lib/nrfx (v2.0.0)\r\nModel: nice!nano\r\n"
+        b"Board-ID: nRF52840-nicenano\r\nDate: Jan  1 2024\r\n")
+# 8 MB volumes: 8 sectors per cluster keeps the count under 4085 (FAT12), 1 sector gives FAT16
+LAYOUTS = {12: 8, 16: 1}
+
+
+def bootloader_files(current_size=40 * 1024):
+    current = pack_image(bytes(range(256)) * (current_size // 512), 0x26000, 0xADA52840)
+    return {'INFO_UF2.TXT': INFO, 'INDEX.HTM': b'<html><body>nice!nano</body></html>\r\n', 'CURRENT.UF2': current}
+
+
+@pytest.fixture(params=[(12, False), (12, True), (16, False), (16, True)],
+                ids=['fat12', 'fat12-fragmented', 'fat16', 'fat16-fragmented'])
+def volume(request, tmp_path):
+    fat_type, fragmented = request.param
+    files = bootloader_files()
+    path = make_fat_image(str(tmp_path / 'disk.img'), files, fat_type=fat_type,
+                          sectors_per_cluster=LAYOUTS[fat_type], fragmented=fragmented)
+    return path, fat_type, fragmented, files
+
+
+def test_layout_and_root_directory(volume):
+    path, fat_type, _, files = volume
+    with FatVolume(path) as fat:
+        assert fat.fat_type == fat_type
+        assert fat.label == 'NICENANO'
+        assert [(e.name, e.size) for e in fat.files()] == [(name, len(data)) for name, data in files.items()]
+
+
+def test_info_and_current_lookup(volume):
+    path, _, fragmented, files = volume
+    with FatVolume(path) as fat:
+        assert fat.read_file('INFO_UF2.TXT') == INFO
+        assert fat.read_file('info_uf2.txt') == INFO  # 8.3 names are matched case-insensitively
+        # CURRENT.UF2 spans many clusters; fragmented images make every link of its chain a jump
+        assert fat.read_file('CURRENT.UF2') == files['CURRENT.UF2']
+        assert fat.read_file('CURRENT.UF2', limit=1000) == files['CURRENT.UF2'][:1000]
+        assert fat.read_file('MISSING.TXT') is None
+        chain = [fat.find('CURRENT.UF2').cluster]
+        while len(chain) < 4:
+            chain.append(fat._next_cluster(chain[-1]))
+        assert all((b - a != 1) == fragmented for a, b in zip(chain, chain[1:]))
+    assert read_bootloader_info(path) == {'UF2 Bootloader': '0.6.0 lib/nrfx (v2.0.0)', 'Model': 'nice!nano',
+                                          'Board-ID': 'nRF52840-nicenano', 'Date': 'Jan  1 2024'}
+
+
+@pytest.mark.parametrize('fat_type', [12, 16])
+def test_reads_are_capped(fat_type, tmp_path):
+    files = bootloader_files(current_size=2 * MAX_FILE_SIZE)
+    path = make_fat_image(str(tmp_path / 'disk.img'), files, fat_type=fat_type,
+                          sectors_per_cluster=LAYOUTS[fat_type], fragmented=True)
+    with FatVolume(path) as fat:
+        assert fat.read_file('CURRENT.UF2') == files['CURRENT.UF2'][:MAX_FILE_SIZE]
+
+
+def test_volume_without_info_is_not_a_bootloader(tmp_path):
+    path = make_fat_image(str(tmp_path / 'usb-stick.img'), {'README.TXT': b'hello\r\n'}, label='STICK')
+    assert read_bootloader_info(path) == {}
+
+
+def test_unreadable_volumes(tmp_path):
+    missing = str(tmp_path / 'missing.img')
+    assert read_bootloader_info(missing) is None
+
+    blank = tmp_path / 'blank.img'
+    blank.write_bytes(bytes(4096))
+    assert read_bootloader_info(str(blank)) is None
+    with pytest.raises(FatError, match='signature'):
+        FatVolume(str(blank))
+
+    # A FAT32 boot sector has no 16-bit FAT size or root directory entries
+    path = make_fat_image(str(tmp_path / 'fat32.img'), {'INFO_UF2.TXT': INFO})
+    with open(path, 'r+b') as f:
+        f.seek(17)
+        f.write(struct.pack('<H', 0))
+    with pytest.raises(FatError, match='FAT32'):
+        FatVolume(path)
+
+
+def patch_fat_entry(path, fat_type, cluster, value):
+    """Overwrite one FAT entry in every copy of the FAT"""
+    with FatVolume(path) as fat:
+        starts = [fat.fat_start + n * fat.fat_sectors * fat.bytes_per_sector for n in range(fat.num_fats)]
+    with open(path, 'r+b') as f:
+        for start in starts:
+            if fat_type == 16:
+                f.seek(start + cluster * 2)
+                f.write(struct.pack('<H', value))
+                continue
+            offset = start + cluster * 3 // 2
+            f.seek(offset)
+            current = struct.unpack('<H', f.read(2))[0]
+            current = (current & 0x000F) | (value << 4) if cluster & 1 else (current & 0xF000) | value
+            f.seek(offset)
+            f.write(struct.pack('<H', current))
+
+
+@pytest.mark.parametrize('fat_type', [12, 16])
+@pytest.mark.parametrize('damage', ['free', 'loop'])
+def test_broken_cluster_chain(fat_type, damage, tmp_path):
+    path = make_fat_image(str(tmp_path / 'disk.img'), bootloader_files(), fat_type=fat_type,
+                          sectors_per_cluster=LAYOUTS[fat_type])
+    with FatVolume(path) as fat:
+        first = fat.find('CURRENT.UF2').cluster
+    # Second link of the chain: points at a free cluster, or back at the start
+    patch_fat_entry(path, fat_type, first + 1, 0 if damage == 'free' else first)
+    with FatVolume(path) as fat:
+        assert fat.read_file('INFO_UF2.TXT') == INFO
+        with pytest.raises(FatError, match='broken cluster chain'):
+            fat.read_file('CURRENT.UF2')
+
+
+# Sector counts that give more clusters than the generated FAT has entries for, and a link into that gap
+OVERSIZED = {12: (32000, 3000), 16: (65535, 20000)}
+
+
+@pytest.mark.parametrize('fat_type', [12, 16])
+def test_truncated_fat(fat_type, tmp_path):
+    path = make_fat_image(str(tmp_path / 'disk.img'), bootloader_files(), fat_type=fat_type,
+                          sectors_per_cluster=LAYOUTS[fat_type])
+    total, cluster = OVERSIZED[fat_type]
+    with open(path, 'r+b') as f:
+        f.seek(19)
+        f.write(struct.pack('<H', total))
+    os.truncate(path, total * 512)
+    with FatVolume(path) as fat:
+        assert fat.fat_type == fat_type
+        first = fat.find('CURRENT.UF2').cluster
+    patch_fat_entry(path, fat_type, first, cluster)
+    with FatVolume(path) as fat:
+        with pytest.raises(FatError, match='past the end of the FAT'):
+            fat.read_file('CURRENT.UF2')
+
+
+def test_deleted_and_long_name_entries_are_skipped(tmp_path):
+    path = make_fat_image(str(tmp_path / 'disk.img'), bootloader_files(), fat_type=12, sectors_per_cluster=8)
+    with FatVolume(path) as fat:
+        root = fat.root_start
+        names = [e.name for e in fat.files()]
+    with open(path, 'r+b') as f:
+        # Entry 1 (after the label) is INFO_UF2.TXT: mark it deleted; turn INDEX.HTM into a long-name slot
+        f.seek(root + 32)
+        f.write(b'\xE5')
+        f.seek(root + 2 * 32 + 11)
+        f.write(bytes([0x0F]))
+    with FatVolume(path) as fat:
+        assert [e.name for e in fat.files()] == [n for n in names if n not in ('INFO_UF2.TXT', 'INDEX.HTM')]
+        assert fat.read_file('INFO_UF2.TXT') is None
+    assert read_bootloader_info(path) == {}
+    assert os.path.getsize(path) == 8 * 1024 * 1024
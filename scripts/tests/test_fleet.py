@@ -0,0 +1,148 @@
+"""Fleet pipeline: pairing keyboard and bootloader entries, matching arrivals, and what counts as done"""
+
+import pytest
+
+import fleet
+from device_registry import DeviceRegistry, make_device
+from fleet import (FAILED, FLASHING, PENDING, UNVERIFIED, VERIFIED, FleetPipeline, fleet_device,
+                   select_inventory)
+from flasher import FlashResult
+from usb_watch import BootloaderDisk
+from verify import ENUMERATED, MISSING, Verification
+
+
+def registry(*entries):
+    return DeviceRegistry(make_device(serial, info) for serial, info in entries)
+
+
+def disk(serial, name='sdb'):
+    return BootloaderDisk(name, f"/dev/{name}", 8.0, serial)
+
+
+class Executor:
+    """Runs submitted work at once, so the pipeline can be stepped without threads"""
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+@pytest.fixture
+def corne():
+    return registry(('APP0001', {'name': 'corne', 'type': 'keyboard', 'side': 'left'}),
+                    ('BOOT0001', {'name': 'corne', 'type': 'bootloader', 'side': 'left'}),
+                    ('APP0002', {'name': 'corne', 'type': 'keyboard', 'side': 'right'}),
+                    ('BOOT0002', {'name': 'corne', 'type': 'bootloader', 'side': 'right'}),
+                    ('BOOT0009', {'name': 'corne', 'type': 'bootloader'}),
+                    ('APP0003', {'name': 'sofle', 'type': 'keyboard', 'side': 'left'}),
+                    ('BOOT0003', {'name': 'sofle', 'type': 'bootloader'}),
+                    ('CTRL0003', {'name': 'sofle', 'type': 'controller'}))
+
+
+def pipeline(entries, results, verifications=(), **kwargs):
+    """A pipeline whose flashes and verifications return the given results in turn"""
+    results, verifications = list(results), list(verifications)
+
+    def verify(entry, timeout):
+        return verifications.pop(0)
+
+    kwargs.setdefault('read_info', lambda path: None)
+    p = FleetPipeline(entries, watcher=None, mount=lambda disk: ('/mnt', False), unmount=None,
+                      verify=verify if verifications else None, log=lambda message: None, **kwargs)
+    p.start = 0.0
+    fleet.flash_one = lambda *args, **kw: results.pop(0)
+    return p
+
+
+@pytest.fixture(autouse=True)
+def restore_flash_one():
+    original = fleet.flash_one
+    yield
+    fleet.flash_one = original
+
+
+def flashed(rebooted=True):
+    return FlashResult('corne', True, 4096, 0.1, 0.2, rebooted, None)
+
+
+def test_inventory_pairs_keyboard_and_bootloader_entries(corne):
+    items = {(item.name, item.side): item for item in select_inventory(corne)}
+    assert set(items) == {('corne', 'left'), ('corne', 'right'), ('corne', None), ('sofle', 'left')}
+    left = items['corne', 'left']
+    assert left.device.serial == 'APP0001'
+    assert {e.serial for e in left.entries} == {'APP0001', 'BOOT0001'}
+    assert {e.serial for e in items['corne', 'right'].entries} == {'APP0002', 'BOOT0002'}
+    # Without a side, a bootloader pairs only when its name has a single sided board
+    assert {e.serial for e in items['sofle', 'left'].entries} == {'APP0003', 'BOOT0003'}
+    assert items['sofle', 'left'].device.serial == 'APP0003'
+    assert [e.serial for e in items['corne', None].entries] == ['BOOT0009']
+    assert items['corne', None].device.type == 'bootloader'
+
+
+def test_arrivals_match_on_bootloader_serial_and_registry_name(corne):
+    entries = [fleet_device(item, 'fw.uf2') for item in select_inventory(corne)]
+    p = pipeline(entries, [], registry=corne)
+    by_name = {(e.name, e.device.side): e for e in entries}
+    assert p.match(disk('BOOT0001'))[0] is by_name['corne', 'left']
+    assert p.match(disk('BOOT0002'))[0] is by_name['corne', 'right']
+    assert p.match(disk('BOOT0003'))[0] is by_name['sofle', 'left']
+    # A "controller" entry is outside the inventory's types but names a board that is in it
+    assert p.match(disk('CTRL0003'))[0] is by_name['sofle', 'left']
+    assert not by_name['corne', None].verifiable
+    entry, reason = p.match(disk('UNKNOWN'))
+    assert entry is None and 'Board-ID cannot be read' in reason
+    assert p.unreachable() == []
+
+
+def test_unregistered_bootloader_matches_a_unique_board_id():
+    board = registry(('APP1', {'name': 'a', 'type': 'keyboard', 'side': 'left', 'board_id': 'nRF52840-nicenano'}),
+                     ('APP2', {'name': 'b', 'type': 'keyboard', 'side': 'left', 'board_id': 'nRF52840-nicenano'}),
+                     ('APP3', {'name': 'c', 'type': 'keyboard', 'side': 'left', 'board_id': 'nRF52840-other'}))
+    entries = [fleet_device(item, 'fw.uf2') for item in select_inventory(board)]
+    info = {'Board-ID': 'nRF52840-other'}
+    p = pipeline(entries, [], read_info=lambda path: info)
+    assert p.match(disk('NEW'))[0].name == 'c'
+    info['Board-ID'] = 'nRF52840-nicenano'
+    entry, reason = p.match(disk('NEW'))
+    assert entry is None and 'a, b' in reason
+    entries[0].finished = True
+    assert p.match(disk('NEW'))[0].name == 'b'
+
+
+def test_entries_sharing_every_serial_fail_up_front():
+    device = make_device('SAME', {'name': 'a', 'type': 'keyboard', 'side': 'left'})
+    entries = [fleet.FleetDevice(device, 'fw.uf2'), fleet.FleetDevice(device._replace(name='b'), 'fw.uf2')]
+    p = pipeline(entries, [])
+    assert p.unreachable() == entries
+
+
+def test_flash_without_reset_is_retried_not_done(corne):
+    entry = fleet_device(select_inventory(corne)[0], 'fw.uf2')
+    p = pipeline([entry], [flashed(rebooted=False), flashed()])
+    p.arrive(disk('BOOT0001'), Executor())
+    assert entry.state == PENDING and not entry.finished
+    assert 'did not reset' in entry.error
+    assert [d.serial for d in p.retry_disks] == ['BOOT0001']
+    p.arrive(disk('BOOT0001'), Executor())
+    assert entry.finished and entry.attempts == 2
+
+
+def test_missing_after_reset_stays_pending_until_it_verifies(corne):
+    entry = fleet_device(select_inventory(corne)[0], 'fw.uf2')
+    missing = Verification('corne', 'APP0001', MISSING, 5.0, None, ['did not re-enumerate'])
+    found = Verification('corne', 'APP0001', ENUMERATED, 0.5, None, [])
+    p = pipeline([entry], [flashed(), flashed()], [missing, found])
+    p.arrive(disk('BOOT0001'), Executor())
+    assert entry.state == UNVERIFIED and not entry.finished and entry.done is None
+    assert p.pending() == [entry]
+    # Back in bootloader mode: flashed again, and this time it comes back
+    p.arrive(disk('BOOT0001'), Executor())
+    assert entry.state == VERIFIED and entry.finished and entry.attempts == 2
+    assert fleet.print_report([entry], 1.0) == 1
+
+
+def test_flash_in_progress_is_not_started_twice(corne):
+    entry = fleet_device(select_inventory(corne)[0], 'fw.uf2')
+    p = pipeline([entry], [])
+    entry.state = FLASHING
+    p.arrive(disk('BOOT0001'), Executor())
+    assert entry.attempts == 0 and entry.state != FAILED
@@ -0,0 +1,91 @@
+"""Keymap model: module headers come from the west workspace, and a model built without them is approximate"""
+
+import pytest
+
+from keymap_model import ModelCache, default_include_dirs
+
+WEST_YML = """\
+manifest:
+  projects:
+    - name: zmk
+    - name: zmk-helpers
+      path: modules/zmk/helpers
+  self:
+    path: config
+"""
+
+KEYMAP = """\
+#include "zmk-helpers/helper.h"
+#include "zmk-helpers/key-labels/test4.h"
+
+ZMK_COMBO(esc, &kp ESC, LT1 LT0, 0)
+ZMK_COMBO(tab, &kp TAB, LT0 RT0 RT1, 0)
+ZMK_LAYER(base, &kp A &kp B &kp C &kp D)
+"""
+
+# A cut-down zmk-helpers checkout: the real macros take the same arguments as the stand-in
+HELPER_H = """\
+#define ZMK_COMBO(name, combo_bindings, keypos, combo_layers, ...) / { combos { compatible = "zmk,combos"; \\
+    combo_ ## name { bindings = <combo_bindings>; key-positions = <keypos>; layers = <combo_layers>; }; }; };
+#define ZMK_LAYER(name, layout) / { keymap { compatible = "zmk,keymap"; \\
+    layer_ ## name { display-name = #name; bindings = <layout>; }; }; };
+"""
+
+LABELS_H = """\
+#define LT1 0
+#define LT0 1
+#define RT0 2
+#define RT1 3
+"""
+
+
+def make_workspace(root):
+    """A west workspace with config/test.keymap and a checked-out zmk, but no modules"""
+    (root / 'config').mkdir()
+    (root / 'config' / 'west.yml').write_text(WEST_YML)
+    (root / 'config' / 'test.keymap').write_text(KEYMAP)
+    (root / 'zmk' / 'app' / 'include').mkdir(parents=True)
+    return root
+
+
+def add_helpers(root):
+    include = root / 'modules' / 'zmk' / 'helpers' / 'include' / 'zmk-helpers'
+    (include / 'key-labels').mkdir(parents=True)
+    (include / 'helper.h').write_text(HELPER_H)
+    (include / 'key-labels' / 'test4.h').write_text(LABELS_H)
+
+
+def model(root):
+    cache = ModelCache(root / 'cache.pickle', enabled=False)
+    return cache.model(root / 'config' / 'test.keymap', default_include_dirs(root))
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    return make_workspace(tmp_path)
+
+
+def test_include_dirs_follow_west_yml(workspace):
+    assert default_include_dirs(workspace) == [workspace / 'config']
+    add_helpers(workspace)
+    assert default_include_dirs(workspace) == [workspace / 'config',
+                                               workspace / 'modules' / 'zmk' / 'helpers' / 'include']
+
+
+def test_headers_are_read_from_the_workspace(workspace):
+    add_helpers(workspace)
+    keymap = model(workspace)
+    assert keymap.fallbacks == []
+    assert not keymap.approximate
+    assert [c.key_positions for c in keymap.combos] == [(0, 1), (1, 2, 3)]
+    assert keymap.combos_per_key() == {0: 1, 1: 2, 2: 1, 3: 1}
+
+
+def test_missing_module_is_approximate(workspace):
+    keymap = model(workspace)
+    assert keymap.fallbacks == ['zmk-helpers/helper.h']
+    assert keymap.approximate
+    assert keymap.to_dict()['approximate'] is True
+    # Without the key-label header positions stay symbolic, but combos per key still add up
+    assert [c.key_positions for c in keymap.combos] == [('LT1', 'LT0'), ('LT0', 'RT0', 'RT1')]
+    assert keymap.combos_per_key()['LT0'] == 2
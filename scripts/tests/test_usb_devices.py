@@ -0,0 +1,69 @@
+"""USB enumeration: sysfs and `lsusb -v` captured from the same machine must give the same devices"""
+
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+from usb_devices import (BOOTLOADER_KEYWORDS, enumerate_usb_devices, find_usb_device, list_usb_devices,
+                         parse_lsusb_output)
+
+DATA = Path(__file__).resolve().parent / 'data'
+
+
+@pytest.fixture
+def sysfs_root(tmp_path):
+    """/sys/bus/usb/devices rebuilt from the captured attributes"""
+    with open(DATA / 'sysfs-usb.json') as f:
+        capture = json.load(f)
+    devices = tmp_path / 'bus' / 'usb' / 'devices'
+    for name, attrs in capture.items():
+        os.makedirs(devices / name)
+        for attr, value in attrs.items():
+            (devices / name / attr).write_text(f"{value}\n")
+    return str(tmp_path)
+
+
+@pytest.fixture
+def lsusb_output():
+    return (DATA / 'lsusb-v.txt').read_text()
+
+
+def comparable(devices):
+    return sorted(device._replace(sysfs_path=None) for device in devices)
+
+
+def test_sysfs_and_lsusb_agree(sysfs_root, lsusb_output):
+    from_sysfs = enumerate_usb_devices(sysfs_root)
+    from_lsusb = parse_lsusb_output(lsusb_output)
+    assert len(from_sysfs) == 6  # Interfaces (1-2:1.2) are not devices
+    assert comparable(from_sysfs) == comparable(from_lsusb)
+
+
+def test_bootloader_keywords_find_the_same_device(sysfs_root, lsusb_output):
+    bootloaders = list_usb_devices(sysfs_root, BOOTLOADER_KEYWORDS)
+    assert [(d.serial, d.product_name) for d in bootloaders] == [('E4C3B2A1F0D9C8B7', 'nice!nano UF2 Bootloader')]
+    from_lsusb = [d for d in parse_lsusb_output(lsusb_output) if d.matches(BOOTLOADER_KEYWORDS)]
+    assert comparable(from_lsusb) == comparable(bootloaders)
+
+
+def test_parsed_fields(lsusb_output):
+    by_serial = {d.serial: d for d in parse_lsusb_output(lsusb_output)}
+    keyboard = by_serial['7F3A9C21D04B6E85']
+    assert (keyboard.bus, keyboard.device, keyboard.vendor_id, keyboard.product_id) == ('001', '005', '1d50', '615e')
+    assert (keyboard.vendor_name, keyboard.product_name) == ('ZMK Project', 'Eyelash Corne')
+    assert keyboard.usb_path == '/dev/bus/usb/001/005'
+    # No serial string (iSerial 0) means no serial, not an empty one
+    assert None in by_serial and by_serial[None].vendor_name in ('Logitech', 'GenesysLogic')
+
+
+def test_find_by_serial(sysfs_root):
+    device = find_usb_device('7F3A9C21D04B6E85', sysfs_root)
+    assert (device.bus, device.device, device.product_name) == ('001', '005', 'Eyelash Corne')
+    assert device.sysfs_path.endswith('1-3')
+    assert find_usb_device('NOPE', sysfs_root) is None
+
+
+def test_missing_sysfs_means_fallback(tmp_path):
+    assert enumerate_usb_devices(str(tmp_path)) is None
@@ -0,0 +1,112 @@
+"""Bootloader detection: a fake sysfs tree and a replayed uevent stream driving BootloaderWatcher"""
+
+import os
+
+from bench_fixtures import FakeSysfs, add_bootloader, disk_name
+from usb_watch import BootloaderWatcher, ReplaySource, format_uevent, list_bootloader_disks, parse_uevent
+
+
+def block_event(action, name, **fields):
+    return {'ACTION': action, 'DEVPATH': f"/devices/virtual/block/{name}", 'SUBSYSTEM': 'block',
+            'DEVNAME': name, 'DEVTYPE': 'disk', **fields}
+
+
+def replay(fake, events, handlers):
+    """A ReplaySource whose messages run handlers[DEVNAME + ACTION] on the fake tree before delivery"""
+    def on_emit(message):
+        handler = handlers.get((message.get('DEVNAME'), message['ACTION']))
+        if handler:
+            handler()
+    return ReplaySource(events, on_emit=on_emit)
+
+
+def collect(watcher, duration):
+    return [(disk.name, disk.serial) for disk in watcher.watch(duration)]
+
+
+def test_uevent_round_trip():
+    raw = format_uevent('add', '/devices/usb1/1-2/block/sdb', SUBSYSTEM='block', DEVNAME='sdb', DEVTYPE='disk')
+    assert parse_uevent(raw) == {'ACTION': 'add', 'DEVPATH': '/devices/usb1/1-2/block/sdb',
+                                 'SUBSYSTEM': 'block', 'DEVNAME': 'sdb', 'DEVTYPE': 'disk'}
+    # Real kernel messages start with an action@devpath header
+    assert parse_uevent(b'remove@/block/sdc\0SUBSYSTEM=block\0')['ACTION'] == 'remove'
+
+
+def test_present_disks_are_reported_first_and_only_bootloaders():
+    with FakeSysfs() as fake:
+        add_bootloader(fake, 0, serial='BOOT0')
+        fake.add_disk('sda', None, size_mb=256000, removable=False)  # System disk on a PCI controller
+        usb_path = fake.add_usb_device(1, 5, '0781', '5581', 'SanDisk', 'Ultra', 'STICK')
+        fake.add_disk('sdz', usb_path, size_mb=32000)  # Too big for a UF2 volume
+
+        assert [(d.name, d.serial) for d in list_bootloader_disks(fake.sysfs_root, fake.dev_root)] == \
+            [(disk_name(0), 'BOOT0')]
+        with BootloaderWatcher(fake.sysfs_root, fake.dev_root, source=ReplaySource([])) as watcher:
+            first = watcher.wait_for_devices(1.0)
+            assert [(d.name, d.path, d.serial) for d in first] == \
+                [(disk_name(0), os.path.join(fake.dev_root, disk_name(0)), 'BOOT0')]
+            assert watcher.wait_for_devices(0.1) == []
+
+
+def test_replayed_arrivals_removals_and_late_sizes():
+    with FakeSysfs() as fake:
+        name0, name1, name2 = disk_name(0), disk_name(1), disk_name(2)
+        usb_stick = []
+
+        def add_late_size():
+            # The disk exists before its capacity is known, as right after a real "add"
+            usb_path = add_bootloader(fake, 2, serial='BOOT2', with_disk=False)
+            fake.add_disk(name2, usb_path, size_mb=0)
+
+        def set_size():
+            fake._write(os.path.join(fake.sysfs_root, 'block', name2, 'size'), 16384)
+
+        def add_stick():
+            usb_stick.append(fake.add_usb_device(2, 1, '0781', '5581', 'SanDisk', 'Ultra', 'STICK'))
+            fake.add_disk('sdy', usb_stick[0], size_mb=32000)
+
+        handlers = {
+            (name0, 'add'): lambda: add_bootloader(fake, 0, serial='BOOT0'),
+            (name0, 'remove'): lambda: fake.remove_disk(name0),
+            (name1, 'add'): lambda: add_bootloader(fake, 1, serial='BOOT1'),
+            (name2, 'add'): add_late_size,
+            (name2, 'change'): set_size,
+            ('sdy', 'add'): add_stick,
+        }
+        events = [
+            (0.02, block_event('add', name0)),
+            (0.04, block_event('add', 'sdy')),
+            (0.06, {'ACTION': 'add', 'DEVPATH': '/devices/usb1/1-9', 'SUBSYSTEM': 'usb', 'DEVTYPE': 'usb_device'}),
+            (0.08, block_event('add', name1)),
+            (0.10, block_event('remove', name0)),
+            (0.12, block_event('add', name2)),
+            (0.30, block_event('change', name2)),
+            (0.32, block_event('add', name0)),
+        ]
+        with BootloaderWatcher(fake.sysfs_root, fake.dev_root, source=replay(fake, events, handlers)) as watcher:
+            assert watcher.mode == 'replay'
+            found = collect(watcher, 1.0)
+        assert found == [(name0, 'BOOT0'), (name1, 'BOOT1'), (name2, 'BOOT2'), (name0, 'BOOT0')]
+
+
+def test_forget_reports_a_present_disk_again():
+    with FakeSysfs() as fake:
+        add_bootloader(fake, 0, serial='BOOT0')
+        with BootloaderWatcher(fake.sysfs_root, fake.dev_root, source=ReplaySource([])) as watcher:
+            assert [d.name for d in watcher.wait_for_devices(0.5)] == [disk_name(0)]
+            watcher.forget(disk_name(0))
+            assert [d.name for d in watcher.wait_for_devices(0.5)] == [disk_name(0)]
+            # Forgetting a disk that has gone reports nothing
+            fake.remove_disk(disk_name(0))
+            watcher.forget(disk_name(0))
+            assert watcher.wait_for_devices(0.1) == []
+
+
+def test_poll_mode_without_an_event_source():
+    with FakeSysfs() as fake:
+        watcher = BootloaderWatcher(fake.sysfs_root, fake.dev_root, source=ReplaySource([]))
+        watcher.close()  # No source left: the watcher polls /sys/block
+        assert watcher.mode == 'poll'
+        assert watcher.wait_for_devices(0.05) == []
+        add_bootloader(fake, 3, serial='BOOT3')
+        assert [(d.name, d.serial) for d in watcher.wait_for_devices(1.0)] == [(disk_name(3), 'BOOT3')]
@@ -0,0 +1,64 @@
+"""Post-flash verification: images without a fingerprint are never waited on"""
+
+import json
+import time
+from contextlib import closing
+
+import pytest
+
+from bench_fixtures import FakeSysfs
+from usb_watch import ReplaySource
+from verify import (ENUMERATED, MISSING, OK_STATES, UNVERIFIABLE, VERIFIED, fingerprint_path, make_fingerprint,
+                    verify_flashed)
+
+KCONFIG = {'CONFIG_USB_DEVICE_STACK': 'y', 'CONFIG_USB_DEVICE_VID': '0x1D50', 'CONFIG_USB_DEVICE_PID': '0x615E',
+           'CONFIG_USB_DEVICE_MANUFACTURER': 'ZMK Project', 'CONFIG_USB_DEVICE_PRODUCT': 'Eyelash Corne'}
+TIMEOUT = 3.0
+
+
+@pytest.fixture
+def images(tmp_path):
+    """A built image with a fingerprint, and one downloaded without"""
+    built = tmp_path / 'built.uf2'
+    built.write_bytes(b'\x01' * 512)
+    with open(fingerprint_path(str(built)), 'w') as f:
+        json.dump(make_fingerprint(str(built), KCONFIG)._asdict(), f)
+    downloaded = tmp_path / 'downloaded.uf2'
+    downloaded.write_bytes(b'\x02' * 512)
+    return str(built), str(downloaded)
+
+
+def arrivals(fake, devices):
+    """A ReplaySource that plugs in (delay, port, serial) application devices"""
+    def on_emit(message):
+        port, serial = message['PORT'], message['SERIAL']
+        fake.add_usb_device(1, port, '1d50', '615e', 'ZMK Project', 'Eyelash Corne', serial)
+
+    return closing(ReplaySource([(delay, {'ACTION': 'add', 'DEVPATH': f"/devices/usb1/1-{port}", 'SUBSYSTEM': 'usb',
+                                          'DEVTYPE': 'usb_device', 'PORT': port, 'SERIAL': serial})
+                                 for delay, port, serial in devices], on_emit=on_emit))
+
+
+def test_no_fingerprint_is_not_waited_on(images):
+    _, downloaded = images
+    with FakeSysfs() as fake, arrivals(fake, []) as source:
+        start = time.monotonic()
+        result, = verify_flashed([('corne', 'APP0001', downloaded)], TIMEOUT, fake.sysfs_root, source)
+        assert time.monotonic() - start < 1.0
+    assert result.state == UNVERIFIABLE and result.state in OK_STATES
+    assert result.problems == []
+
+
+def test_no_fingerprint_seen_while_waiting_for_the_others(images):
+    built, downloaded = images
+    with FakeSysfs() as fake, arrivals(fake, [(0.1, 3, 'APP0002'), (0.3, 2, 'APP0001')]) as source:
+        results = verify_flashed([('left', 'APP0001', built), ('right', 'APP0002', downloaded),
+                                  ('dongle', 'APP0003', downloaded)], TIMEOUT, fake.sysfs_root, source)
+    assert [r.state for r in results] == [VERIFIED, ENUMERATED, UNVERIFIABLE]
+
+
+def test_fingerprinted_usb_image_is_still_missing_when_it_does_not_return(images):
+    built, _ = images
+    with FakeSysfs() as fake, arrivals(fake, []) as source:
+        result, = verify_flashed([('corne', 'APP0001', built)], 0.3, fake.sysfs_root, source)
+    assert result.state == MISSING and result.state not in OK_STATES
@@ -0,0 +1,151 @@
+"""The `zmk` entry point: start-up budget and the daemon's single-threaded forking"""
+
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+SCRIPTS = Path(__file__).resolve().parent.parent
+ZMK = str(SCRIPTS / 'zmk')
+BUDGET_MS = 50  # `zmk --help` over a bare interpreter
+RUNS = 9
+
+
+def imported(argv, env):
+    """Module names imported by a command, from -X importtime"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', *argv], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    return {line.rsplit('|', 1)[-1].strip() for line in result.stderr.splitlines() if line.startswith('import time:')}
+
+
+@pytest.fixture
+def env(tmp_path):
+    run_dir = tmp_path / 'run'
+    run_dir.mkdir()
+    return dict(os.environ, HOME=str(tmp_path), XDG_RUNTIME_DIR=str(run_dir), ZMK_DAEMON='0')
+
+
+def test_help_imports_nothing_beyond_the_interpreter(env):
+    extra = imported([ZMK, '--help'], env) - imported(['-c', 'pass'], env)
+    assert extra == set()
+
+
+def test_help_within_budget(env):
+    def median_ms(argv):
+        samples = []
+        for _ in range(RUNS):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, *argv], env=env, stdout=subprocess.DEVNULL, check=True)
+            samples.append(time.perf_counter() - start)
+        return statistics.median(samples) * 1000
+
+    baseline = median_ms(['-c', 'pass'])
+    overhead = median_ms([ZMK, '--help']) - baseline
+    assert overhead <= BUDGET_MS, f"`zmk --help` adds {overhead:.1f} ms over {baseline:.1f} ms (budget {BUDGET_MS} ms)"
+
+
+@pytest.fixture
+def daemon(env, tmp_path):
+    """A running daemon with one configured keyboard; yields the client environment"""
+    config = tmp_path / '.config' / 'zmk'
+    config.mkdir(parents=True)
+    (config / 'devices.yaml').write_text('ABC123:\n  name: corne\n  type: keyboard\n  side: left\n')
+    socket_path = tmp_path / 'run' / 'zmk.sock'
+    process = subprocess.Popen([sys.executable, str(SCRIPTS / 'zmk_daemon.py')], env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    try:
+        deadline = time.monotonic() + 20
+        while not socket_path.exists():
+            assert process.poll() is None and time.monotonic() < deadline, 'daemon did not start'
+            time.sleep(0.05)
+        client_env = dict(env)
+        del client_env['ZMK_DAEMON']
+        yield client_env
+    finally:
+        process.send_signal(signal.SIGINT)
+        process.wait(10)
+    assert not socket_path.exists()
+
+
+def registry_name(client_env):
+    return subprocess.run([sys.executable, ZMK, 'registry', '--name', 'corne'], env=client_env,
+                          capture_output=True, text=True, timeout=20)
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/task'), reason='thread count is read from /proc')
+def test_daemon_serves_commands_from_a_single_thread(daemon, env):
+    served = registry_name(daemon)
+    assert served.returncode == 0
+    assert served.stdout.startswith('ABC123: corne (keyboard, left side')
+    failed = subprocess.run([sys.executable, ZMK, 'registry', '--bogus'], env=daemon,
+                            capture_output=True, text=True, timeout=20)
+    assert failed.returncode == 2 and 'unrecognized arguments' in failed.stderr
+
+    status = subprocess.run([sys.executable, str(SCRIPTS / 'zmk_daemon.py'), '--status'], env=env,
+                            capture_output=True, text=True, timeout=20).stdout
+    fields = dict(line.split(None, 1) for line in status.splitlines())
+    assert fields['served'] == '2'
+    assert fields['threads'] == '1'  # Nothing running beside the loop that forks
+
+
+def test_stalled_client_does_not_block_the_daemon(daemon):
+    stalled = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with stalled:
+        stalled.connect(os.path.join(daemon['XDG_RUNTIME_DIR'], 'zmk.sock'))
+        stalled.sendall(b'{"command": "registry"')  # ...and never the newline
+        start = time.monotonic()
+        served = registry_name(daemon)
+        assert served.returncode == 0 and served.stdout.startswith('ABC123: corne')
+        assert time.monotonic() - start < 10
+        assert stalled.recv(64) == b''  # Dropped after the request timeout
+
+
+
+@pytest.fixture
+def zmk():
+    from auto_flash_functions import load_script
+    return load_script('zmk')
+
+
+def listening_socket(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(str(path))
+    sock.listen(1)
+    sock.setblocking(False)
+    return sock
+
+
+@pytest.mark.parametrize('mode, trusted', [(0o700, True), (0o1777, True), (0o777, False)])
+def test_socket_trusted_only_where_nobody_else_can_replace_it(zmk, tmp_path, mode, trusted):
+    shared = tmp_path / 'shared'
+    shared.mkdir()
+    with listening_socket(shared / 'zmk.sock'):
+        shared.chmod(mode)
+        assert zmk.trusted_socket(str(shared / 'zmk.sock')) is trusted
+    (tmp_path / 'plain').write_text('')
+    assert not zmk.trusted_socket(str(tmp_path / 'plain'))
+
+
+def test_untrusted_socket_gets_no_fds_or_environment(zmk, tmp_path, monkeypatch, capsys):
+    shared = tmp_path / 'shared'
+    shared.mkdir()
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(shared))
+    monkeypatch.delenv('ZMK_DAEMON', raising=False)
+    with listening_socket(shared / 'zmk.sock') as listener:
+        shared.chmod(0o777)
+        assert zmk.run_via_daemon('registry', []) is None
+        with pytest.raises(BlockingIOError):
+            listener.accept()  # The client never connected
+    assert 'Not using' in capsys.readouterr().err
+
+
+def test_peer_uid_is_the_listener(zmk):
+    left, right = socket.socketpair()
+    with left, right:
+        assert zmk.peer_uid(left) in (None, os.getuid())
@@ -0,0 +1,43 @@
+"""`zmk devices --log`: the log comes from the keyboard's tty, whatever order devices.yaml lists entries in"""
+
+import io
+
+import pytest
+
+from auto_flash_functions import load_script
+from bench_fixtures import FakeSysfs
+from device_registry import DeviceRegistry, make_device
+
+BOOTLOADER = ('BOOT0001', {'name': 'corne', 'type': 'bootloader', 'side': 'left'})
+KEYBOARD = ('APP0001', {'name': 'corne', 'type': 'keyboard', 'side': 'left'})
+
+
+@pytest.fixture
+def zmk_devices():
+    return load_script('zmk-devices')
+
+
+@pytest.mark.parametrize('entries', [(BOOTLOADER, KEYBOARD), (KEYBOARD, BOOTLOADER)])
+def test_log_resolves_the_keyboard_not_the_bootloader(zmk_devices, entries):
+    registry = DeviceRegistry(make_device(serial, info) for serial, info in entries)
+    assert zmk_devices.find_log_device(registry, 'Corne').serial == 'APP0001'
+
+
+def test_bootloader_alone_has_no_log(zmk_devices):
+    registry = DeviceRegistry([make_device(*BOOTLOADER)])
+    assert zmk_devices.find_log_device(registry, 'corne') is None
+
+
+def test_stream_log_with_the_bootloader_listed_first(zmk_devices, monkeypatch):
+    registry = DeviceRegistry(make_device(serial, info) for serial, info in (BOOTLOADER, KEYBOARD))
+    monkeypatch.setattr(zmk_devices, 'load_registry', lambda quiet=False: registry)
+    with FakeSysfs() as fake:
+        usb_path = fake.add_usb_device(1, 2, '1d50', '615e', 'ZMK Project', 'Eyelash Corne', 'APP0001')
+        fake.add_tty('ttyACM0', usb_path)
+        with open(f"{fake.dev_root}/ttyACM0", 'wb') as f:
+            f.write(b'<inf> zmk: Welcome to ZMK!\n')
+        index = zmk_devices.build_index(fake.sysfs_root, fake.dev_root)
+        monkeypatch.setattr(zmk_devices, 'build_index', lambda: index)
+        out = io.BytesIO()
+        assert zmk_devices.stream_log('corne', follow=False, wait=1.0, out=out)
+    assert out.getvalue() == b'<inf> zmk: Welcome to ZMK!\n'
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Lightweight tracing for the ZMK tools
+Spans and counters around the hot paths (USB enumeration, block device scans,
+mounts, UF2 writes, west build stages). Off unless ZMK_TRACE is set or a tool
+runs with --profile; span() then hands back a shared no-op object, so the
+instrumentation costs a global check. Recorded runs are appended to a compact
+JSONL log in ~/.cache/zmk and can be summarized or exported as a Chrome trace.
+"""
+
+import atexit
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Constants
+TRACE_LOG = Path.home() / ".cache" / "zmk" / "traces.jsonl"
+MAX_LOG_SIZE = 8 * 1024 * 1024  # The log is rotated to traces.jsonl.1 beyond this
+FLUSH_EVERY = 512  # Buffered events before a write
+
+# ZMK_TRACE: unset/0 = off, 1 = record to TRACE_LOG, anything else = log path.
+# ZMK_TRACE_RUN groups the records of one run across processes.
+_enabled = False
+_log_path = None
+_run = None
+_buffer = []
+_lock = threading.Lock()
+_clock_offset = time.time_ns() - time.perf_counter_ns()
+_chrome_path = None
+_pid = None  # Process that configured tracing; a forked child starts its own buffer
+_named = False
+_registered = False
+
+
+def tracing_enabled():
+    return _enabled
+
+
+def _env_log():
+    """The log path ZMK_TRACE asks for, or None when tracing is off"""
+    setting = os.environ.get('ZMK_TRACE', '')
+    if setting in ('', '0'):
+        return None
+    return TRACE_LOG if setting == '1' else Path(setting)
+
+
+def configure(log_path=None, chrome_path=None):
+    """
+    Start recording (to log_path, or ZMK_TRACE/TRACE_LOG), or re-read ZMK_TRACE
+    when called without arguments. Child processes inherit the setting and
+    the run ID through the environment.
+    """
+    global _enabled, _log_path, _run, _chrome_path, _pid, _named, _registered
+
+    log_path = log_path or _env_log()
+    if log_path is None:
+        _enabled = False
+        _buffer.clear()
+        return False
+
+    _log_path = Path(log_path)
+    _run = os.environ.get('ZMK_TRACE_RUN') or f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+    os.environ['ZMK_TRACE'] = str(_log_path)
+    os.environ['ZMK_TRACE_RUN'] = _run
+    _chrome_path = chrome_path or _chrome_path
+    if not _enabled or _pid != os.getpid():
+        _enabled = True
+        _pid = os.getpid()
+        _named = False
+        _buffer.clear()
+    if not _registered:
+        _registered = True
+        atexit.register(finish)
+    return True
+
+
+def _now_us():
+    return (time.perf_counter_ns() + _clock_offset) // 1000
+
+
+def _record(event):
+    event['pid'] = os.getpid()
+    event['tid'] = threading.get_native_id()
+    event['run'] = _run
+    with _lock:
+        _buffer.append(event)
+        if len(_buffer) < FLUSH_EVERY:
+            return
+    flush()
+
+
+class _Span:
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def set(self, **args):
+        """Attach attributes to the span (e.g. bytes written, devices found)"""
+        self.args.update(args)
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        event = {'ph': 'X', 'name': self.name, 'ts': (self.start + _clock_offset) // 1000,
+                 'dur': (end - self.start) // 1000}
+        if self.args:
+            event['args'] = self.args
+        _record(event)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, **args):
+    """Context manager timing a stage: `with span('flash.write', device=name) as s: ...`"""
+    if not _enabled:
+        return _NO_SPAN
+    return _Span(name, args)
+
+
+def add_span(name, start, end, **args):
+    """Record a span from perf_counter() timestamps taken elsewhere (e.g. parsed build output)"""
+    if not _enabled:
+        return
+    event = {'ph': 'X', 'name': name, 'ts': (int(start * 1e9) + _clock_offset) // 1000,
+             'dur': int((end - start) * 1e6)}
+    if args:
+        event['args'] = args
+    _record(event)
+
+
+def count(name, value=1):
+    """Record a counter sample (shown as a graph in the Chrome trace)"""
+    if not _enabled:
+        return
+    _record({'ph': 'C', 'name': name, 'ts': _now_us(), 'args': {name: value}})
+
+
+def traced(name):
+    """Decorator form of span() for whole functions"""
+    def decorate(func):
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Span(name, {}):
+                return func(*args, **kwargs)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        wrapper.__wrapped__ = func
+        return wrapper
+    return decorate
+
+
+def flush():
+    """Append buffered events to the log (one write, so concurrent processes do not interleave lines)"""
+    import json
+    global _named
+
+    with _lock:
+        if not _buffer or _log_path is None:
+            return
+        if not _named:
+            # Named at the first write: `zmk <command>` and the daemon set argv after start-up
+            _named = True
+            _buffer.insert(0, {'ph': 'M', 'name': 'process_name', 'ts': 0, 'pid': os.getpid(),
+                               'tid': threading.get_native_id(), 'run': _run,
+                               'args': {'name': os.path.basename(sys.argv[0] or 'python')}})
+        data = ''.join(json.dumps(e, separators=(',', ':')) + '\n' for e in _buffer).encode()
+        _buffer.clear()
+    try:
+        _log_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            if _log_path.stat().st_size > MAX_LOG_SIZE:
+                os.replace(_log_path, _log_path.with_name(_log_path.name + '.1'))
+        except FileNotFoundError:
+            pass
+        fd = os.open(_log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        print(f"⚠️  Could not write trace log {_log_path}: {e}", file=sys.stderr)
+
+
+def finish():
+    """Flush the log and write the Chrome trace asked for with --profile (run at exit)"""
+    if not _enabled:
+        return
+    flush()
+    if _chrome_path:
+        events = [e for e in read_events([_log_path]) if e.get('run') == _run]
+        write_chrome_trace(events, _chrome_path)
+        print(f"📊 Trace of run {_run} written to {_chrome_path}", file=sys.stderr)
+
+
+def add_profile_argument(parser):
+    parser.add_argument('--profile', nargs='?', const='', default=None, metavar='TRACE_JSON',
+                        help='Record timing spans to the trace log (and a Chrome trace to TRACE_JSON)')
+
+
+def setup_profile(args):
+    """Enable tracing if the tool was run with --profile"""
+    profile = getattr(args, 'profile', None)
+    if profile is not None:
+        configure(_env_log() or TRACE_LOG, profile or None)
+
+
+# Reading the log back
+
+def read_events(paths):
+    """Events from JSONL logs, oldest first (unparseable lines are skipped)"""
+    import json
+
+    events = []
+    for path in paths:
+        try:
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        events.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError:
+            continue
+    return events
+
+
+def log_files(path=None):
+    path = Path(path or _env_log() or TRACE_LOG)
+    return [path.with_name(path.name + '.1'), path]
+
+
+def runs(events):
+    """Run IDs in the order they were first recorded"""
+    return list(dict.fromkeys(e.get('run') for e in events if e.get('run')))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(events):
+    """{span name: (count, runs, p50 ms, p95 ms, max ms, total ms)} for the complete ('X') events"""
+    durations = {}
+    run_sets = {}
+    for event in events:
+        if event.get('ph') != 'X':
+            continue
+        durations.setdefault(event['name'], []).append(event['dur'] / 1000)
+        run_sets.setdefault(event['name'], set()).add(event.get('run'))
+    return {name: (len(values), len(run_sets[name]), percentile(values, 0.5), percentile(values, 0.95),
+                   max(values), sum(values))
+            for name, values in durations.items()}
+
+
+def write_chrome_trace(events, path):
+    """Write events in the Chrome trace-event format (chrome://tracing, Perfetto)"""
+    import json
+
+    trace = [{k: v for k, v in e.items() if k != 'run'} for e in events]
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f, separators=(',', ':'))
+
+
+configure()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Summarize or export recorded ZMK tool traces',
+                                     epilog='Record with --profile on any tool, or ZMK_TRACE=1 for everything')
+    parser.add_argument('--log', help=f'Trace log to read (default: {TRACE_LOG})')
+    subparsers = parser.add_subparsers(dest='action')
+    summary_parser = subparsers.add_parser('summarize', help='p50/p95 per stage across runs')
+    summary_parser.add_argument('--runs', '-r', type=int, help='Only the last N runs')
+    summary_parser.add_argument('--match', '-m', help='Only spans whose name contains this')
+    export_parser = subparsers.add_parser('export', help='Write a Chrome trace-event JSON file')
+    export_parser.add_argument('output', help='Output .json file')
+    export_parser.add_argument('--run', help='Run ID to export (default: the last run; "all" for every run)')
+    subparsers.add_parser('runs', help='List recorded runs')
+    subparsers.add_parser('clear', help='Delete the trace log')
+    args = parser.parse_args()
+
+    paths = log_files(args.log)
+    if args.action == 'clear':
+        for path in paths:
+            if path.exists():
+                path.unlink()
+        print("🗑️  Trace log cleared")
+        return
+
+    events = read_events(paths)
+    run_ids = runs(events)
+    if not run_ids:
+        print(f"No traces recorded in {paths[-1]}. Run a tool with --profile or ZMK_TRACE=1 first.")
+        sys.exit(1)
+
+    if args.action == 'runs':
+        for run in run_ids:
+            spans = [e for e in events if e.get('run') == run and e.get('ph') == 'X']
+            tools = sorted({e['args']['name'] for e in events if e.get('run') == run and e.get('ph') == 'M'})
+            wall = (max(e['ts'] + e['dur'] for e in spans) - min(e['ts'] for e in spans)) / 1e6 if spans else 0
+            print(f"{run:<24} {len(spans):>6} spans  {wall:8.2f}s  {', '.join(tools)}")
+        return
+
+    if args.action == 'export':
+        selected = run_ids if args.run == 'all' else [args.run or run_ids[-1]]
+        chosen = [e for e in events if e.get('run') in selected]
+        if not chosen:
+            print(f"❌ No events for run {args.run}")
+            sys.exit(1)
+        write_chrome_trace(chosen, args.output)
+        print(f"📊 Wrote {len(chosen)} events from {len(selected)} run(s) to {args.output}")
+        return
+
+    # summarize (default)
+    if getattr(args, 'runs', None):
+        keep = set(run_ids[-args.runs:])
+        events = [e for e in events if e.get('run') in keep]
+    if getattr(args, 'match', None):
+        events = [e for e in events if args.match in e.get('name', '')]
+    summary = summarize(events)
+    if not summary:
+        print("No matching spans")
+        return
+    width = max(len(name) for name in summary)
+    print(f"{'Stage':<{width}}  {'count':>6} {'runs':>5} {'p50 ms':>10} {'p95 ms':>10} {'max ms':>10} {'total s':>9}")
+    for name, (n, run_count, p50, p95, worst, total) in sorted(summary.items()):
+        print(f"{name:<{width}}  {n:>6} {run_count:>5} {p50:>10.2f} {p95:>10.2f} {worst:>10.2f} {total / 1000:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+UF2 firmware parser and validator
+Memory-maps a .uf2 file and walks its 512-byte blocks in place: checks the
+magic numbers, block numbering and family ID, and compares the family and
+flash address range with the bootloader's INFO_UF2.TXT before anything is
+written. Also streams the image in block-aligned chunks for the flasher.
+"""
+
+import mmap
+import os
+import re
+import struct
+from collections import namedtuple
+
+# Constants
+BLOCK_SIZE = 512
+MAX_PAYLOAD = 476
+MAGIC_START0 = 0x0A324655  # "UF2\n"
+MAGIC_START1 = 0x9E5D5157
+MAGIC_END = 0x0AB16F30
+HEADER = struct.Struct('<8I')
+FOOTER = struct.Struct('<I')
+
+# Block flags
+FLAG_NOT_MAIN_FLASH = 0x00000001
+FLAG_FILE_CONTAINER = 0x00001000
+FLAG_FAMILY_ID_PRESENT = 0x00002000
+FLAG_MD5_PRESENT = 0x00004000
+FLAG_EXTENSION_TAGS = 0x00008000
+
+FAMILIES = {
+    0xADA52840: 'nRF52840',
+    0x621E937A: 'nRF52833',
+    0x1B57745F: 'nRF52',
+    0xE48BFF56: 'RP2040',
+    0x57755A57: 'STM32F4',
+}
+
+# Board-ID prefix in INFO_UF2.TXT: (family IDs, first writable address, end of application flash)
+# nRF52840: the Adafruit bootloader lives at 0xF4000; the app starts after the SoftDevice (see below)
+BOARD_TARGETS = {
+    'nRF52840': ((0xADA52840,), 0x1000, 0xF4000),
+    'nRF52833': ((0x621E937A,), 0x1000, 0x74000),
+    'RPI-RP2': ((0xE48BFF56,), 0x10000000, 0x11000000),
+}
+# First application address for the SoftDevice named in INFO_UF2.TXT
+SOFTDEVICE_APP_START = {
+    'S140 6': 0x26000,
+    'S140 7': 0x27000,
+    'S113 7': 0x1C000,
+}
+
+UF2Block = namedtuple('UF2Block', 'index flags target_addr payload_size block_no num_blocks family_id')
+BoardTarget = namedtuple('BoardTarget', 'board_id family_ids start end')
+
+
+class UF2Error(ValueError):
+    """The file is not a well-formed UF2 image, or does not fit the target bootloader"""
+
+
+class UF2Image:
+    """
+    A .uf2 file mapped read-only. Nothing is copied: blocks() decodes headers
+    straight from the mapping and chunks() yields memoryview slices of it.
+    validate() must be called before the summary attributes are meaningful.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.size = os.path.getsize(self.path)
+        self._file = open(self.path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+        self.view = memoryview(self._map) if self._map is not None else memoryview(b'')
+        self.num_blocks = 0
+        self.family_ids = set()
+        self.address_range = None  # (lowest address, end of highest payload) of main-flash blocks
+        self.payload_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        try:
+            self.view.release()
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+        except BufferError:
+            pass  # A chunk is still referenced; the mapping goes away with it
+        self._file.close()
+
+    def blocks(self):
+        """Yield the UF2Block header of every block (raises UF2Error on a bad magic)"""
+        for index in range(self.size // BLOCK_SIZE):
+            offset = index * BLOCK_SIZE
+            start0, start1, flags, target, payload, block_no, num_blocks, family = \
+                HEADER.unpack_from(self.view, offset)
+            if start0 != MAGIC_START0 or start1 != MAGIC_START1 or \
+                    FOOTER.unpack_from(self.view, offset + BLOCK_SIZE - 4)[0] != MAGIC_END:
+                raise UF2Error(f"block {index}: bad magic number (not a UF2 file?)")
+            yield UF2Block(index, flags, target, payload, block_no, num_blocks,
+                           family if flags & FLAG_FAMILY_ID_PRESENT else None)
+
+    def validate(self):
+        """Check the structure of the whole image. Returns self for chaining."""
+        if not self.size:
+            raise UF2Error("empty file")
+        if self.size % BLOCK_SIZE:
+            raise UF2Error(f"size {self.size} is not a multiple of {BLOCK_SIZE} bytes (truncated?)")
+
+        low = high = None
+        expected_no = 0
+        expected_total = None
+        for block in self.blocks():
+            if block.payload_size > MAX_PAYLOAD:
+                raise UF2Error(f"block {block.index}: payload size {block.payload_size} > {MAX_PAYLOAD}")
+            if block.flags & FLAG_FILE_CONTAINER:
+                raise UF2Error(f"block {block.index}: file-container blocks are not firmware")
+            if expected_total is None:
+                expected_total = block.num_blocks
+            if block.num_blocks != expected_total:
+                raise UF2Error(f"block {block.index}: total changes from {expected_total} to {block.num_blocks}")
+            if block.block_no != expected_no:
+                raise UF2Error(f"block {block.index}: numbered {block.block_no}, expected {expected_no}")
+            expected_no += 1
+            if expected_no == expected_total:
+                expected_no = 0  # Several images may be concatenated, each numbered from 0
+            if block.flags & FLAG_NOT_MAIN_FLASH:
+                continue
+            if block.family_id is not None:
+                self.family_ids.add(block.family_id)
+            end = block.target_addr + block.payload_size
+            low = block.target_addr if low is None else min(low, block.target_addr)
+            high = end if high is None else max(high, end)
+            self.payload_bytes += block.payload_size
+
+        if expected_no:
+            raise UF2Error(f"image ends after block {expected_no - 1} of {expected_total} (truncated?)")
+        if len(self.family_ids) > 1:
+            names = ', '.join(family_name(f) for f in sorted(self.family_ids))
+            raise UF2Error(f"mixed family IDs in one image: {names}")
+        self.num_blocks = self.size // BLOCK_SIZE
+        self.address_range = (low, high) if low is not None else None
+        return self
+
+    @property
+    def family_id(self):
+        return next(iter(self.family_ids), None)
+
+    def chunks(self, chunk_size=64 * 1024):
+        """Yield memoryview slices of whole blocks, about chunk_size bytes each"""
+        step = max(BLOCK_SIZE, chunk_size - chunk_size % BLOCK_SIZE)
+        for offset in range(0, self.size, step):
+            yield self.view[offset:offset + step]
+
+    def describe(self):
+        if self.address_range is None:
+            return f"{self.num_blocks} blocks, no main-flash payload"
+        low, high = self.address_range
+        return (f"{self.num_blocks} blocks, {family_name(self.family_id)}, "
+                f"0x{low:08X}-0x{high:08X} ({self.payload_bytes // 1024} KiB payload)")
+
+
+def family_name(family_id):
+    if family_id is None:
+        return 'no family ID'
+    return FAMILIES.get(family_id, f"family 0x{family_id:08X}")
+
+
+def parse_info(text):
+    """INFO_UF2.TXT as a dict ('UF2 Bootloader' holds the version line)"""
+    info = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('UF2 Bootloader'):
+            info['UF2 Bootloader'] = line[len('UF2 Bootloader'):].strip()
+        elif ':' in line:
+            key, value = line.split(':', 1)
+            info[key.strip()] = value.strip()
+    return info
+
+
+def read_info(mount_point):
+    """Parsed INFO_UF2.TXT of a mounted bootloader volume ({} if unreadable)"""
+    try:
+        with open(os.path.join(mount_point, 'INFO_UF2.TXT'), 'r', errors='replace') as f:
+            return parse_info(f.read())
+    except OSError:
+        return {}
+
+
+def board_target(info):
+    """What the bootloader accepts, from its Board-ID (None for unknown boards)"""
+    board_id = info.get('Board-ID', '')
+    for prefix, (family_ids, start, end) in BOARD_TARGETS.items():
+        if board_id.startswith(prefix):
+            # "S140 version 6.1.1" / "S140 6.1.1" -> "S140 6"
+            softdevice = re.match(r'(S\d+)\D*(\d+)', info.get('SoftDevice', ''))
+            if softdevice:
+                start = SOFTDEVICE_APP_START.get(' '.join(softdevice.groups()), start)
+            return BoardTarget(board_id, family_ids, start, end)
+    return None
+
+
+def check_target(image, info):
+    """
+    Problems that make a validated image unsafe for the bootloader described by
+    info: a different family, or payload outside the application flash region
+    (which would overwrite the SoftDevice/bootloader or be ignored). Unknown
+    boards only get the structural check.
+    """
+    target = board_target(info)
+    if target is None:
+        return []
+
+    problems = []
+    if image.family_id is not None and image.family_id not in target.family_ids:
+        expected = ', '.join(family_name(f) for f in target.family_ids)
+        problems.append(f"family {family_name(image.family_id)} does not match {target.board_id} ({expected})")
+    if image.address_range is not None:
+        low, high = image.address_range
+        if low < target.start or high > target.end:
+            problems.append(f"payload 0x{low:08X}-0x{high:08X} is outside {target.board_id}'s application flash "
+                            f"0x{target.start:08X}-0x{target.end:08X}")
+    return problems
+
+
+def open_firmware(firmware_file, mount_point=None):
+    """
+    Open and validate a firmware image, and if mount_point is given check it
+    against that bootloader. Raises UF2Error; the caller closes the image.
+    """
+    image = UF2Image(firmware_file)
+    try:
+        image.validate()
+        if mount_point is not None:
+            problems = check_target(image, read_info(mount_point))
+            if problems:
+                raise UF2Error('; '.join(problems))
+    except Exception:
+        image.close()
+        raise
+    return image
+
+
+def pack_image(data, address, family_id=None, payload_size=256):
+    """Wrap raw bytes in UF2 blocks (used by fixtures and benchmarks)"""
+    count = (len(data) + payload_size - 1) // payload_size
+    flags = FLAG_FAMILY_ID_PRESENT if family_id is not None else 0
+    out = bytearray()
+    for index in range(count):
+        payload = data[index * payload_size:(index + 1) * payload_size]
+        out += HEADER.pack(MAGIC_START0, MAGIC_START1, flags, address + index * payload_size, len(payload),
+                           index, count, family_id or 0)
+        out += payload.ljust(MAX_PAYLOAD, b'\0')
+        out += FOOTER.pack(MAGIC_END)
+    return bytes(out)
+
+
+def main():
+    import argparse
+    from tracing import add_profile_argument, setup_profile
+    import sys
+
+    parser = argparse.ArgumentParser(description='Validate UF2 firmware images')
+    parser.add_argument('files', nargs='+', help='.uf2 files to check')
+    parser.add_argument('--mount', '-m', help='Also check against the bootloader volume mounted here')
+    parser.add_argument('--info', '-i', help='Also check against this INFO_UF2.TXT')
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    setup_profile(args)
+
+    info = None
+    if args.info:
+        with open(args.info, 'r', errors='replace') as f:
+            info = parse_info(f.read())
+    elif args.mount:
+        info = read_info(args.mount)
+    target = board_target(info) if info else None
+    if info is not None:
+        print(f"🎯 {info.get('Board-ID', 'unknown board')}: "
+              + (f"{', '.join(family_name(f) for f in target.family_ids)}, "
+                 f"0x{target.start:08X}-0x{target.end:08X}" if target else "unknown board, structure only"))
+
+    failed = 0
+    for path in args.files:
+        try:
+            with UF2Image(path) as image:
+                image.validate()
+                problems = check_target(image, info) if info else []
+                description = image.describe()
+        except (UF2Error, OSError) as e:
+            problems, description = [str(e)], None
+        status = '❌' if problems else '✅'
+        print(f"{status} {os.path.basename(path)}" + (f": {description}" if description else ''))
+        for problem in problems:
+            print(f"   {problem}")
+        failed += bool(problems)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Shared USB device enumeration for ZMK tools
+Reads device attributes straight from /sys/bus/usb/devices instead of parsing
+`lsusb -v`, which opens every device's descriptors and can take seconds.
+"""
+
+import os
+import re
+from collections import namedtuple
+
+from matcher import as_matcher, load_rules
+from tracing import span, traced
+
+# Devices whose vendor/product strings contain one of these are treated as bootloaders
+# (vendor names like "Adafruit" or "Raspberry Pi", products like "UF2 Bootloader");
+# the list lives in device_rules.json
+BOOTLOADER_KEYWORDS = load_rules().bootloader
+
+
+class UsbDevice(namedtuple('UsbDevice', 'bus device vendor_id product_id vendor_name product_name serial sysfs_path')):
+    """One attached USB device. bus/device are zero-padded strings as lsusb prints them."""
+
+    __slots__ = ()
+
+    @property
+    def usb_path(self):
+        return f"/dev/bus/usb/{self.bus}/{self.device}"
+
+    def matches(self, keywords):
+        return as_matcher(keywords).search(self.vendor_name, self.product_name) is not None
+
+
+def _read_attr(path, name):
+    try:
+        with open(os.path.join(path, name), 'r', errors='replace') as f:
+            return f.read().strip()
+    except OSError:
+        return ''
+
+
+def enumerate_usb_devices(sysfs_root='/sys', keywords=None):
+    """
+    List attached USB devices from sysfs.
+    If keywords is given, only devices whose manufacturer or product string contains
+    one of them are returned, and the remaining attributes are only read for those.
+    Returns None if sysfs is not available (callers fall back to lsusb).
+    """
+    devices_dir = os.path.join(sysfs_root, 'bus', 'usb', 'devices')
+    try:
+        entries = os.listdir(devices_dir)
+    except OSError:
+        return None
+
+    matcher = as_matcher(keywords) if keywords is not None else None
+    devices = []
+    for entry in sorted(entries):
+        if ':' in entry:
+            continue  # Interfaces, not devices
+        path = os.path.join(devices_dir, entry)
+
+        vendor_name = _read_attr(path, 'manufacturer')
+        product_name = _read_attr(path, 'product')
+        if matcher is not None and matcher.search(vendor_name, product_name) is None:
+            continue
+
+        busnum = _read_attr(path, 'busnum')
+        devnum = _read_attr(path, 'devnum')
+        if not busnum or not devnum:
+            continue
+
+        devices.append(UsbDevice(
+            bus=busnum.zfill(3),
+            device=devnum.zfill(3),
+            vendor_id=_read_attr(path, 'idVendor'),
+            product_id=_read_attr(path, 'idProduct'),
+            vendor_name=vendor_name,
+            product_name=product_name,
+            serial=_read_attr(path, 'serial') or None,
+            sysfs_path=path,
+        ))
+    return devices
+
+
+@traced('usb.find')
+def find_usb_device(serial, sysfs_root='/sys'):
+    """
+    The attached device with this serial number, or None.
+    Only the serial attribute is read until the device is found.
+    """
+    devices_dir = os.path.join(sysfs_root, 'bus', 'usb', 'devices')
+    try:
+        entries = os.listdir(devices_dir)
+    except OSError:
+        return next((d for d in list_usb_devices(sysfs_root) if d.serial == serial), None)
+
+    for entry in sorted(entries):
+        if ':' in entry:
+            continue
+        path = os.path.join(devices_dir, entry)
+        if _read_attr(path, 'serial') != serial:
+            continue
+        busnum = _read_attr(path, 'busnum')
+        devnum = _read_attr(path, 'devnum')
+        if busnum and devnum:
+            return UsbDevice(busnum.zfill(3), devnum.zfill(3), _read_attr(path, 'idVendor'),
+                             _read_attr(path, 'idProduct'), _read_attr(path, 'manufacturer'),
+                             _read_attr(path, 'product'), serial, path)
+    return None
+
+
+def run_lsusb():
+    """Get USB device information using lsusb -v"""
+    import aio
+    output = aio.call(aio.lsusb())
+    if not output:
+        print("Error: lsusb command not found or failed")
+    return output
+
+
+def parse_lsusb_output(lsusb_output):
+    """
+    Parse `lsusb -v` output into UsbDevice records (fallback when sysfs is unavailable).
+    Names come from the device's iManufacturer/iProduct strings, as in sysfs; the
+    usb.ids names on the idVendor/idProduct lines are used only when it has none.
+    """
+    devices = []
+    current_device = None
+
+    def flush():
+        if current_device:
+            current_device.setdefault('bus', '')
+            current_device.setdefault('device', '')
+            devices.append(UsbDevice(
+                bus=current_device['bus'],
+                device=current_device['device'],
+                vendor_id=current_device.get('vendor_id', ''),
+                product_id=current_device.get('product_id', ''),
+                vendor_name=current_device.get('manufacturer', current_device.get('vendor_name', '')),
+                product_name=current_device.get('product', current_device.get('product_name', '')),
+                serial=current_device.get('serial'),
+                sysfs_path=None,
+            ))
+
+    for line in lsusb_output.split('\n'):
+        line = line.strip()
+
+        if line.startswith('Bus ') and 'Device ' in line:
+            flush()
+            current_device = {}
+            # Extract bus and device numbers
+            match = re.search(r'Bus (\d+) Device (\d+)', line)
+            if match:
+                current_device['bus'] = match.group(1).zfill(3)
+                current_device['device'] = match.group(2).zfill(3)
+
+        elif current_device is None:
+            continue
+
+        elif line.startswith('idVendor'):
+            match = re.search(r'idVendor\s+0x([0-9a-f]+)\s*(.*)', line)
+            if match:
+                current_device['vendor_id'] = match.group(1)
+                current_device['vendor_name'] = match.group(2).strip()
+
+        elif line.startswith('idProduct'):
+            match = re.search(r'idProduct\s+0x([0-9a-f]+)\s*(.*)', line)
+            if match:
+                current_device['product_id'] = match.group(1)
+                current_device['product_name'] = match.group(2).strip()
+
+        elif line.startswith(('iManufacturer', 'iProduct')):
+            match = re.search(r'i(Manufacturer|Product)\s+\d+\s+(.+)', line)
+            if match:
+                current_device[match.group(1).lower()] = match.group(2).strip()
+
+        elif line.startswith('iSerial'):
+            match = re.search(r'iSerial\s+\d+\s+(.+)', line)
+            if match:
+                current_device['serial'] = match.group(1).strip()
+
+    flush()
+    return devices
+
+
+# Snapshot handed over by the zmk daemon; serves the first /sys enumeration only
+_primed = None
+
+
+def prime(devices):
+    """Let the next list_usb_devices() call reuse an enumeration taken moments ago"""
+    global _primed
+    _primed = list(devices)
+
+
+def list_usb_devices(sysfs_root='/sys', keywords=None):
+    """List attached USB devices, from sysfs when possible and lsusb otherwise"""
+    global _primed
+    with span('usb.enumerate', source='sysfs') as s:
+        if _primed is not None and sysfs_root == '/sys':
+            s.set(source='daemon')
+            devices, _primed = _primed, None
+            if keywords is not None:
+                matcher = as_matcher(keywords)
+                devices = [d for d in devices if d.matches(matcher)]
+        else:
+            devices = enumerate_usb_devices(sysfs_root, keywords)
+        if devices is None:
+            s.set(source='lsusb')
+            devices = parse_lsusb_output(run_lsusb())
+            if keywords is not None:
+                matcher = as_matcher(keywords)
+                devices = [d for d in devices if d.matches(matcher)]
+        s.set(devices=len(devices))
+    return devices
+
+
+def list_bootloader_devices(sysfs_root='/sys'):
+    """List USB devices that look like they are in bootloader mode"""
+    return list_usb_devices(sysfs_root, BOOTLOADER_KEYWORDS)
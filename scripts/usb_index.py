@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+USB device index for ZMK tools
+One pass over the tty, hidraw and block classes in sysfs maps USB devices, by
+(bus, device number) and by serial, to the /dev nodes of their interfaces:
+CDC ACM/serial ttys (ZMK's USB logging port), hidraw nodes and disks. Each
+class directory is listed once, parent directories are resolved once and
+shared between siblings, and no uevent files are read.
+"""
+
+import os
+import sys
+from collections import namedtuple
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+from tracing import traced
+from usb_devices import UsbDevice
+
+# Constants
+CHILD_CLASSES = (('tty', ('class', 'tty')), ('hidraw', ('class', 'hidraw')), ('block', ('block',)))
+
+_index = None
+
+
+class UsbNode(namedtuple('UsbNode', 'device tty hidraw block')):
+    """A UsbDevice with the /dev paths of its tty, hidraw and block children (sorted tuples)"""
+
+    __slots__ = ()
+
+    def dev_paths(self):
+        """/dev/bus/usb/<bus>/<device> (if present) followed by the ttys, hidraw nodes and disks"""
+        usb_path = [self.device.usb_path] if os.path.exists(self.device.usb_path) else []
+        return usb_path + list(self.tty) + list(self.hidraw) + list(self.block)
+
+
+class UsbIndex:
+    """Attached USB devices and their /dev children, from one sysfs scan"""
+
+    def __init__(self, nodes=()):
+        self.nodes = list(nodes)
+        self.by_number = {(n.device.bus, n.device.device): n for n in self.nodes}
+        self.by_serial = {n.device.serial: n for n in self.nodes if n.device.serial}
+
+    def find(self, serial=None, bus=None, device=None):
+        """The node for a serial, or for a bus and device number (as strings, padded or not); None if absent"""
+        if serial is not None:
+            return self.by_serial.get(serial)
+        if bus is None or device is None:
+            return None
+        return self.by_number.get((str(bus).zfill(3), str(device).zfill(3)))
+
+
+def _read_attr(path, name):
+    try:
+        with open(os.path.join(path, name), 'r', errors='replace') as f:
+            return f.read().strip()
+    except OSError:
+        return ''
+
+
+def _usb_device_of(path, owners):
+    """
+    The USB device directory a sysfs path lies under, or None. owners caches
+    every directory already resolved, so siblings cost no extra stat calls.
+    """
+    visited = []
+    owner = None
+    while path and path != os.path.dirname(path):
+        if path in owners:
+            owner = owners[path]
+            break
+        visited.append(path)
+        if os.path.exists(os.path.join(path, 'idVendor')):
+            owner = path
+            break
+        path = os.path.dirname(path)
+    for directory in visited:
+        owners[directory] = owner
+    return owner
+
+
+def _read_usb_device(path):
+    busnum, devnum = _read_attr(path, 'busnum'), _read_attr(path, 'devnum')
+    if not busnum or not devnum:
+        return None
+    return UsbDevice(busnum.zfill(3), devnum.zfill(3), _read_attr(path, 'idVendor'), _read_attr(path, 'idProduct'),
+                     _read_attr(path, 'manufacturer'), _read_attr(path, 'product'),
+                     _read_attr(path, 'serial') or None, path)
+
+
+@traced('usb.index')
+def build_index(sysfs_root='/sys', dev_root='/dev'):
+    """
+    Scan the tty, hidraw and block classes once and return a UsbIndex of the
+    USB devices that own them. Only those devices' attributes are read;
+    devices without such children are not in the index.
+    """
+    owners = {}
+    children = {}
+    for kind, class_dir in CHILD_CLASSES:
+        directory = os.path.join(sysfs_root, *class_dir)
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            continue
+        for name in names:
+            # Only USB serial ttys; the many virtual ones (tty0..tty63, pts) are skipped unresolved
+            if kind == 'tty' and not name.startswith(('ttyACM', 'ttyUSB')):
+                continue
+            owner = _usb_device_of(os.path.realpath(os.path.join(directory, name)), owners)
+            if owner is not None:
+                found = children.setdefault(owner, {k: [] for k, _ in CHILD_CLASSES})
+                found[kind].append(os.path.join(dev_root, name))
+
+    nodes = []
+    for owner, found in children.items():
+        device = _read_usb_device(owner)
+        if device is not None:
+            nodes.append(UsbNode(device, *(tuple(sorted(found[kind])) for kind, _ in CHILD_CLASSES)))
+    return UsbIndex(nodes)
+
+
+def usb_index(refresh=False):
+    """The index of /sys for this process, built on first use"""
+    global _index
+    if _index is None or refresh:
+        _index = build_index()
+    return _index
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='List USB devices with their tty, hidraw and disk nodes')
+    parser.add_argument('--serial', '-s', help='Only the device with this serial number')
+    args = parser.parse_args()
+
+    index = usb_index()
+    nodes = [index.find(serial=args.serial)] if args.serial else index.nodes
+    nodes = [n for n in nodes if n is not None]
+    if not nodes:
+        print("No matching USB devices")
+        sys.exit(1)
+    for node in sorted(nodes, key=lambda n: (n.device.bus, n.device.device)):
+        d = node.device
+        children = ', '.join(node.tty + node.hidraw + node.block) or '-'
+        print(f"{d.bus}:{d.device} {d.vendor_id}:{d.product_id} {d.serial or '-':<20} "
+              f"{(d.vendor_name + ' ' + d.product_name).strip() or '-':<32} {children}")
+
+
+if __name__ == "__main__":
+    main()
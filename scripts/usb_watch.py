@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+Event-driven bootloader detection for ZMK flashing tools
+Listens for kernel uevents on a netlink socket (or falls back to inotify on
+/dev and /sys/block) and reports bootloader block devices as soon as they appear,
+instead of re-running lsusb/lsblk every half second.
+"""
+
+import os
+import select
+import socket
+import struct
+import threading
+import time
+from collections import namedtuple
+
+from tracing import traced
+
+# Constants
+MAX_BOOTLOADER_SIZE_MB = 64  # UF2 bootloaders expose a tiny FAT volume
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_KERNEL_GROUP = 1
+POLL_INTERVAL = 0.25  # Used only when neither netlink nor inotify is available
+SETTLE_INTERVAL = 0.05  # Re-check interval for disks that report size 0 right after "add"
+
+# inotify(7) flags
+IN_CLOSE_WRITE = 0x00000008
+IN_CREATE = 0x00000100
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+BootloaderDisk = namedtuple('BootloaderDisk', 'name path size_mb serial')
+
+
+def parse_uevent(data):
+    """Parse a raw kernel uevent message into a dict of its KEY=VALUE fields"""
+    if isinstance(data, bytes):
+        data = data.decode('utf-8', 'replace')
+
+    event = {}
+    for field in data.split('\0'):
+        if '=' in field:
+            key, value = field.split('=', 1)
+            event[key] = value
+        elif '@' in field and 'ACTION' not in event:
+            # Header line, e.g. "add@/devices/.../block/sdb"
+            action, devpath = field.split('@', 1)
+            event['ACTION'] = action
+            event['DEVPATH'] = devpath
+    return event
+
+
+def format_uevent(action, devpath, **fields):
+    """Build a raw kernel uevent message (used to replay recorded event streams)"""
+    parts = [f"{action}@{devpath}", f"ACTION={action}", f"DEVPATH={devpath}"]
+    parts.extend(f"{key}={value}" for key, value in fields.items())
+    return '\0'.join(parts).encode() + b'\0'
+
+
+def _read_sysfs(path, default=''):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+def find_usb_parent(sysfs_path):
+    """Walk up from a sysfs device path to the USB device that owns it"""
+    path = sysfs_path
+    while path and path != os.path.dirname(path):
+        if os.path.exists(os.path.join(path, 'idVendor')):
+            return path
+        path = os.path.dirname(path)
+    return None
+
+
+def read_bootloader_disk(name, sysfs_root='/sys', dev_root='/dev'):
+    """
+    Check whether /sys/block/<name> looks like a UF2 bootloader disk.
+    Returns a BootloaderDisk, or None if the device does not qualify.
+    """
+    block_path = os.path.join(sysfs_root, 'block', name)
+    if not os.path.exists(os.path.join(block_path, 'device')):
+        return None  # Virtual devices (loop, zram, dm-*) have no backing device
+
+    real_path = os.path.realpath(block_path)
+    usb_parent = find_usb_parent(real_path)
+    if not usb_parent:
+        return None
+
+    try:
+        sectors = int(_read_sysfs(os.path.join(block_path, 'size'), '0'))
+    except ValueError:
+        sectors = 0
+    size_mb = sectors * 512 / (1024 * 1024)
+    if size_mb <= 0 or size_mb > MAX_BOOTLOADER_SIZE_MB:
+        return None
+
+    serial = _read_sysfs(os.path.join(usb_parent, 'serial')) or None
+    return BootloaderDisk(name, os.path.join(dev_root, name), size_mb, serial)
+
+
+@traced('block.scan')
+def list_bootloader_disks(sysfs_root='/sys', dev_root='/dev'):
+    """List all bootloader disks currently present"""
+    try:
+        names = sorted(os.listdir(os.path.join(sysfs_root, 'block')))
+    except OSError:
+        return []
+
+    disks = []
+    for name in names:
+        disk = read_bootloader_disk(name, sysfs_root, dev_root)
+        if disk:
+            disks.append(disk)
+    return disks
+
+
+class NetlinkSource:
+    """Kernel uevents from a NETLINK_KOBJECT_UEVENT socket"""
+
+    name = 'netlink'
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW | socket.SOCK_NONBLOCK,
+                                  NETLINK_KOBJECT_UEVENT)
+        self.sock.bind((0, UEVENT_KERNEL_GROUP))
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def read_events(self):
+        events = []
+        while True:
+            try:
+                data = self.sock.recv(16384)
+            except BlockingIOError:
+                break
+            events.append(parse_uevent(data))
+        return events
+
+    def close(self):
+        self.sock.close()
+
+
+class InotifySource:
+    """
+    Block device creation seen through inotify on /dev and /sys/block (or,
+    with another mask, any file event in a set of directories; DEVNAME is the file name)
+    """
+
+    name = 'inotify'
+
+    def __init__(self, paths, mask=IN_CREATE | IN_MOVED_TO):
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        watched = 0
+        for path in paths:
+            if libc.inotify_add_watch(self.fd, os.fsencode(path), mask) >= 0:
+                watched += 1
+        if not watched:
+            os.close(self.fd)
+            raise OSError('no inotify watches could be added')
+
+    def fileno(self):
+        return self.fd
+
+    def read_events(self):
+        events = []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return events
+
+        offset = 0
+        while offset + 16 <= len(data):
+            _, mask, _, length = struct.unpack_from('iIII', data, offset)
+            name = data[offset + 16:offset + 16 + length].rstrip(b'\0').decode('utf-8', 'replace')
+            offset += 16 + length
+            if name:
+                events.append({'ACTION': 'add', 'SUBSYSTEM': 'block', 'DEVNAME': name})
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ReplaySource:
+    """
+    Replays a recorded uevent stream: a list of (delay_seconds, message) pairs.
+    Messages are raw uevent bytes or dicts; each is delivered through a pipe after
+    its delay so the watcher's select() loop behaves exactly as with a real socket.
+    An optional on_emit(message) hook runs just before delivery (e.g. to create
+    the matching fake sysfs entry).
+    """
+
+    name = 'replay'
+
+    def __init__(self, events, on_emit=None):
+        self.read_fd, self.write_fd = os.pipe()
+        os.set_blocking(self.read_fd, False)
+        self.pending = b''
+        self.emitted = []
+        self.thread = threading.Thread(target=self._run, args=(list(events), on_emit), daemon=True)
+        self.thread.start()
+
+    def _run(self, events, on_emit):
+        start = time.monotonic()
+        for delay, message in events:
+            wait = start + delay - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            if on_emit:
+                on_emit(message)
+            if isinstance(message, dict):
+                fields = {k: v for k, v in message.items() if k not in ('ACTION', 'DEVPATH')}
+                message = format_uevent(message.get('ACTION', 'add'), message.get('DEVPATH', ''), **fields)
+            self.emitted.append(time.monotonic())
+            try:
+                os.write(self.write_fd, struct.pack('I', len(message)) + message)
+            except OSError:
+                return
+
+    def fileno(self):
+        return self.read_fd
+
+    def read_events(self):
+        try:
+            self.pending += os.read(self.read_fd, 65536)
+        except BlockingIOError:
+            pass
+
+        events = []
+        while len(self.pending) >= 4:
+            (length,) = struct.unpack_from('I', self.pending)
+            if len(self.pending) < 4 + length:
+                break
+            events.append(parse_uevent(self.pending[4:4 + length]))
+            self.pending = self.pending[4 + length:]
+        return events
+
+    def close(self):
+        for fd in (self.read_fd, self.write_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+def open_event_source(sysfs_root='/sys', dev_root='/dev'):
+    """Open the best available event source: netlink, then inotify, else None (poll)"""
+    if sysfs_root == '/sys':
+        try:
+            return NetlinkSource()
+        except (OSError, AttributeError):
+            pass
+
+    try:
+        return InotifySource([dev_root, os.path.join(sysfs_root, 'block')])
+    except (OSError, AttributeError):
+        return None
+
+
+class BootloaderWatcher:
+    """
+    Reports bootloader disks as they appear.
+
+    Disks already present when the watcher starts are reported by the first call
+    to wait_for_devices(); after that only newly arrived disks are reported.
+    """
+
+    def __init__(self, sysfs_root='/sys', dev_root='/dev', source=None):
+        self.sysfs_root = sysfs_root
+        self.dev_root = dev_root
+        self.source = source if source is not None else open_event_source(sysfs_root, dev_root)
+        self.seen = set()
+        self.pending = set()  # Disks announced but not yet readable (size still 0)
+        self.primed = False
+
+    @property
+    def mode(self):
+        return self.source.name if self.source else 'poll'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.source:
+            self.source.close()
+            self.source = None
+
+    def _check(self, names):
+        found = []
+        for name in names:
+            if name in self.seen:
+                continue
+            disk = read_bootloader_disk(name, self.sysfs_root, self.dev_root)
+            if disk:
+                self.seen.add(name)
+                self.pending.discard(name)
+                found.append(disk)
+            elif os.path.exists(os.path.join(self.sysfs_root, 'block', name)):
+                self.pending.add(name)
+            else:
+                self.pending.discard(name)
+        return found
+
+    def _names_from_events(self, events):
+        names = []
+        for event in events:
+            if event.get('ACTION') not in ('add', 'change'):
+                if event.get('ACTION') == 'remove':
+                    name = event.get('DEVNAME', os.path.basename(event.get('DEVPATH', '')))
+                    self.seen.discard(name)
+                    self.pending.discard(name)
+                continue
+            if event.get('SUBSYSTEM', 'block') != 'block' or event.get('DEVTYPE', 'disk') != 'disk':
+                continue
+            name = event.get('DEVNAME') or os.path.basename(event.get('DEVPATH', ''))
+            if name:
+                names.append(os.path.basename(name))
+        return names
+
+    def wait_for_devices(self, timeout):
+        """
+        Block until at least one new bootloader disk appears or timeout expires.
+        Returns the list of newly found BootloaderDisk records (possibly empty).
+        """
+        if not self.primed:
+            self.primed = True
+            present = list_bootloader_disks(self.sysfs_root, self.dev_root)
+            for disk in present:
+                self.seen.add(disk.name)
+            if present:
+                return present
+
+        deadline = time.monotonic() + max(timeout, 0)
+        while True:
+            remaining = deadline - time.monotonic()
+            if self.pending:
+                found = self._check(list(self.pending))
+                if found:
+                    return found
+
+            if remaining <= 0:
+                return []
+
+            if self.source is None:
+                time.sleep(min(POLL_INTERVAL, remaining))
+                try:
+                    names = os.listdir(os.path.join(self.sysfs_root, 'block'))
+                except OSError:
+                    names = []
+                found = self._check(names)
+            else:
+                wait = min(SETTLE_INTERVAL, remaining) if self.pending else remaining
+                ready, _, _ = select.select([self.source], [], [], wait)
+                if not ready:
+                    continue
+                found = self._check(self._names_from_events(self.source.read_events()))
+
+            if found:
+                return found
+
+    def forget(self, name):
+        """Report this disk again on the next wait if it is still present (e.g. to retry a flash)"""
+        self.seen.discard(name)
+        self.pending.add(name)
+
+    def watch(self, duration):
+        """Yield bootloader disks as they appear, for up to `duration` seconds"""
+        deadline = time.monotonic() + duration
+        while True:
+            remaining = deadline - time.monotonic()
+            for disk in self.wait_for_devices(remaining):
+                yield disk
+            if deadline - time.monotonic() <= 0:
+                return
+
+
+def main():
+    import argparse
+    from tracing import add_profile_argument, setup_profile
+
+    parser = argparse.ArgumentParser(description='Watch for UF2 bootloader block devices')
+    parser.add_argument('--duration', '-d', type=float, default=30.0,
+                        help='How long to watch in seconds (default: 30)')
+    parser.add_argument('--sysfs-root', default='/sys', help='sysfs mount point (for testing)')
+    parser.add_argument('--dev-root', default='/dev', help='/dev directory (for testing)')
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    setup_profile(args)
+
+    with BootloaderWatcher(args.sysfs_root, args.dev_root) as watcher:
+        print(f"Watching for bootloader devices ({watcher.mode}) for {args.duration} seconds...")
+        start = time.monotonic()
+        for disk in watcher.watch(args.duration):
+            elapsed = time.monotonic() - start
+            print(f"[{elapsed:6.2f}s] {disk.path} ({disk.size_mb:.1f} MB, Serial: {disk.serial or 'none'})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Post-flash verification for ZMK tools
+Waits (on kernel uevents, with a timeout) for a flashed keyboard's serial to
+come back as a normal USB device instead of a bootloader, then compares its
+descriptors with the fingerprint recorded next to the UF2 when it was built.
+"""
+
+import hashlib
+import json
+import os
+import select
+import sys
+import time
+from collections import namedtuple
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from build_info import CONFIG_DIR, OUTPUT_NAME, decode as decode_build_info
+from tracing import span
+from usb_devices import BOOTLOADER_KEYWORDS, find_usb_device
+
+# Constants
+FINGERPRINT_SUFFIX = '.fingerprint.json'
+VERIFY_TIMEOUT = 15.0  # Seconds for a flashed keyboard to re-enumerate
+RECHECK_INTERVAL = 0.5  # Re-read sysfs this often even without uevents
+POLL_INTERVAL = 0.1  # Used only when there is no netlink socket
+BUILD_INFO = CONFIG_DIR / OUTPUT_NAME
+
+# Verification states
+VERIFIED = 'verified'  # Back on USB and matching the fingerprint
+ENUMERATED = 'enumerated'  # Back on USB, no fingerprint to compare
+NO_USB = 'no-usb'  # Firmware without USB (e.g. a split peripheral): nothing to wait for
+UNVERIFIABLE = 'unverifiable'  # No fingerprint and not seen while waiting for the others: may have no USB
+MISMATCH = 'mismatch'
+MISSING = 'missing'
+OK_STATES = {VERIFIED, ENUMERATED, NO_USB, UNVERIFIABLE}
+
+Fingerprint = namedtuple('Fingerprint', 'image_sha256 usb vendor_id product_id manufacturer product build_info')
+Verification = namedtuple('Verification', 'name serial state seconds device problems')
+
+def image_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_kconfig(path):
+    """CONFIG_* values from a build's zephyr/.config (strings unquoted)"""
+    values = {}
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                if line.startswith('CONFIG_') and '=' in line:
+                    key, value = line.rstrip('\n').split('=', 1)
+                    values[key] = value[1:-1] if value.startswith('"') and value.endswith('"') else value
+    except OSError:
+        pass
+    return values
+
+
+def read_build_info(path=BUILD_INFO):
+    """The message build_info.dtsi types (e.g. 'Built from commit abc1234 2024-...'), or None"""
+    try:
+        text = Path(path).read_text()
+    except OSError:
+        return None
+    return decode_build_info(text)
+
+
+def _usb_id(value):
+    try:
+        return f"{int(value, 0):04x}"
+    except (TypeError, ValueError):
+        return None
+
+
+def make_fingerprint(image, kconfig, build_info=None):
+    """Fingerprint of a built image from its Kconfig values"""
+    return Fingerprint(
+        image_sha256=image_digest(image),
+        usb=kconfig.get('CONFIG_USB_DEVICE_STACK') == 'y',
+        vendor_id=_usb_id(kconfig.get('CONFIG_USB_DEVICE_VID')),
+        product_id=_usb_id(kconfig.get('CONFIG_USB_DEVICE_PID')),
+        manufacturer=kconfig.get('CONFIG_USB_DEVICE_MANUFACTURER'),
+        product=kconfig.get('CONFIG_USB_DEVICE_PRODUCT') or kconfig.get('CONFIG_ZMK_KEYBOARD_NAME'),
+        build_info=build_info,
+    )
+
+
+def fingerprint_path(firmware_file):
+    firmware_file = Path(firmware_file)
+    return firmware_file.with_name(firmware_file.name + FINGERPRINT_SUFFIX)
+
+
+def write_fingerprint(firmware_file, build_dir, build_info_path=BUILD_INFO):
+    """Record the fingerprint of a freshly built image next to it. Returns the Fingerprint."""
+    fingerprint = make_fingerprint(firmware_file, read_kconfig(Path(build_dir) / 'zephyr' / '.config'),
+                                   read_build_info(build_info_path))
+    path = fingerprint_path(firmware_file)
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(fingerprint._asdict(), f, indent=1)
+    os.replace(tmp, path)
+    return fingerprint
+
+
+def load_fingerprint(firmware_file):
+    """The fingerprint recorded for this exact image, or None (missing, or left over from another build)"""
+    try:
+        with open(fingerprint_path(firmware_file), 'r') as f:
+            data = json.load(f)
+        fingerprint = Fingerprint(**{field: data.get(field) for field in Fingerprint._fields})
+    except (OSError, ValueError, TypeError):
+        return None
+    return fingerprint if fingerprint.image_sha256 == image_digest(firmware_file) else None
+
+
+def compare(fingerprint, device):
+    """Differences between what the image should enumerate as and the attached device"""
+    problems = []
+    expected = [('vendor ID', fingerprint.vendor_id, device.vendor_id.lower()),
+                ('product ID', fingerprint.product_id, device.product_id.lower()),
+                ('manufacturer', fingerprint.manufacturer, device.vendor_name),
+                ('product', fingerprint.product, device.product_name)]
+    for label, want, got in expected:
+        if want and want != got:
+            problems.append(f"{label} is {got or 'empty'!r}, expected {want!r}")
+    return problems
+
+
+def open_usb_event_source(sysfs_root='/sys'):
+    """A netlink uevent socket for the real /sys, else None (poll)"""
+    if sysfs_root != '/sys':
+        return None
+    from usb_watch import NetlinkSource
+    try:
+        return NetlinkSource()
+    except (OSError, AttributeError):
+        return None
+
+
+def running_application(serial, sysfs_root='/sys'):
+    """The device with this serial if it is attached and not a bootloader, else None"""
+    device = find_usb_device(serial, sysfs_root)
+    if device is None or device.matches(BOOTLOADER_KEYWORDS):
+        return None
+    return device
+
+
+def wait_for_applications(serials, timeout=VERIFY_TIMEOUT, sysfs_root='/sys', source=None, optional=()):
+    """
+    Wait for each serial to re-enumerate as a normal USB device. Every uevent
+    triggers a re-check; sysfs is also re-read every RECHECK_INTERVAL.
+    Optional serials are looked for too, but never waited on once the others are back.
+    Returns {serial: (UsbDevice, seconds)} for the ones that came back.
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    remaining = set(serials) | set(optional)
+    required = set(serials)
+    found = {}
+    owns_source = source is None
+    if owns_source:
+        source = open_usb_event_source(sysfs_root)
+    try:
+        while remaining:
+            for serial in sorted(remaining):
+                device = running_application(serial, sysfs_root)
+                if device is not None:
+                    found[serial] = (device, time.monotonic() - start)
+                    remaining.discard(serial)
+            left = deadline - time.monotonic()
+            if not remaining & required or left <= 0:
+                break
+            if source is None:
+                time.sleep(min(left, POLL_INTERVAL))
+                continue
+            ready, _, _ = select.select([source], [], [], min(left, RECHECK_INTERVAL))
+            if ready:
+                source.read_events()
+    finally:
+        if owns_source and source is not None:
+            source.close()
+    return found
+
+
+def verify_flashed(items, timeout=VERIFY_TIMEOUT, sysfs_root='/sys', source=None):
+    """
+    Confirm that flashed devices came back running their new firmware.
+    items are (name, serial, firmware_file); returns Verifications in the same order.
+    An image without a fingerprint (e.g. downloaded from CI) may be a split half
+    with no USB, so it is only checked for while waiting on the fingerprinted ones.
+    """
+    with span('verify', devices=len(items)) as s:
+        fingerprints = {serial: load_fingerprint(firmware_file) for _, serial, firmware_file in items}
+        waiting = [serial for serial, fp in fingerprints.items() if fp is not None and fp.usb]
+        unknown = [serial for serial, fp in fingerprints.items() if fp is None]
+        found = wait_for_applications(waiting, timeout, sysfs_root, source, unknown) if waiting or unknown else {}
+
+        results = []
+        for name, serial, _ in items:
+            fingerprint = fingerprints[serial]
+            if serial in unknown and serial not in found:
+                results.append(Verification(name, serial, UNVERIFIABLE, 0.0, None, []))
+            elif serial not in waiting and serial not in unknown:
+                results.append(Verification(name, serial, NO_USB, 0.0, None, []))
+            elif serial not in found:
+                results.append(Verification(name, serial, MISSING, timeout, None,
+                                            [f"serial {serial} did not re-enumerate within {timeout:.0f}s"]))
+            else:
+                device, seconds = found[serial]
+                problems = compare(fingerprint, device) if fingerprint else []
+                state = MISMATCH if problems else VERIFIED if fingerprint else ENUMERATED
+                results.append(Verification(name, serial, state, seconds, device, problems))
+        s.set(ok=sum(1 for r in results if r.state in OK_STATES))
+    return results
+
+
+def print_verification(results):
+    """Print one line per device and return the number that passed"""
+    icons = {VERIFIED: '✅', ENUMERATED: '☑️ ', NO_USB: '➖', UNVERIFIABLE: '➖', MISMATCH: '❌', MISSING: '⏳'}
+    notes = {VERIFIED: 'running the flashed build', ENUMERATED: 'back on USB (no fingerprint to compare)',
+             NO_USB: 'firmware has no USB, not checked',
+             UNVERIFIABLE: 'no fingerprint and not back on USB, not checked',
+             MISMATCH: 'wrong firmware', MISSING: 'not seen'}
+    for r in results:
+        seconds = f" after {r.seconds:.2f}s" if r.device is not None else ''
+        print(f"{icons[r.state]} {r.name}: {notes[r.state]}{seconds}")
+        for problem in r.problems:
+            print(f"     {problem}")
+    return sum(1 for r in results if r.state in OK_STATES)
+
+
+def main():
+    import argparse
+    from device_registry import load_registry
+    from tracing import add_profile_argument, setup_profile
+
+    parser = argparse.ArgumentParser(description='Check that keyboards run the firmware built for them')
+    parser.add_argument('devices', nargs='*', help='Device names (default: every keyboard with a known side)')
+    parser.add_argument('--firmware-dir', '-f', default=str(Path(__file__).resolve().parent.parent / 'firmware'),
+                        help='Directory containing firmware files')
+    parser.add_argument('--timeout', '-t', type=float, default=0.0,
+                        help='Wait this long for devices that are not attached yet (default: 0)')
+    parser.add_argument('--show', action='store_true', help='Print the recorded fingerprints and stop')
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    setup_profile(args)
+
+    if args.show:
+        for path in sorted(Path(args.firmware_dir).glob('*.uf2')):
+            fingerprint = load_fingerprint(path)
+            if fingerprint is None:
+                print(f"{path.name}: no fingerprint")
+                continue
+            usb = f"{fingerprint.vendor_id}:{fingerprint.product_id} {fingerprint.product!r}" if fingerprint.usb else 'no USB'
+            print(f"{path.name}: {usb}, sha256 {fingerprint.image_sha256[:12]}"
+                  + (f", {fingerprint.build_info}" if fingerprint.build_info else ''))
+        return
+
+    from auto_flash_functions import load_script
+    find_firmware_file = load_script('auto-flash').find_firmware_file
+    wanted = {name.lower() for name in args.devices}
+    items = []
+    for device in load_registry().values():
+        if wanted and device.name.lower() not in wanted or device.side not in ('left', 'right'):
+            continue
+        firmware_file = find_firmware_file(device.name, device.side, Path(args.firmware_dir))
+        if firmware_file:
+            items.append((device.name, device.serial, firmware_file))
+    if not items:
+        print("No matching devices with firmware to compare against")
+        sys.exit(1)
+
+    results = verify_flashed(items, args.timeout)
+    if print_verification(results) < len(results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
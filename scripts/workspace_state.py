@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+Cached workspace checks for ZMK builds
+The west and upstream checks that run before every build are keyed on a
+fingerprint read straight from the files on disk: config/west.yml, the
+revision each west project has checked out, and the main, upstream/main and
+upstream-sync-* refs. While the fingerprint is unchanged and the TTL has not
+expired a check is skipped. `git fetch upstream` runs in a detached background
+process, so the build prints the last known upstream report instead of waiting
+on the network. Offline mode (--offline or ZMK_OFFLINE=1) never fetches or runs
+west update.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+from tracing import add_profile_argument, setup_profile, span
+
+# Constants
+REPO_ROOT = Path(__file__).resolve().parent.parent
+STATE_PATH = REPO_ROOT / '.build' / 'workspace-state.json'
+FETCH_LOCK = REPO_ROOT / '.build' / 'upstream-fetch.lock'
+DEFAULT_TTL = float(os.environ.get('ZMK_STATE_TTL', 6 * 3600))  # Seconds a passed check stays valid
+FETCH_TIMEOUT = 60.0
+GIT_TIMEOUT = 10.0
+SYNC_TAG_PREFIX = 'upstream-sync-'
+REPORT_LIMIT = 10  # New upstream commits shown before "... and N more"
+WEST_UPDATE = ['west', 'update', '--fetch-opt=--filter=blob:none']
+
+
+def offline_requested():
+    return os.environ.get('ZMK_OFFLINE', '') not in ('', '0')
+
+
+def _digest(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else json.dumps(part, sort_keys=True).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()[:16]
+
+
+def _read_bytes(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return b''
+
+
+def git_dir(repo):
+    """The .git directory of a checkout (following a `gitdir:` file), or None"""
+    dot_git = Path(repo) / '.git'
+    if dot_git.is_file():
+        text = _read_bytes(dot_git).decode(errors='replace').strip()
+        if text.startswith('gitdir:'):
+            return (Path(repo) / text[len('gitdir:'):].strip()).resolve()
+        return None
+    return dot_git if dot_git.is_dir() else None
+
+
+def read_refs(gitdir, prefix):
+    """{ref name: object id} for the refs under a prefix (loose and packed), without running git"""
+    refs = {}
+    for line in _read_bytes(Path(gitdir) / 'packed-refs').decode(errors='replace').splitlines():
+        fields = line.split(' ', 1)
+        if len(fields) == 2 and fields[1].startswith(prefix) and not line.startswith(('#', '^')):
+            refs[fields[1]] = fields[0]
+    # Loose refs override packed ones
+    base = Path(gitdir) / prefix
+    search = base.parent if not prefix.endswith('/') else base
+    if search.is_dir():
+        for path in search.rglob('*'):
+            name = path.relative_to(gitdir).as_posix()
+            if path.is_file() and name.startswith(prefix):
+                refs[name] = _read_bytes(path).decode(errors='replace').strip()
+    return refs
+
+
+def resolve_ref(gitdir, ref):
+    """Object id of a ref name or of HEAD, or None"""
+    for _ in range(5):  # Symbolic refs nest at most a level or two
+        if ref == 'HEAD':
+            value = _read_bytes(Path(gitdir) / 'HEAD').decode(errors='replace').strip()
+        else:
+            value = read_refs(gitdir, ref).get(ref)
+        if not value:
+            return None
+        if not value.startswith('ref:'):
+            return value
+        ref = value[len('ref:'):].strip()
+    return None
+
+
+def west_projects(manifest_path=REPO_ROOT / 'config' / 'west.yml'):
+    """[(name, path)] of the projects listed directly in west.yml"""
+    import yaml
+
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = (yaml.safe_load(f) or {}).get('manifest') or {}
+    except (OSError, yaml.YAMLError):
+        return []
+    return [(p['name'], p.get('path') or p['name']) for p in manifest.get('projects') or [] if p.get('name')]
+
+
+def west_fingerprint(root=REPO_ROOT):
+    """west.yml, the manifests it imports, and each project's checked-out and manifest revision"""
+    projects = []
+    imported = []
+    for name, path in west_projects(root / 'config' / 'west.yml'):
+        gitdir = git_dir(root / path)
+        head = resolve_ref(gitdir, 'HEAD') if gitdir else None
+        manifest_rev = resolve_ref(gitdir, 'refs/heads/manifest-rev') if gitdir else None
+        projects.append([name, path, head, manifest_rev])
+        if name == 'zmk':
+            imported.append(_read_bytes(root / path / 'app' / 'west.yml'))
+    return _digest(_read_bytes(root / 'config' / 'west.yml'), *imported, projects), projects
+
+
+def upstream_fingerprint(root=REPO_ROOT):
+    """The refs the upstream report is computed from"""
+    gitdir = git_dir(root)
+    if gitdir is None:
+        return _digest([]), {}
+    refs = {name: sha for name, sha in read_refs(gitdir, 'refs/tags/' + SYNC_TAG_PREFIX).items()}
+    for ref in ('refs/heads/main', 'refs/remotes/upstream/main'):
+        refs[ref] = resolve_ref(gitdir, ref)
+    return _digest(refs), refs
+
+
+def load_state(path=None):
+    try:
+        with open(path or STATE_PATH, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_entry(key, entry, path=None):
+    """Store one check's entry, re-reading the file so a background fetch's update is not lost"""
+    path = path or STATE_PATH
+    state = load_state(path)
+    state[key] = entry
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(path).with_name(Path(path).name + f".{os.getpid()}.tmp")
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp, path)
+
+
+def is_fresh(entry, fingerprint, ttl, now=None):
+    now = time.time() if now is None else now
+    return bool(entry) and entry.get('fingerprint') == fingerprint and now - entry.get('checked_at', 0) < ttl
+
+
+def git(*args, root=REPO_ROOT, timeout=GIT_TIMEOUT):
+    """stdout of a git command, or None if it failed"""
+    import aio
+
+    result = aio.call(aio.run(['git', '-C', str(root), *args], timeout))
+    return result.stdout if result.returncode == 0 else None
+
+
+def _version_key(name):
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+
+def upstream_report(refs, root=REPO_ROOT):
+    """{'tag': latest sync tag, 'commits': upstream commits not yet integrated ('date sha subject')}"""
+    tags = sorted((ref[len('refs/tags/'):] for ref in refs if ref.startswith('refs/tags/')), key=_version_key)
+    if not tags:
+        return {'tag': None, 'commits': []}
+    latest = tags[-1]
+    # The tag message lists integrated commits as local_sha->upstream_sha
+    message = git('for-each-ref', '--format=%(contents)', f"refs/tags/{latest}", root=root) or ''
+    integrated = set(re.findall(r'[a-f0-9]{7,}->([a-f0-9]{7,})', message))
+    if not refs.get('refs/remotes/upstream/main'):
+        return {'tag': latest, 'commits': []}
+
+    merge_base = (git('merge-base', 'main', 'upstream/main', root=root) or '').strip()
+    log_range = ['upstream/main', f"^{merge_base}"] if merge_base else ['upstream/main', '-20']
+    log = git('log', '--pretty=format:%ad %h %s', '--date=short', *log_range, root=root) or ''
+    commits = [line for line in log.splitlines()
+               if line and not any(line.split(' ', 2)[1].startswith(sha) or sha.startswith(line.split(' ', 2)[1])
+                                   for sha in integrated)]
+    return {'tag': latest, 'commits': commits}
+
+
+def print_upstream(report, age=None):
+    if report.get('tag') is None:
+        print("⚠️  No upstream-sync tags found. Run 'just upstream-status' to see all upstream commits.")
+        return
+    checked = f" (fetched {age / 60:.0f} min ago)" if age is not None else ''
+    commits = report.get('commits') or []
+    if not commits:
+        print(f"✅ Up to date with upstream since {report['tag']}{checked}")
+        return
+    print(f"🆕 New upstream commits since {report['tag']}{checked}:")
+    for line in commits[:REPORT_LIMIT]:
+        print(f"   {line}")
+    if len(commits) > REPORT_LIMIT:
+        print(f"   ... and {len(commits) - REPORT_LIMIT} more")
+    print("💡 Run 'just upstream-status' for details or 'git cherry-pick <commit>' to integrate")
+
+
+def fetch_upstream(root=REPO_ROOT, lock_path=None, timeout=FETCH_TIMEOUT):
+    """
+    git fetch upstream, then store a fresh report. Returns False without doing
+    anything if another fetch holds the lock.
+    """
+    import aio
+
+    lock_path = lock_path or FETCH_LOCK
+    Path(lock_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        with span('workspace.fetch'):
+            result = aio.call(aio.run(['git', '-C', str(root), 'fetch', 'upstream', '--quiet'], timeout))
+        fingerprint, refs = upstream_fingerprint(root)
+        # fetched_at is the attempt, so an unreachable remote is retried once per TTL, not every build
+        save_entry('upstream', {'fingerprint': fingerprint, 'checked_at': time.time(), 'fetched_at': time.time(),
+                                'fetch_error': (result.stderr.strip() or 'git fetch failed')
+                                if result.returncode != 0 else None,
+                                'report': upstream_report(refs, root)})
+        return True
+
+
+def start_background_fetch():
+    """Run fetch_upstream in a detached process that outlives this one"""
+    subprocess.Popen([sys.executable, os.path.abspath(__file__), 'upstream', '--fetch-only'],
+                     cwd=REPO_ROOT, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL, start_new_session=True)
+
+
+def check_upstream(ttl=DEFAULT_TTL, offline=False, wait=False, root=REPO_ROOT):
+    """
+    Print the upstream report. It is recomputed locally only when the refs
+    changed; a fetch starts in the background when the last one is older
+    than the TTL (or runs in the foreground with wait=True).
+    """
+    if wait and not offline:
+        print("📡 Fetching upstream...")
+        fetch_upstream(root)
+    entry = load_state().get('upstream') or {}
+    fingerprint, refs = upstream_fingerprint(root)
+    if entry.get('fingerprint') != fingerprint or 'report' not in entry:
+        with span('workspace.upstream_report'):
+            entry = dict(entry, fingerprint=fingerprint, checked_at=time.time(),
+                         report=upstream_report(refs, root))
+        save_entry('upstream', entry)
+
+    fetched_at = entry.get('fetched_at')
+    print_upstream(entry['report'], time.time() - fetched_at if fetched_at and not entry.get('fetch_error') else None)
+    if offline:
+        return
+    if entry.get('fetch_error'):
+        print(f"📡 Last upstream fetch failed: {entry['fetch_error'].splitlines()[-1]}")
+    if not wait and (fetched_at is None or time.time() - fetched_at >= ttl):
+        start_background_fetch()
+        print("📡 Fetching upstream in the background; the next build reports the result")
+
+
+def projects_needing_update(projects, root=REPO_ROOT):
+    """Names of projects that are missing or not checked out at their manifest revision"""
+    stale = []
+    for name, path, head, manifest_rev in projects:
+        if not (root / path).is_dir() or head is None or (manifest_rev is not None and head != manifest_rev):
+            stale.append(name)
+    return stale
+
+
+def check_west(ttl=DEFAULT_TTL, offline=False, root=REPO_ROOT):
+    """Run west update if the workspace does not match west.yml. Returns False if it is needed but failed."""
+    entry = load_state().get('west')
+    fingerprint, projects = west_fingerprint(root)
+    if is_fresh(entry, fingerprint, ttl):
+        return True
+
+    stale = projects_needing_update(projects, root)
+    if not stale and entry and entry.get('manifest') != _digest(_read_bytes(root / 'config' / 'west.yml')):
+        stale = ['west.yml changed']
+    if stale:
+        if offline:
+            print(f"⚠️  West workspace needs an update ({', '.join(stale)}), skipped offline")
+            return True
+        print(f"Running west update ({', '.join(stale)})...")
+        try:
+            with span('workspace.west_update'):
+                if subprocess.run(WEST_UPDATE, cwd=root).returncode != 0:
+                    return False
+        except FileNotFoundError:
+            print("❌ 'west' command not found. Run 'just init' in the build environment first.")
+            return False
+        fingerprint, projects = west_fingerprint(root)
+    save_entry('west', {'fingerprint': fingerprint, 'checked_at': time.time(),
+                        'manifest': _digest(_read_bytes(root / 'config' / 'west.yml'))})
+    return True
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Cached west and upstream checks for builds')
+    parser.add_argument('check', choices=['west', 'upstream', 'status'], help='Check to run, or show the cache')
+    parser.add_argument('--ttl', type=float, default=DEFAULT_TTL,
+                        help=f'Seconds a passed check stays valid (default: {DEFAULT_TTL:.0f}, or $ZMK_STATE_TTL)')
+    parser.add_argument('--offline', action='store_true', default=offline_requested(),
+                        help='Never fetch or run west update (also: ZMK_OFFLINE=1)')
+    parser.add_argument('--wait', action='store_true', help='Fetch upstream in the foreground')
+    parser.add_argument('--fetch-only', action='store_true', help=argparse.SUPPRESS)
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    setup_profile(args)
+
+    if args.check == 'west':
+        sys.exit(0 if check_west(args.ttl, args.offline) else 1)
+    if args.check == 'upstream':
+        if args.fetch_only:
+            fetch_upstream()
+        else:
+            check_upstream(args.ttl, args.offline, args.wait)
+        return
+
+    with span('workspace.status'):
+        state = load_state()
+        fingerprints = (('west', west_fingerprint()[0]), ('upstream', upstream_fingerprint()[0]))
+    now = time.time()
+    for key, fingerprint in fingerprints:
+        entry = state.get(key)
+        if not entry:
+            print(f"{key:<9} never checked")
+            continue
+        valid = 'valid' if is_fresh(entry, fingerprint, args.ttl, now) else 'stale'
+        print(f"{key:<9} {valid}, checked {(now - entry['checked_at']) / 60:.0f} min ago"
+              + (f", fetched {(now - entry['fetched_at']) / 60:.0f} min ago" if entry.get('fetched_at') else ''))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Resident ZMK daemon
+Keeps the heavy imports, the device registry and a USB snapshot warm and
+serves `zmk` commands over a Unix socket. Each request is forked from this
+process with the client's stdin/stdout/stderr, so a hotkey-triggered flash or
+build starts in milliseconds instead of re-importing and re-enumerating.
+
+The daemon is single-threaded: one select() loop accepts requests, follows USB
+uevents, forwards the clients' signals and reaps the commands (through pidfds),
+so every fork happens in a process with no other threads whose locks a child
+could inherit held.
+"""
+
+import json
+import os
+import select
+import signal
+import socket
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+# Constants
+SCRIPTS_DIR = Path(__file__).resolve().parent
+REAP_INTERVAL = 0.1  # How often children are reaped when pidfds are not available
+REQUEST_TIMEOUT = 1.0  # Seconds a client has to send its request line before it is dropped
+
+# Imported once in the daemon so forked commands find them in sys.modules
+PRELOAD = [
+    'argparse', 'glob', 'hashlib', 'pickle', 'shlex', 'subprocess', 'tempfile', 'concurrent.futures',
+    'yaml', 'device_registry', 'usb_devices', 'usb_watch', 'flasher', 'auto_flash_functions',
+    'build_cache', 'build_scheduler', 'keymap_model', 'tracing',
+]
+
+
+def load_cli():
+    """The `zmk` dispatcher as a module (the script has no .py suffix)"""
+    import importlib.util
+    from importlib.machinery import SourceFileLoader
+
+    loader = SourceFileLoader('zmk_cli', str(SCRIPTS_DIR / 'zmk'))
+    spec = importlib.util.spec_from_loader('zmk_cli', loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+
+class WarmState:
+    """
+    Device registry and USB snapshot kept current between requests.
+    USB uevents (read from `source` by the daemon's loop) mark the snapshot
+    stale; without netlink it is re-read per request.
+    """
+
+    def __init__(self):
+        import device_registry
+        import usb_devices
+
+        self.device_registry = device_registry
+        self.usb_devices = usb_devices
+        self.registry = None
+        self.usb = []
+        self.usb_taken = 0.0
+        self.stale = True
+        self.source = None
+        self.served = 0
+        self.started = time.time()
+
+    @property
+    def events(self):
+        return self.source is not None
+
+    def watch(self):
+        """Open the uevent socket the daemon's loop reads (stays None without netlink)"""
+        from usb_watch import NetlinkSource
+
+        try:
+            self.source = NetlinkSource()
+        except (OSError, AttributeError):
+            self.source = None
+
+    def read_events(self):
+        """Mark the USB snapshot stale if any of the pending uevents is a USB one"""
+        if any(e.get('SUBSYSTEM') == 'usb' for e in self.source.read_events()):
+            self.stale = True
+
+    def refresh(self):
+        # load_registry() only stats the config file when it is unchanged
+        self.registry = self.device_registry.load_registry(quiet=True)
+        if self.stale or not self.events:
+            self.stale = False
+            self.usb = self.usb_devices.list_usb_devices()
+            self.usb_taken = time.time()
+        if 'aio' in sys.modules:
+            sys.modules['aio'].stop_loop()  # The lsusb fallback runs on aio's loop thread
+
+    def status(self):
+        return {
+            'pid': os.getpid(),
+            'uptime': round(time.time() - self.started, 1),
+            'served': self.served,
+            'devices': len(self.registry or ()),
+            'usb_devices': len(self.usb),
+            'usb_age': f"{time.time() - self.usb_taken:.1f} s",
+            'usb_events': 'netlink' if self.events else 'none (re-read per request)',
+            'threads': len(os.listdir('/proc/self/task')) if os.path.isdir('/proc/self/task') else None,
+        }
+
+
+def read_request(conn):
+    """
+    One JSON request line plus any file descriptors passed with it.
+    Raises OSError if the client stalls past REQUEST_TIMEOUT, ValueError on a malformed
+    request; either way any received fds are closed.
+    """
+    data, fds = b'', []
+    conn.settimeout(REQUEST_TIMEOUT)
+    try:
+        while not data.endswith(b'\n'):
+            chunk, received, _, _ = socket.recv_fds(conn, 65536, 3)
+            fds += received
+            if not chunk:
+                break
+            data += chunk
+        request = json.loads(data or b'{}')
+    except (OSError, ValueError):
+        for fd in fds:
+            os.close(fd)
+        raise
+    conn.settimeout(None)
+    return request, fds
+
+
+def run_child(cli, request, fds, state):
+    """In the forked child: take over the client's stdio and run the command. Never returns."""
+    status = 1
+    try:
+        for target, fd in enumerate(fds[:3]):
+            os.dup2(fd, target)
+        for fd in fds:
+            os.close(fd)
+        for signum in (signal.SIGTERM, signal.SIGHUP):
+            signal.signal(signum, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+        sys.stdin = open(0, 'r', closefd=False)
+        sys.stdout = open(1, 'w', buffering=1 if os.isatty(1) else -1, closefd=False)
+        sys.stderr = open(2, 'w', buffering=1, closefd=False)
+        os.environ.clear()
+        os.environ.update(request.get('env') or {})
+        os.chdir(request.get('cwd') or '/')
+        tracing = sys.modules.get('tracing')
+        if tracing:
+            tracing.configure()  # The client's ZMK_TRACE, not the daemon's
+
+        state.usb_devices.prime(state.usb)
+        status = cli.run_local(request['command'], request.get('argv') or [])
+    except KeyboardInterrupt:
+        status = 130
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+    finally:
+        # A late Ctrl-C must not unwind into the daemon's accept loop
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGINT, signal.SIGTERM, signal.SIGHUP})
+        try:
+            if 'tracing' in sys.modules:
+                sys.modules['tracing'].finish()  # os._exit skips atexit
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(status if isinstance(status, int) else 1)
+
+
+class Command:
+    """A forked command: the client connection it answers to and a pidfd to reap it by"""
+
+    def __init__(self, conn, pid):
+        self.conn = conn
+        self.pid = pid
+        self.client_gone = False
+        try:
+            self.pidfd = os.pidfd_open(pid)
+        except (AttributeError, OSError):
+            self.pidfd = None  # Reaped by polling instead
+
+    def forward(self):
+        """Pass the signal numbers the client sent on to the command"""
+        try:
+            data = self.conn.recv(64)
+        except OSError:
+            data = b''
+        if not data:
+            self.client_gone = True
+            self.kill(signal.SIGTERM)
+            return
+        for line in data.decode(errors='replace').split():
+            try:
+                self.kill(int(line))
+            except ValueError:
+                pass
+
+    def kill(self, signum):
+        try:
+            os.kill(self.pid, signum)
+        except OSError:
+            pass
+
+    def reap(self, block=False):
+        """Report the exit status to the client once the command has exited; True when it has"""
+        pid, raw = os.waitpid(self.pid, 0 if block else os.WNOHANG)
+        if pid == 0:
+            return False
+        status = os.waitstatus_to_exitcode(raw)
+        try:
+            self.conn.sendall(json.dumps({'status': status if status >= 0 else 128 - status}).encode() + b'\n')
+        except OSError:
+            pass
+        self.conn.close()
+        if self.pidfd is not None:
+            os.close(self.pidfd)
+        return True
+
+
+def start_command(server, conn, cli, request, fds, state, running):
+    """Fork a command for a request; the daemon has no other threads, so the child inherits no held locks"""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            # Only the client's stdio is the command's: drop the daemon's sockets and the other commands'
+            for sock in [server, conn, state.source] + [c.conn for c in running]:
+                if sock is not None:
+                    sock.close()
+            for command in running:
+                if command.pidfd is not None:
+                    os.close(command.pidfd)
+            run_child(cli, request, fds, state)
+        finally:
+            os._exit(1)
+    for fd in fds:
+        os.close(fd)
+    return Command(conn, pid)
+
+
+def answer(conn, cli, state):
+    """Read one request and either answer it or return (request, fds) for a command to fork"""
+    try:
+        request, fds = read_request(conn)
+    except (OSError, ValueError):
+        conn.close()
+        return None
+
+    state.refresh()
+    if request.get('query') == 'status':
+        conn.sendall(json.dumps(state.status()).encode() + b'\n')
+        conn.close()
+        return None
+    command = request.get('command')
+    if command not in cli.COMMANDS or command in cli.LOCAL_ONLY or len(fds) < 3:
+        conn.sendall(b'{"status": 2}\n')
+        conn.close()
+        for fd in fds:
+            os.close(fd)
+        return None
+    return request, fds
+
+
+def serve(path, verbose=False):
+    cli = load_cli()
+    for name in PRELOAD:
+        try:
+            __import__(name)
+        except ImportError:
+            pass
+
+    state = WarmState()
+    state.watch()
+    state.refresh()
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(old_umask)
+    server.listen(16)
+    print(f"🟢 zmk daemon listening on {path} (pid {os.getpid()}, {len(state.registry)} devices, "
+          f"{len(state.usb)} USB devices, events: {'netlink' if state.events else 'none'})")
+
+    commands = []
+    try:
+        while True:
+            watched = [server] + ([state.source] if state.source else [])
+            watched += [c.conn for c in commands if not c.client_gone]
+            watched += [c.pidfd for c in commands if c.pidfd is not None]
+            polling = any(c.pidfd is None for c in commands)
+            ready, _, _ = select.select(watched, [], [], REAP_INTERVAL if polling else None)
+
+            if state.source in ready:
+                state.read_events()
+            for command in list(commands):
+                if command.conn in ready and not command.client_gone:
+                    command.forward()
+                if (command.pidfd is None or command.pidfd in ready) and command.reap():
+                    commands.remove(command)
+            if server in ready:
+                conn, _ = server.accept()
+                pending = answer(conn, cli, state)
+                if pending is not None:
+                    request, fds = pending
+                    state.served += 1
+                    if verbose:
+                        print(f"▶️  zmk {request['command']} {' '.join(request.get('argv') or [])}")
+                    commands.append(start_command(server, conn, cli, request, fds, state, commands))
+    except KeyboardInterrupt:
+        print("\n🛑 zmk daemon stopped")
+    finally:
+        server.close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def query_status(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        sock.sendall(b'{"query": "status"}\n')
+        reply = b''
+        while not reply.endswith(b'\n'):
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            reply += chunk
+        return json.loads(reply)
+    except (OSError, ValueError):
+        return None
+    finally:
+        sock.close()
+
+
+def main():
+    import argparse
+
+    cli = load_cli()
+    parser = argparse.ArgumentParser(description='Serve zmk commands from a warm resident process')
+    parser.add_argument('--socket', default=cli.socket_path(),
+                        help=f'Unix socket to listen on (default: {cli.socket_path()})')
+    parser.add_argument('--status', action='store_true', help='Show the running daemon and exit')
+    parser.add_argument('--verbose', '-v', action='store_true', help='Log each command served')
+    args = parser.parse_args()
+
+    running = query_status(args.socket) if os.path.exists(args.socket) else None
+    if args.status:
+        if not running:
+            print(f"⚪ No zmk daemon on {args.socket}")
+            sys.exit(1)
+        for key, value in running.items():
+            print(f"  {key:<12} {value}")
+        return
+
+    if running:
+        print(f"❌ A zmk daemon is already running (pid {running['pid']}) on {args.socket}")
+        sys.exit(1)
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)  # Left behind by a daemon that did not exit cleanly
+    serve(args.socket, args.verbose)
+
+
+if __name__ == "__main__":
+    main()